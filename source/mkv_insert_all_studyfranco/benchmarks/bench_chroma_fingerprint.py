@@ -0,0 +1,56 @@
+'''
+Speed of the NumPy chroma fingerprints and, when fpcalc is installed, their agreement with fpcalc.
+The agreement is the ratio of equal bits at the best alignment of the two fingerprints (within +-3 items).
+python3 benchmarks/bench_chroma_fingerprint.py --seconds 600
+python3 benchmarks/bench_chroma_fingerprint.py --file audio.wav
+'''
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from os import path
+
+import numpy as np
+from scipy.io import wavfile
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib"))
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "tests"))
+import audioCorrelation
+from chromaFingerprint import calculate_fingerprints_wav, sample_rate
+from music import generate_music
+
+def get_agreement(fingerprints_1, fingerprints_2, max_shift=3):
+    best = 0.0
+    for shift in range(-max_shift, max_shift+1):
+        begin_x, begin_y, overlap = audioCorrelation.get_overlap_bounds(len(fingerprints_1), len(fingerprints_2), shift)
+        bits_different = audioCorrelation.popcount(np.bitwise_xor(fingerprints_1[begin_x:begin_x+overlap], fingerprints_2[begin_y:begin_y+overlap])).sum()
+        best = max(best, 1.0-bits_different/(32.0*overlap))
+    return best
+
+def run(file_path, seconds):
+    begin = time.time()
+    fingerprints_numpy = calculate_fingerprints_wav(file_path, seconds)
+    duration = time.time()-begin
+    print(f"numpy: {duration:.2f} s ({seconds/duration:.0f}x realtime), {len(fingerprints_numpy)} items")
+    if shutil.which(audioCorrelation.tools.software["fpcalc"]) == None:
+        print("fpcalc is not installed, no agreement measure")
+        return
+    begin = time.time()
+    fingerprints_fpcalc = audioCorrelation.fingerprint_array(audioCorrelation.calculate_fingerprints(file_path, seconds))
+    duration = time.time()-begin
+    print(f"fpcalc: {duration:.2f} s ({seconds/duration:.0f}x realtime), {len(fingerprints_fpcalc)} items")
+    print(f"bits equal with fpcalc: {get_agreement(fingerprints_numpy, fingerprints_fpcalc)*100:.1f} %")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=600)
+    parser.add_argument("--file", type=str, default=None, help="wav file, synthetic music if not given")
+    args = parser.parse_args()
+    if args.file != None:
+        run(args.file, args.seconds)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = path.join(folder, "music.wav")
+            wavfile.write(file_path, sample_rate, generate_music(args.seconds, 1, sample_rate))
+            run(file_path, args.seconds)
@@ -0,0 +1,68 @@
+'''
+Speed and accuracy of the coarse to fine searches against the full searches, on synthetic shifted signals.
+Audio: corrabs_lean against corrabs_coarse_to_fine on shifted noise with an added noise, error against the true shift in ms.
+Fingerprints: all the offsets scored (score_offsets) against get_max_corr_coarse_to_fine, on noisy shifted fingerprints.
+python3 benchmarks/bench_coarse_to_fine.py
+'''
+import argparse
+import sys
+import time
+from os import path
+
+import numpy as np
+from scipy.signal import lfilter
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib"))
+import audioCorrelation
+
+def bench_audio(seconds, trials, rng, sample_rate=48000):
+    times = {"corrabs_lean": 0.0, "corrabs_coarse_to_fine": 0.0}
+    errors = {"corrabs_lean": [], "corrabs_coarse_to_fine": []}
+    for trial in range(trials):
+        length = seconds*sample_rate
+        shift = int(rng.integers(-5*sample_rate, 5*sample_rate))
+        signal = (lfilter([1.0], [1.0, -0.95], rng.standard_normal(length+12*sample_rate))*1000).astype(np.int16)
+        s1 = signal[6*sample_rate+shift:6*sample_rate+shift+length]
+        s2 = (signal[6*sample_rate:6*sample_rate+length] + rng.normal(0, 1000, length)).astype(np.int16)
+        for name in times:
+            begin = time.time()
+            lag,value = getattr(audioCorrelation, name)(s1, s2)
+            times[name] += time.time()-begin
+            errors[name].append(abs(lag+shift)/sample_rate*1000)
+    for name in times:
+        print(f"audio {seconds:4} s {name:24} {times[name]/trials:6.2f} s by correlation, max error {max(errors[name]):.3f} ms")
+
+def add_bit_noise(rng, fingerprints, probability):
+    return fingerprints ^ np.packbits(rng.random((len(fingerprints), 32)) < probability, axis=1, bitorder='little').view(np.uint32).ravel()
+
+def bench_fingerprints(items, trials, rng):
+    time_full = 0.0
+    time_coarse = 0.0
+    different = 0
+    for trial in range(trials):
+        shift = int(rng.integers(-items//10, items//10))
+        base = rng.integers(0, 2**32, items+items//5, dtype=np.uint64).astype(np.uint32)
+        source = add_bit_noise(rng, base[items//10+shift:items//10+shift+items], 0.15)
+        target = add_bit_noise(rng, base[items//10:items//10+items], 0.15)
+        span = items - audioCorrelation.min_overlap
+        offsets = range(-span, span + 1)
+        begin = time.time()
+        corr = audioCorrelation.score_offsets(source, target[None, :], offsets)[0]
+        full = offsets[int(np.argmax(corr))]
+        time_full += time.time()-begin
+        begin = time.time()
+        coarse = audioCorrelation.get_max_corr_coarse_to_fine(source, target[None, :], offsets)[0][1]
+        time_coarse += time.time()-begin
+        different += full != coarse
+    print(f"fingerprints {items:5} items: all the offsets {time_full/trials*1000:7.1f} ms, coarse to fine {time_coarse/trials*1000:6.1f} ms, {different} different delays on {trials}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=5)
+    args = parser.parse_args()
+    rng = np.random.default_rng(6)
+    for seconds in [30, 120, 240]:
+        bench_audio(seconds, args.trials, rng)
+    # A 10 minutes cut is about 4800 items
+    for items in [1000, 2500, 4800]:
+        bench_fingerprints(items, args.trials*4, rng)
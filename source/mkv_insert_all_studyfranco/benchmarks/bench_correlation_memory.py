@@ -0,0 +1,47 @@
+'''
+Peak RSS and time of the second correlation implementations on two cuts of synthetic audio.
+Each run is done in a fresh process, so the peak RSS is the one of the correlation alone.
+python3 benchmarks/bench_correlation_memory.py --seconds 240
+'''
+import argparse
+import resource
+import subprocess
+import sys
+import time
+from os import path
+
+lib_folder = path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib")
+implementations = ["corrabs", "corrabs_lean", "corrabs_coarse_to_fine"]
+
+def run_one(implementation, seconds, sample_rate):
+    sys.path.insert(0, lib_folder)
+    import numpy as np
+    import audioCorrelation
+    rng = np.random.default_rng(5)
+    length = seconds*sample_rate
+    signal = (np.cumsum(rng.standard_normal(length+sample_rate))*20).astype(np.int16)
+    s1 = signal[sample_rate//10:sample_rate//10+length]
+    s2 = signal[:length]
+    rss_signals = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss//1024
+    begin = time.time()
+    result = getattr(audioCorrelation, implementation)(s1, s2)
+    duration = time.time()-begin
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss//1024
+    if implementation == "corrabs":
+        ls1,ls2,padsize,xmax,ca = result
+        lag = xmax if xmax < ls1 else xmax-padsize
+    else:
+        lag = result[0]
+    print(f"{implementation:24} peak RSS {rss:6} MB (before the correlation {rss_signals} MB), {duration:6.2f} s, lag {lag}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=240)
+    parser.add_argument("--sample_rate", type=int, default=48000)
+    parser.add_argument("--implementation", choices=implementations, default=None, help="Run only this one, in this process")
+    args = parser.parse_args()
+    if args.implementation != None:
+        run_one(args.implementation, args.seconds, args.sample_rate)
+    else:
+        for implementation in implementations:
+            subprocess.run([sys.executable, path.abspath(__file__), "--seconds", str(args.seconds), "--sample_rate", str(args.sample_rate), "--implementation", implementation], check=True)
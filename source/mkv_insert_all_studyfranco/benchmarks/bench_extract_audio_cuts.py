@@ -0,0 +1,76 @@
+'''
+Audio cuts extraction: one ffmpeg by (audio, cut) with output seeking (before) against one ffmpeg by cut with input seeking (now).
+Without --file, print the processes, the decoded audio and the file read for the cuts of mergeVideo.
+With --file, run both extractions on the file with ffmpeg and print their wall time.
+python3 benchmarks/bench_extract_audio_cuts.py --duration 7200 --audios 2
+python3 benchmarks/bench_extract_audio_cuts.py --file movie.mkv --streams 1,2
+'''
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+from time import strftime,gmtime
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib"))
+import video
+
+def get_cuts(duration):
+    # Same cuts as mergeVideo
+    begin_in_second,length_time = video.generate_begin_and_length_by_segment(duration)
+    length_time_converted = strftime('%H:%M:%S',gmtime(length_time*2))
+    return video.generate_cut_with_begin_length(begin_in_second,length_time,length_time_converted)
+
+def to_seconds(timestamp):
+    hours,minutes,seconds = timestamp.split(":")
+    return int(hours)*3600+int(minutes)*60+float(seconds)
+
+def print_estimate(duration, number_audios):
+    cuts = [(to_seconds(begin),to_seconds(length)) for begin,length in get_cuts(duration)]
+    # The output seeking decode the audio from the start of the file up to the end of the cut
+    decoded_before = number_audios*sum(begin+length for begin,length in cuts)
+    decoded_now = number_audios*sum(length for begin,length in cuts)
+    read_now = sum(length for begin,length in cuts)
+    print(f"{duration} s, {number_audios} audios: processes {number_audios*len(cuts)} -> {len(cuts)}, decoded audio {decoded_before:.0f} -> {decoded_now:.0f} s, file read {decoded_before:.0f} -> {read_now:.0f} s")
+
+def get_duration(ffprobe, file_path):
+    return float(subprocess.run([ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", file_path], check=True, capture_output=True).stdout)
+
+def run_commands(cmds):
+    begin = time.time()
+    for cmd in cmds:
+        subprocess.run(cmd, check=True, capture_output=True)
+    return time.time()-begin
+
+def measure(ffmpeg, ffprobe, file_path, streams):
+    cuts = get_cuts(get_duration(ffprobe, file_path))
+    base_cmd = [ffmpeg, "-y", "-nostdin", "-threads", "5"]
+    codec_param = ["-c:a", "pcm_s16le", "-ar", "48000", "-ac", "1"]
+    with tempfile.TemporaryDirectory() as folder:
+        cmds_before = [base_cmd+["-i", file_path, "-ss", begin, "-t", length, "-map", "0:"+stream]+codec_param+[path.join(folder, f"before.{stream}.{number}.wav")]
+                       for stream in streams for number,(begin,length) in enumerate(cuts)]
+        cmds_now = []
+        for number,(begin,length) in enumerate(cuts):
+            cmd = base_cmd+["-ss", begin, "-t", length, "-i", file_path]
+            for stream in streams:
+                cmd.extend(["-map", "0:"+stream]+codec_param+[path.join(folder, f"now.{stream}.{number}.wav")])
+            cmds_now.append(cmd)
+        # The commands are run one by one, so the times don't depend of the number of cores
+        print(f"one ffmpeg by audio and cut, output seeking: {len(cmds_before)} processes, {run_commands(cmds_before):.1f} s")
+        print(f"one ffmpeg by cut, input seeking: {len(cmds_now)} processes, {run_commands(cmds_now):.1f} s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, action="append", help="Duration of the shortest audio in seconds, can be repeated")
+    parser.add_argument("--audios", type=int, default=2, help="Number of compatible audios")
+    parser.add_argument("--file", type=str, default=None)
+    parser.add_argument("--streams", type=str, default="1", help="Stream orders of the audios, separated by a comma")
+    parser.add_argument("--ffmpeg", type=str, default="ffmpeg")
+    parser.add_argument("--ffprobe", type=str, default="ffprobe")
+    args = parser.parse_args()
+    if args.file != None:
+        measure(args.ffmpeg, args.ffprobe, args.file, args.streams.split(","))
+    else:
+        for duration in (args.duration or [7200, 2700]):
+            print_estimate(duration, args.audios)
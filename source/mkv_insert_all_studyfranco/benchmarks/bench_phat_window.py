@@ -0,0 +1,95 @@
+'''
+Accuracy of the second correlation against the window length, plain (corrabs_lean) and GCC-PHAT (corrabs_phat),
+on synthetic shifted tracks:
+- noise: the target is the source with a broadband noise 12 dB over the signal,
+- dubbed: the same music bed with a different voice on each track, and an echo on the target,
+- overlaid: the target is the source mixed with another music 10 dB louder.
+correct = within 1 ms of the true delay, conf = median confidence (get_peak_confidence, 5 ms exclusion),
+wrong max conf = highest confidence of a wrong PHAT peak (to compare with phat_min_confidence).
+python3 benchmarks/bench_phat_window.py
+'''
+import argparse
+import sys
+from os import path
+
+import numpy as np
+from scipy.signal import butter, sosfilt
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib"))
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "tests"))
+import audioCorrelation
+from music import generate_music
+
+max_delay = 3
+
+def generate_voice(duration, seed, sample_rate):
+    # Syllables of 0.2 s on a gliding pitch, with pauses, like a speech
+    rng = np.random.default_rng(seed)
+    length = int(duration*sample_rate)
+    syllable_samples = int(0.2*sample_rate)
+    pitch = np.repeat(rng.uniform(100, 250, length//syllable_samples+1), syllable_samples)[:length]
+    phase = 2*np.pi*np.cumsum(pitch)/sample_rate
+    voice = sum(np.sin(harmonic*phase)/harmonic for harmonic in range(1, 8))
+    envelope = np.repeat(rng.random(length//syllable_samples+1) < 0.7, syllable_samples)[:length]*np.abs(np.sin(np.pi*np.arange(length)/syllable_samples))
+    return voice*envelope*6000
+
+def add_echo(signal, sample_rate):
+    echo = np.zeros(len(signal))
+    for delay,gain in [(0.023, 0.6), (0.051, 0.4), (0.087, 0.25)]:
+        echo[int(delay*sample_rate):] += gain*signal[:len(signal)-int(delay*sample_rate)]
+    return signal+echo
+
+def get_tracks(scenario, duration, shift, rng, sample_rate):
+    # s1[n] is the same sound as s2[n+shift]: the lag found has to be -shift
+    margin = max_delay*sample_rate
+    seed = int(rng.integers(0, 2**31))
+    music = generate_music(duration+2*max_delay, seed, sample_rate).astype(np.float64)
+    length = int(duration*sample_rate)
+    if scenario == "noise":
+        source = music
+        target = music + rng.normal(0, 4*music.std(), len(music))
+    elif scenario == "dubbed":
+        lowpass = butter(4, 4000, fs=sample_rate, output='sos')
+        source = 0.2*music + generate_voice(duration+2*max_delay, seed+1, sample_rate)
+        target = add_echo(sosfilt(lowpass, 0.2*music + generate_voice(duration+2*max_delay, seed+2, sample_rate)), sample_rate)
+    else:
+        source = music
+        target = music + 3*generate_music(duration+2*max_delay, seed+1, sample_rate)
+    s1 = source[margin+shift:margin+shift+length]
+    s2 = target[margin:margin+length]
+    return (s1/np.abs(s1).max()*16000).astype(np.int16),(s2/np.abs(s2).max()*16000).astype(np.int16)
+
+def run(scenario, windows, trials, sample_rate):
+    rng = np.random.default_rng(19)
+    exclusion = max(1,int(audioCorrelation.peak_confidence_exclusion*sample_rate))
+    print(f"{scenario}:\n    window  plain correct/conf   phat correct/conf   phat median error   phat wrong max conf")
+    for window in windows:
+        correct = {"plain": 0, "phat": 0}
+        confidences = {"plain": [], "phat": []}
+        errors = []
+        wrong_confidence = 0.0
+        for trial in range(trials):
+            shift = int(rng.integers(-max_delay*sample_rate, max_delay*sample_rate))
+            s1,s2 = get_tracks(scenario, window, shift, rng, sample_rate)
+            lag,value = audioCorrelation.corrabs_lean(s1,s2)
+            ls1,ls2,padsize,xmax,ca = audioCorrelation.corrabs(s1,s2)
+            confidences["plain"].append(audioCorrelation.get_peak_confidence(ca,xmax,exclusion))
+            correct["plain"] += abs(lag+shift) <= sample_rate/1000
+            lag,value,confidence = audioCorrelation.corrabs_phat(s1,s2,exclusion)
+            confidences["phat"].append(confidence)
+            if abs(lag+shift) <= sample_rate/1000:
+                correct["phat"] += 1
+                errors.append(abs(lag+shift)/sample_rate*1000)
+            else:
+                wrong_confidence = max(wrong_confidence, confidence)
+        median_error = f"{np.median(errors):.2f} ms" if len(errors) else "-"
+        print(f"    {window:3} s   {correct['plain']:2}/{trials} {np.median(confidences['plain']):5.2f}          {correct['phat']:2}/{trials} {np.median(confidences['phat']):5.2f}          {median_error:>9}          {wrong_confidence:5.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=12)
+    parser.add_argument("--sample_rate", type=int, default=11025)
+    parser.add_argument("--windows", type=int, nargs="+", default=[2, 5, 10, 20, 40, 80])
+    args = parser.parse_args()
+    for scenario in ["noise", "dubbed", "overlaid"]:
+        run(scenario, args.windows, args.trials, args.sample_rate)
@@ -0,0 +1,26 @@
+'''
+Decisions of the fast VMAF arbitration against the full one on a simulated corpus (see tests/vmaf_simulation.py).
+python3 benchmarks/bench_vmaf_arbitration.py --pairs 20000
+'''
+import argparse
+import sys
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib"))
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "tests"))
+import video
+from vmaf_simulation import simulate
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=23)
+    args = parser.parse_args()
+    gaps, decisions_full, decisions_fast, cuts_fast = simulate(args.pairs, args.seed)
+    different = decisions_full != decisions_fast
+    print(f"decisions different from the full mode: {different.mean()*100:.1f} %")
+    print(f"with a true gap under 0.5 VMAF: {different[np.abs(gaps) < 0.5].mean()*100:.1f} %")
+    print(f"with a true gap over 2 VMAF: {different[np.abs(gaps) > 2].mean()*100:.1f} %")
+    print(f"cuts done: {cuts_fast.mean():.2f} on average instead of {video.number_cut}")
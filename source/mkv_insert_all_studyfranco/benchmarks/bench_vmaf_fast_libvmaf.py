@@ -0,0 +1,39 @@
+'''
+Agreement of the fast VMAF arbitration with the full one through libvmaf, on testsrc2 clips encoded with libx264 at several CRF.
+For each pair of clips: the scores of the two directions in the full and the fast mode, and if the decision is the same.
+Needs ffmpeg with libvmaf and libx264.
+python3 benchmarks/bench_vmaf_fast_libvmaf.py --duration 4
+'''
+import argparse
+import itertools
+import sys
+import tempfile
+import time
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib"))
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "tests"))
+from vmaf_clips import encode_clips, get_vmaf_scores, has_libvmaf
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=int, default=4)
+    parser.add_argument("--crfs", type=int, nargs="+", default=[18, 23, 28, 33, 38])
+    args = parser.parse_args()
+    if not has_libvmaf():
+        print("ffmpeg with libvmaf and libx264 is not installed")
+        sys.exit(0)
+    with tempfile.TemporaryDirectory() as folder:
+        clips = encode_clips(folder, args.crfs, args.duration)
+        same = 0
+        pairs = list(itertools.permutations(args.crfs, 2))
+        for crf_1,crf_2 in pairs:
+            begin = time.time()
+            full = get_vmaf_scores(folder, clips[crf_1], clips[crf_2], args.duration, False)
+            time_full = time.time()-begin
+            begin = time.time()
+            fast = get_vmaf_scores(folder, clips[crf_1], clips[crf_2], args.duration, True)
+            time_fast = time.time()-begin
+            same += (full[0] >= full[1]) == (fast[0] >= fast[1])
+            print(f"crf {crf_1:2} vs {crf_2:2}: full {full[0]:6.2f} / {full[1]:6.2f} in {time_full:5.2f} s, fast {fast[0]:6.2f} / {fast[1]:6.2f} in {time_fast:5.2f} s")
+        print(f"same decision on {same} pairs of {len(pairs)}")
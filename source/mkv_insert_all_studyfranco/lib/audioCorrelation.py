@@ -26,7 +26,8 @@ import tools
 import gc
 import json
 import time
-from threading import RLock
+from tempfile import TemporaryFile
+from threading import Condition
 import sys
 
 '''
@@ -60,13 +61,96 @@ def calculate_fingerprints(filename,length=1):
         else:
             raise Exception("This cmd is in error: "+" ".join(cmd)+"\n"+str(stderror.decode("utf-8"))+"\n"+str(stdout.decode("utf-8"))+"\nReturn code: "+str(exitCode)+"\n")
     
+    return parse_fpcalc_output(stdout)
+
+def parse_fpcalc_output(stdout):
     fpcalc_out = stdout.decode("utf-8").strip().replace('\\n', '').replace("'", "")
     fingerprint_index = fpcalc_out.find('FINGERPRINT=') + 12
     # convert fingerprint to list of integers
     fingerprints = list(map(int, fpcalc_out[fingerprint_index:].split(',')))
     
     return fingerprints
+
+def calculate_fingerprints_array(filename,length=1):
+    if tools.fingerprint_backend == "numpy":
+        from chromaFingerprint import calculate_fingerprints_wav
+        return calculate_fingerprints_wav(filename,length)
+    return fingerprint_array(calculate_fingerprints(filename,length))
+
+def get_fingerprints(filename,length=1,cache_key=None):
+    if cache_key != None and tools.fingerprint_cache != None:
+        fingerprints = tools.fingerprint_cache.get(cache_key)
+        if fingerprints is not None:
+            return fingerprints
+    fingerprints = calculate_fingerprints_array(filename,length)
+    if cache_key != None and tools.fingerprint_cache != None:
+        tools.fingerprint_cache.put(cache_key,fingerprints)
+    return fingerprints
   
+'''
+Full track fingerprint.
+Chromaprint works on mono audio at 11025 Hz and gives one item every 4096/3 samples,
+so the fingerprint of a cut is a slice of the fingerprint of the whole track.
+'''
+fingerprint_sample_rate = 11025
+fingerprint_item_duration = (4096//3)/fingerprint_sample_rate
+
+def calculate_full_track_fingerprints(file_path,stream_order):
+    '''
+    Fingerprint a whole audio stream with one decode: ffmpeg send the raw PCM to fpcalc by a pipe, without temporary file.
+    '''
+    cmd_decode = [tools.software["ffmpeg"], "-v", "error", "-nostats", "-nostdin", "-threads", str(2),
+                  "-i", file_path, "-map", f"0:{stream_order}", "-vn", "-sn", "-dn",
+                  "-af", f"pan=mono|c0=c0,aresample={fingerprint_sample_rate}",
+                  "-c:a", "pcm_s16le", "-f", "s16le", "pipe:1"]
+    if tools.fingerprint_backend == "numpy":
+        return calculate_full_track_fingerprints_numpy(cmd_decode)
+    cmd_fingerprint = [tools.software["fpcalc"], "-raw", "-length", "0", "-format", "s16le",
+                       "-rate", str(fingerprint_sample_rate), "-channels", "1", "-"]
+    slots = tools.acquire_host_cpu_tokens([cmd_decode, cmd_fingerprint])
+    try:
+        decoder = Popen(cmd_decode, stdout=PIPE, stderr=PIPE)
+        fingerprinter = Popen(cmd_fingerprint, stdin=decoder.stdout, stdout=PIPE, stderr=PIPE)
+        # Only fpcalc read the pipe, ffmpeg get a SIGPIPE if fpcalc stop
+        decoder.stdout.close()
+        stdout, stderror = fingerprinter.communicate()
+        stderror_decode = decoder.stderr.read()
+        decoder.wait()
+    finally:
+        tools.release_host_cpu_tokens(slots)
+    # If fpcalc fail, ffmpeg fail too on the closed pipe: the error of fpcalc is the one to report
+    if fingerprinter.returncode != 0:
+        raise Exception("This cmd is in error: "+" ".join(cmd_fingerprint)+"\n"+str(stderror.decode("utf-8"))+"\n"+str(stdout.decode("utf-8"))+"\nReturn code: "+str(fingerprinter.returncode)+"\n")
+    if decoder.returncode != 0:
+        raise Exception("This cmd is in error: "+" ".join(cmd_decode)+"\n"+str(stderror_decode.decode("utf-8"))+"\nReturn code: "+str(decoder.returncode)+"\n")
+    return fingerprint_array(parse_fpcalc_output(stdout))
+
+def calculate_full_track_fingerprints_numpy(cmd_decode):
+    from chromaFingerprint import calculate_fingerprints_pipe
+    # stderr in a temporary file: it is only read at the end, a full pipe would block ffmpeg
+    with TemporaryFile() as stderror_file:
+        slots = tools.acquire_host_cpu_tokens([cmd_decode])
+        try:
+            decoder = Popen(cmd_decode, stdout=PIPE, stderr=stderror_file)
+            try:
+                fingerprints = calculate_fingerprints_pipe(decoder.stdout)
+            finally:
+                decoder.stdout.close()
+                decoder.wait()
+        finally:
+            tools.release_host_cpu_tokens(slots)
+        if decoder.returncode != 0:
+            stderror_file.seek(0)
+            raise Exception("This cmd is in error: "+" ".join(cmd_decode)+"\n"+str(stderror_file.read().decode("utf-8"))+"\nReturn code: "+str(decoder.returncode)+"\n")
+    return fingerprints
+
+def slice_fingerprints(fingerprints,cut_begin,cut_length):
+    '''
+    Items of a full track fingerprint for the cut beginning at cut_begin seconds and of cut_length seconds.
+    '''
+    begin = min(int(round(cut_begin/fingerprint_item_duration)), len(fingerprints))
+    return fingerprints[begin:begin+int(cut_length/fingerprint_item_duration)]
+
 # returns correlation between lists
 def correlation(listx, listy):
     if len(listx) == 0 or len(listy) == 0:
@@ -113,7 +197,37 @@ def compare(listx, listy, span, step):
     for offset in numpy.arange(-span, span + 1, step):
         corr_xy.append(cross_correlation(listx, listy, offset))
     return corr_xy
-  
+
+'''
+Numpy engine for the fingerprint cross correlation.
+The fingerprints are stored as uint32 arrays and the hamming distance of each offset
+is computed with a popcount on the xor of the two overlapping parts.
+score_offsets returns the same values as compare() (tests/test_numpy_correlation.py).
+'''
+if hasattr(numpy, "bitwise_count"):
+    def popcount(values):
+        return numpy.bitwise_count(values)
+else:
+    popcount_table = numpy.array([bin(i).count("1") for i in range(1 << 16)], dtype=numpy.uint8)
+    def popcount(values):
+        return popcount_table[values & 0xFFFF] + popcount_table[values >> 16]
+
+def fingerprint_array(fingerprints):
+    if isinstance(fingerprints, numpy.ndarray) and fingerprints.dtype == numpy.uint32:
+        return fingerprints
+    return numpy.asarray(fingerprints, dtype=numpy.int64).astype(numpy.uint32)
+
+def get_overlap_bounds(len_x, len_y, offset):
+    # Same slices as cross_correlation and correlation
+    if offset > 0:
+        overlap = min(len_x-offset, len_y)
+        return offset, 0, overlap
+    elif offset < 0:
+        overlap = min(len_y+offset, len_x)
+        return 0, -offset, overlap
+    else:
+        return 0, 0, min(len_x, len_y)
+
 # return index of maximum value in list
 def max_index(listx):
     max_index = 0
@@ -135,27 +249,131 @@ def get_max_corr(corr, source, target, span, sizePoint):
     #     % (corr[max_corr_index] * 100.0, max_corr_offset))
     return corr[max_corr_index],max_corr_offset,-max_corr_offset*sizePoint
 
-def correlate(source, target, lengthFile):
-    fingerprint_source = calculate_fingerprints(source,length=lengthFile)
-    fingerprint_target = calculate_fingerprints(target,length=lengthFile)
-    
-    if len(fingerprint_source) != len(fingerprint_target):
-        if len(fingerprint_target) < len(fingerprint_source):
-            span = len(fingerprint_target) - min_overlap
-        else:
-            span = len(fingerprint_source) - min_overlap
-    else:
-        span = len(fingerprint_target) - min_overlap
-    corr = compare(fingerprint_source, fingerprint_target, span, step)
-    return get_max_corr(corr, source, target, span, int(lengthFile/len(fingerprint_source)*1000))
+def correlate(source, target, lengthFile, cache_key_source=None, cache_key_target=None):
+    fingerprint_source = get_fingerprints(source,length=lengthFile,cache_key=cache_key_source)
+    fingerprint_target = get_fingerprints(target,length=lengthFile,cache_key=cache_key_target)
+    return correlate_one_to_many(fingerprint_source, [fingerprint_target], lengthFile)[0]
 
 '''
 End Copy
 '''
 
-def test_calcul_can_be(filename,length):
+def correlate_one_to_many(fingerprint_source, fingerprints_target, lengthFile):
+    '''
+    Correlate one fingerprint against a list of fingerprints.
+    The targets with the same length are stacked in a 2-D array and all of them are scored in the same operation.
+    Return a list of (corr, offset, ms) in the targets order, the same values as correlate() on each couple
+    (with tools.coarse_to_fine, except in rare cases where the coarse pass misses the best offset).
+    '''
+    array_source = fingerprint_array(fingerprint_source)
+    size_point = int(lengthFile/len(array_source)*1000)
+    targets_by_length = {}
+    for position,fingerprint_target in enumerate(fingerprints_target):
+        array_target = fingerprint_array(fingerprint_target)
+        if len(array_target) in targets_by_length:
+            targets_by_length[len(array_target)].append((position,array_target))
+        else:
+            targets_by_length[len(array_target)] = [(position,array_target)]
+
+    results = [None]*len(fingerprints_target)
+    for length_target,targets in targets_by_length.items():
+        matrix_target = numpy.stack([array_target for position,array_target in targets])
+        span = min(len(array_source), length_target) - min_overlap
+        if span < 0:
+            raise Exception('Overlap too small: %i' % min(len(array_source), length_target))
+        offsets = range(-span, span + 1, step)
+        if tools.coarse_to_fine and len(offsets) > 4*coarse_window*coarse_candidates:
+            max_corr_list = get_max_corr_coarse_to_fine(array_source, matrix_target, offsets)
+        else:
+            corr = score_offsets(array_source, matrix_target, offsets)
+            # argmax keep the first maximum like max_index
+            max_corr_list = [(float(corr[row, max_corr_index]),offsets[max_corr_index]) for row,max_corr_index in enumerate(numpy.argmax(corr, axis=1))]
+        for row,(max_corr,max_corr_offset) in enumerate(max_corr_list):
+            results[targets[row][0]] = (max_corr,max_corr_offset,-max_corr_offset*size_point)
+    return results
+
+def correlate_one_to_many_timed(fingerprint_source, fingerprints_target, lengthFile, submit_time):
+    '''
+    correlate_one_to_many for a pool of workers.
+    Return the results, the time waited for a worker since submit_time and the time of the correlation.
+    '''
+    begin = time.time()
+    results = correlate_one_to_many(fingerprint_source, fingerprints_target, lengthFile)
+    return results,begin-submit_time,time.time()-begin
+
+def score_offsets(array_source, matrix_target, offsets):
+    '''
+    Correlation of the source with each row of matrix_target for the offsets.
+    '''
+    corr = numpy.empty((matrix_target.shape[0], len(offsets)), dtype=numpy.float64)
+    for offset_index,offset in enumerate(offsets):
+        begin_x, begin_y, overlap = get_overlap_bounds(len(array_source), matrix_target.shape[1], offset)
+        bits_different = popcount(numpy.bitwise_xor(array_source[begin_x:begin_x+overlap], matrix_target[:, begin_y:begin_y+overlap])).sum(axis=1, dtype=numpy.int64)
+        corr[:, offset_index] = ((32*overlap - bits_different) / float(overlap))/32
+    return corr
+
+'''
+Coarse to fine search.
+The coarse pass estimates the correlation of all the offsets on a subsample of the fingerprint bits (one bit every coarse_bit_step),
+with a FFT cross correlation of each bit plane. The exact correlation is then only calculated around the best coarse offsets.
+The refined peak is kept only if it is over coarse_min_corr and over the coarse score of every offset outside the refined windows
+by coarse_margin. Otherwise (repeated content, no clear peak) all the offsets are scanned like before.
+The coarse scores are an estimation, so the result is not guaranteed to be the one of the full scan, only very likely:
+it is only used with tools.coarse_to_fine (off by default).
+'''
+coarse_bit_step = 4
+coarse_candidates = 3
+coarse_window = 8
+coarse_min_corr = 0.6
+coarse_margin = 0.05
+
+def coarse_scores(array_source, matrix_target, span):
+    from scipy import fft as scipy_fft
+    len_x = len(array_source)
+    len_y = matrix_target.shape[1]
+    padsize = scipy_fft.next_fast_len(len_x+len_y, real=True)
+    bits = numpy.arange(0, 32, coarse_bit_step, dtype=numpy.uint32)
+    planes_x = ((array_source[:, None] >> bits) & 1).astype(numpy.float64)
+    planes_y = ((matrix_target[:, :, None] >> bits) & 1).astype(numpy.float64)
+    # corr[k] = sum_n x[n+k]*y[n] for all the bit planes
+    spectrum = scipy_fft.rfft(planes_x, n=padsize, axis=0)[None, :, :]*numpy.conj(scipy_fft.rfft(planes_y, n=padsize, axis=1))
+    both_one = numpy.rint(scipy_fft.irfft(spectrum.sum(axis=2), n=padsize, axis=1))
+    offsets = numpy.arange(-span, span + 1, step)
+    both_one = both_one[:, offsets % padsize]
+    
+    begin_x = numpy.maximum(offsets, 0)
+    begin_y = numpy.maximum(-offsets, 0)
+    overlap = numpy.minimum(len_x-begin_x, len_y-begin_y)
+    cumsum_x = numpy.concatenate(([0], numpy.cumsum(planes_x.sum(axis=1))))
+    cumsum_y = numpy.concatenate((numpy.zeros((matrix_target.shape[0], 1)), numpy.cumsum(planes_y.sum(axis=2), axis=1)), axis=1)
+    ones_x = cumsum_x[begin_x+overlap] - cumsum_x[begin_x]
+    ones_y = cumsum_y[:, begin_y+overlap] - cumsum_y[:, begin_y]
+    bits_different = ones_x[None, :] + ones_y - 2*both_one
+    return 1.0 - bits_different/(overlap*len(bits))[None, :]
+
+def get_max_corr_coarse_to_fine(array_source, matrix_target, offsets):
+    coarse_corr = coarse_scores(array_source, matrix_target, -offsets[0])
+    max_corr_list = []
+    for row in range(matrix_target.shape[0]):
+        offset_indexes = set()
+        for candidate in numpy.argsort(-coarse_corr[row], kind='stable')[:coarse_candidates]:
+            offset_indexes.update(range(max(0, int(candidate)-coarse_window), min(len(offsets), int(candidate)+coarse_window+1)))
+        offset_indexes = sorted(offset_indexes)
+        corr = score_offsets(array_source, matrix_target[row:row+1], [offsets[offset_index] for offset_index in offset_indexes])[0]
+        max_corr_index = int(numpy.argmax(corr))
+        coarse_outside = coarse_corr[row].copy()
+        coarse_outside[offset_indexes] = -1.0
+        if corr[max_corr_index] >= max(coarse_min_corr, coarse_outside.max()+coarse_margin):
+            max_corr_list.append((float(corr[max_corr_index]),offsets[offset_indexes[max_corr_index]]))
+        else:
+            corr = score_offsets(array_source, matrix_target[row:row+1], offsets)[0]
+            max_corr_index = int(numpy.argmax(corr))
+            max_corr_list.append((float(corr[max_corr_index]),offsets[max_corr_index]))
+    return max_corr_list
+
+def test_calcul_can_be(filename,length,cache_key=None):
     try:
-        calculate_fingerprints(filename,length)
+        get_fingerprints(filename,length,cache_key)
         return True
     except:
         import traceback
@@ -173,6 +391,8 @@ import numpy as np
 from scipy import fft
 from scipy.io import wavfile
 from os import path,remove
+from subprocess import Popen, PIPE
+from threading import Thread
 
 ax = None
 normalize = False
@@ -181,8 +401,8 @@ lowpass = 0
 
 #ffmpeglow = [tools.software["ffmpeg"], "-y", "-threads", str(tools.core_to_use), "-i", '"{}"', "-af", f"'lowpass=f={lowpass}'", '"{}"']
 
-def get_files_metrics(outfile):
-    r,s = wavfile.read(outfile)
+def get_files_metrics(outfile,mmap=False):
+    r,s = wavfile.read(outfile,mmap=mmap)
     if len(s.shape)>1: #stereo
         s = s[:,0]
     return r,s
@@ -193,37 +413,35 @@ def generate_norm_cmd(in_file,out_file):
             "-map_metadata", "0", "-map_metadata:s:a:0", "0:s:a:0", "-map_chapters", "0", "-c:v", "copy", "-map", "[norm0]",
             "-c:a:0", "pcm_s16le", "-c:s", "copy", out_file]
 
-def read_normalized(in1,in2):
-    from video import ffmpeg_pool_audio_convert,wait_end_big_job
+def read_normalized(in1,in2,mmap=False):
+    import video
 
-    r1,s1 = get_files_metrics(in1)
-    r2,s2 = get_files_metrics(in2)
+    r1,s1 = get_files_metrics(in1,mmap)
+    r2,s2 = get_files_metrics(in2,mmap)
     if r1 != r2:
         base_namme_in1 = path.splitext(path.basename(in1))[0]
         base_namme_in2 = path.splitext(path.basename(in2))[0]
-        wait_end_big_job()
         out_in1_norm = path.join(tools.tmpFolder,base_namme_in1+"_norm.wav")
-        job_in1 = ffmpeg_pool_audio_convert.apply_async(tools.launch_cmdExt, (generate_norm_cmd(in1,out_in1_norm),) )
+        job_in1 = video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, tools.launch_cmdExt, (generate_norm_cmd(in1,out_in1_norm),) )
         out_in2_norm = path.join(tools.tmpFolder,base_namme_in2+"_norm.wav")
-        job_in2 = ffmpeg_pool_audio_convert.apply_async(tools.launch_cmdExt, (generate_norm_cmd(in2,out_in2_norm),) )
+        job_in2 = video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, tools.launch_cmdExt, (generate_norm_cmd(in2,out_in2_norm),) )
             
         job_in1.get()
-        r1,s1 = get_files_metrics(out_in1_norm)
+        r1,s1 = get_files_metrics(out_in1_norm,mmap)
         job_in2.get()
-        r2,s2 = get_files_metrics(out_in2_norm)
+        r2,s2 = get_files_metrics(out_in2_norm,mmap)
         if r1 != r2:
-            wait_end_big_job()
             out_in1_norm_denoise = path.join(tools.tmpFolder,base_namme_in1+"_norm_denoise.wav")
-            job_in1 = ffmpeg_pool_audio_convert.apply_async(tools.launch_cmdExt, ([tools.software["ffmpeg"], "-y", "-threads", str(2), "-i", out_in1_norm, "-af", "'afftdn=nf=-25'", out_in1_norm_denoise],) )
+            job_in1 = video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, tools.launch_cmdExt, ([tools.software["ffmpeg"], "-y", "-threads", str(2), "-i", out_in1_norm, "-af", "'afftdn=nf=-25'", out_in1_norm_denoise],) )
             out_in2_norm_denoise = path.join(tools.tmpFolder,base_namme_in2+"_norm_denoise.wav")
-            job_in2 = ffmpeg_pool_audio_convert.apply_async(tools.launch_cmdExt, ([tools.software["ffmpeg"], "-y", "-threads", str(2), "-i", out_in2_norm, "-af", "'afftdn=nf=-25'", out_in2_norm_denoise],) )
+            job_in2 = video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, tools.launch_cmdExt, ([tools.software["ffmpeg"], "-y", "-threads", str(2), "-i", out_in2_norm, "-af", "'afftdn=nf=-25'", out_in2_norm_denoise],) )
             
             job_in1.get()
-            r1,s1 = get_files_metrics(out_in1_norm_denoise)
+            r1,s1 = get_files_metrics(out_in1_norm_denoise,mmap)
             remove(out_in1_norm)
             remove(out_in1_norm_denoise)
             job_in2.get()
-            r2,s2 = get_files_metrics(out_in2_norm_denoise)
+            r2,s2 = get_files_metrics(out_in2_norm_denoise,mmap)
             remove(out_in2_norm)
             remove(out_in2_norm_denoise)
         else:
@@ -234,6 +452,61 @@ def read_normalized(in1,in2):
     fs = r1
     return fs,s1,s2
 
+def generate_stream_pcm_cmd(file_path,stream_order,cut_begin,cut_length,sample_rate):
+    # Input seeking, resampling and loudnorm in the same filter graph. Only the first channel is kept like get_files_metrics
+    return [tools.software["ffmpeg"], "-v", "error", "-nostats", "-nostdin", "-threads", str(2),
+            "-ss", str(cut_begin), "-t", str(cut_length), "-i", file_path, "-map", f"0:{stream_order}", "-vn", "-sn", "-dn",
+            "-af", f"pan=mono|c0=c0,aresample={sample_rate},loudnorm=i=-23.0:lra=7.0:tp=-2.0,aresample={sample_rate}",
+            "-c:a", "pcm_s16le", "-f", "s16le", "pipe:1"]
+
+class pcm_stream_reader(Thread):
+    '''
+    Read the raw PCM produced by ffmpeg in a preallocated numpy buffer
+    '''
+    def __init__(self,cmd,number_samples):
+        Thread.__init__(self)
+        self.cmd = cmd
+        self.signal = np.empty(number_samples, dtype=np.int16)
+        self.exception = None
+
+    def run(self):
+        try:
+            process = Popen(self.cmd, stdout=PIPE, stderr=PIPE)
+            buffer = memoryview(self.signal).cast("B")
+            position = 0
+            while position < len(buffer):
+                read = process.stdout.readinto(buffer[position:])
+                if not read:
+                    break
+                position += read
+            # The estimation of the length can be a little too short, the end is ignored
+            process.stdout.read()
+            stderror = process.stderr.read()
+            process.wait()
+            if process.returncode != 0:
+                raise Exception("This cmd is in error: "+" ".join(self.cmd)+"\n"+str(stderror.decode("utf-8"))+"\nReturn code: "+str(process.returncode)+"\n")
+            self.signal = self.signal[:position//2]
+        except Exception as e:
+            self.exception = e
+
+stream_sample_rate = 48000
+def read_normalized_stream(in1,in2):
+    cmds = [generate_stream_pcm_cmd(file_path,stream_order,cut_begin,cut_length,stream_sample_rate) for file_path,stream_order,cut_begin,cut_length in [in1,in2]]
+    slots = tools.acquire_host_cpu_tokens(cmds)
+    try:
+        readers = []
+        for cmd,(file_path,stream_order,cut_begin,cut_length) in zip(cmds,[in1,in2]):
+            readers.append(pcm_stream_reader(cmd,get_number_samples_stream(cut_length)))
+            readers[-1].start()
+        for reader in readers:
+            reader.join()
+    finally:
+        tools.release_host_cpu_tokens(slots)
+    for reader in readers:
+        if reader.exception != None:
+            raise reader.exception
+    return stream_sample_rate,readers[0].signal,readers[1].signal
+
 def corrabs(s1,s2):
     ls1 = len(s1)
     ls2 = len(s2)
@@ -248,6 +521,344 @@ def corrabs(s1,s2):
     xmax = np.argmax(ca)
     return ls1,ls2,padsize,xmax,ca
 
+def corrabs_lean(s1,s2):
+    '''
+    Same peak as corrabs with less memory: float32 real FFT on a next_fast_len size, in place products,
+    and only the peak is returned, not the correlation.
+    Return the lag in samples (positive when s1 need to be cut, negative when s2 need to be cut) and the peak value.
+    '''
+    ls1 = len(s1)
+    ls2 = len(s2)
+    padsize = fft.next_fast_len(ls1+ls2+1, real=True)
+    spectrum_1 = fft.rfft(np.asarray(s1, dtype=np.float32), n=padsize)
+    spectrum_2 = fft.rfft(np.asarray(s2, dtype=np.float32), n=padsize)
+    np.conjugate(spectrum_2, out=spectrum_2)
+    spectrum_1 *= spectrum_2
+    spectrum_2 = None
+    corr = fft.irfft(spectrum_1, n=padsize, overwrite_x=True)
+    spectrum_1 = None
+    np.absolute(corr, out=corr)
+    xmax = int(np.argmax(corr))
+    value = float(corr[xmax])
+    corr = None
+    # The positive lags are in [0,ls1[ and the negative lags at the end of the correlation
+    if xmax < ls1:
+        return xmax,value
+    else:
+        return xmax-padsize,value
+
+coarse_decimation = 16
+fine_block = 1<<20
+def decimate_block_mean(s):
+    '''
+    Mean of each block of coarse_decimation samples, in float32, without a full copy of the signal.
+    '''
+    length = len(s)//coarse_decimation
+    decimated = np.zeros(length, dtype=np.float32)
+    for phase in range(coarse_decimation):
+        decimated += s[phase:length*coarse_decimation:coarse_decimation]
+    decimated /= coarse_decimation
+    return decimated
+
+def get_correlation_window(s1,s2,lag_begin,lag_end):
+    '''
+    abs(corr[lag]) = abs(sum s1[n+lag]*s2[n]) for lag in [lag_begin,lag_end[, like corrabs_lean.
+    The signals are read by blocks of fine_block samples converted in float64, they are not copied.
+    '''
+    ls1 = len(s1)
+    ls2 = len(s2)
+    values = np.zeros(lag_end-lag_begin)
+    for block_begin in range(max(0,-(lag_end-1)), min(ls2,ls1-lag_begin), fine_block):
+        block_end = min(block_begin+fine_block, ls2, ls1-lag_begin)
+        block_s2 = np.asarray(s2[block_begin:block_end], dtype=np.float64)
+        begin_s1 = max(0,block_begin+lag_begin)
+        block_s1 = np.asarray(s1[begin_s1:min(ls1,block_end+lag_end-1)], dtype=np.float64)
+        for i,lag in enumerate(range(lag_begin,lag_end)):
+            first = max(block_begin,-lag)
+            last = min(block_end,ls1-lag)
+            if first < last:
+                values[i] += np.dot(block_s1[first+lag-begin_s1:last+lag-begin_s1], block_s2[first-block_begin:last-block_begin])
+    return np.absolute(values)
+
+def corrabs_coarse_to_fine(s1,s2):
+    '''
+    Peak of corrabs_lean found on the signals decimated by coarse_decimation (block mean),
+    then the exact correlation is calculated at full sample rate only in a window of +-2 blocks around it.
+    The result is the one of corrabs_lean when the decimated signals have the same peak.
+    '''
+    ls1 = len(s1)
+    ls2 = len(s2)
+    if min(ls1,ls2) < coarse_decimation*4096:
+        return corrabs_lean(s1,s2)
+    coarse_s1 = decimate_block_mean(s1)
+    coarse_s2 = decimate_block_mean(s2)
+    coarse_lag,coarse_value = corrabs_lean(coarse_s1,coarse_s2)
+    coarse_s1 = None
+    coarse_s2 = None
+    
+    lag_begin = max(coarse_lag*coarse_decimation-2*coarse_decimation, -(ls2-1))
+    lag_end = min(coarse_lag*coarse_decimation+2*coarse_decimation, ls1-1)+1
+    if lag_begin >= lag_end:
+        return corrabs_lean(s1,s2)
+    values = get_correlation_window(s1,s2,lag_begin,lag_end)
+    # The first maximum, like argmax in corrabs_lean
+    best = int(np.argmax(values))
+    return lag_begin+best,float(values[best])
+
+'''
+GCC-PHAT (phase transform).
+The cross spectrum is divided by its magnitude, so all the frequencies have the same weight and the peak is a few samples wide.
+The low frequencies of music or of a dubbed voice don't hide the common sound anymore, and shorter windows are enough.
+'''
+phat_epsilon = 1e-3
+phat_window = 40
+phat_min_confidence = 1.8
+peak_confidence_exclusion = 0.005
+
+def cross_correlation_phat(s1,s2):
+    '''
+    Absolute value of the GCC-PHAT of the signals, with the same lag convention and memory use as corrabs_lean.
+    '''
+    ls1 = len(s1)
+    ls2 = len(s2)
+    padsize = fft.next_fast_len(ls1+ls2+1, real=True)
+    spectrum_1 = fft.rfft(np.asarray(s1, dtype=np.float32), n=padsize)
+    spectrum_2 = fft.rfft(np.asarray(s2, dtype=np.float32), n=padsize)
+    np.conjugate(spectrum_2, out=spectrum_2)
+    spectrum_1 *= spectrum_2
+    spectrum_2 = None
+    magnitude = np.absolute(spectrum_1)
+    # The frequencies without energy (over the lowpass of a codec) are not amplified up to the level of the others
+    magnitude += phat_epsilon*float(magnitude.max())+np.finfo(np.float32).tiny
+    spectrum_1 /= magnitude
+    magnitude = None
+    corr = fft.irfft(spectrum_1, n=padsize, overwrite_x=True)
+    spectrum_1 = None
+    np.absolute(corr, out=corr)
+    return corr
+
+def corrabs_phat(s1,s2,exclusion):
+    '''
+    Return the lag in samples of the GCC-PHAT peak, its value and its confidence (get_peak_confidence with exclusion samples).
+    '''
+    corr = cross_correlation_phat(s1,s2)
+    xmax = int(np.argmax(corr))
+    value = float(corr[xmax])
+    confidence = get_peak_confidence(corr,xmax,exclusion)
+    if xmax < len(s1):
+        return xmax,value,confidence
+    else:
+        return xmax-len(corr),value,confidence
+
+def corrabs_sub_sample(s1,s2,exclusion):
+    '''
+    Lag in samples of the GCC-PHAT peak, with a parabolic interpolation between the samples around the peak, and its confidence.
+    '''
+    corr = cross_correlation_phat(s1,s2)
+    xmax = int(np.argmax(corr))
+    fraction = get_sub_sample_peak(corr,xmax)
+    confidence = get_peak_confidence(corr,xmax,exclusion)
+    if xmax < len(s1):
+        return xmax+fraction,confidence
+    else:
+        return xmax-len(corr)+fraction,confidence
+
+def get_sub_sample_peak(corr,index):
+    # Vertex of the parabola going through the peak and its two neighbours, in samples from index
+    before = float(corr[index-1])
+    peak = float(corr[index])
+    after = float(corr[(index+1) % len(corr)])
+    denominator = before - 2*peak + after
+    if denominator >= 0:
+        return 0.0
+    return 0.5*(before-after)/denominator
+
+def corrabs_phat_window(s1,s2,fs):
+    '''
+    GCC-PHAT on the first phat_window seconds of the signals, and on the whole signals only if this peak is not clear.
+    Raise an exception if the peak is still not clear.
+    '''
+    exclusion = max(1,int(peak_confidence_exclusion*fs))
+    window = int(phat_window*fs)
+    if window > 0 and max(len(s1),len(s2)) > window:
+        lag,value,confidence = corrabs_phat(s1[:window],s2[:window],exclusion)
+        if confidence >= phat_min_confidence:
+            return lag,value,confidence
+    lag,value,confidence = corrabs_phat(s1,s2,exclusion)
+    if confidence < phat_min_confidence:
+        raise Exception(f"GCC-PHAT peak not clear, confidence {confidence:.2f}")
+    return lag,value,confidence
+
+def get_peak_confidence(corr,index,exclusion):
+    '''
+    Sharpness of the peak at index: its height divided by the height of the highest other peak, more than exclusion samples away.
+    1 when two lags are as good, corr is modified.
+    '''
+    value = float(corr[index])
+    corr[np.arange(index-exclusion,index+exclusion+1) % len(corr)] = 0
+    second_value = float(np.max(corr))
+    if second_value <= 0:
+        return float("inf")
+    return value/second_value
+
+'''
+Overlap-save correlation.
+The signals are read by blocks, from a ffmpeg pipe or a memory mapped wav, and the correlation is accumulated only for the lags in
+[-overlap_save_max_lag,overlap_save_max_lag] seconds. The memory used depend of the memory budget, not of the length of the audio.
+'''
+overlap_save_max_lag = 30
+overlap_save_top_k = 5
+overlap_save_peak_distance = 0.01
+
+class pcm_block_reader():
+    '''
+    Read by blocks the raw PCM produced by ffmpeg
+    The host CPU tokens of the command (slots of tools.acquire_host_cpu_tokens) are released by close or kill.
+    '''
+    def __init__(self,cmd,slots=None):
+        self.cmd = cmd
+        self.slots = [slots]
+        self.process = Popen(self.cmd, stdout=PIPE, stderr=PIPE)
+
+    def read(self,number_samples):
+        block = np.empty(number_samples, dtype=np.int16)
+        buffer = memoryview(block).cast("B")
+        position = 0
+        while position < len(buffer):
+            read = self.process.stdout.readinto(buffer[position:])
+            if not read:
+                break
+            position += read
+        return block[:position//2]
+
+    def close(self):
+        try:
+            self.process.stdout.read()
+            stderror = self.process.stderr.read()
+            self.process.wait()
+        finally:
+            self.release_tokens()
+        if self.process.returncode != 0:
+            raise Exception("This cmd is in error: "+" ".join(self.cmd)+"\n"+str(stderror.decode("utf-8"))+"\nReturn code: "+str(self.process.returncode)+"\n")
+
+    def kill(self):
+        if self.process.poll() == None:
+            self.process.kill()
+            self.process.wait()
+        self.release_tokens()
+
+    def release_tokens(self):
+        tools.release_host_cpu_tokens(self.slots)
+        self.slots = []
+
+class array_block_reader():
+    '''
+    Read by blocks an array already available, like a memory mapped wav
+    '''
+    def __init__(self,signal):
+        self.signal = signal
+        self.position = 0
+
+    def read(self,number_samples):
+        block = np.array(self.signal[self.position:self.position+number_samples], dtype=np.int16)
+        self.position += len(block)
+        return block
+
+    def close(self):
+        self.signal = None
+
+    def kill(self):
+        self.signal = None
+
+def open_stream_block_readers(in1,in2):
+    cmds = [generate_stream_pcm_cmd(file_path,stream_order,cut_begin,cut_length,stream_sample_rate) for file_path,stream_order,cut_begin,cut_length in [in1,in2]]
+    slots = tools.acquire_host_cpu_tokens(cmds)
+    readers = []
+    try:
+        for cmd,slots_cmd in zip(cmds,slots):
+            readers.append(pcm_block_reader(cmd,slots_cmd))
+    except:
+        for reader in readers:
+            reader.kill()
+        tools.release_host_cpu_tokens(slots[len(readers):])
+        raise
+    return stream_sample_rate,readers[0],readers[1]
+
+def open_wav_block_readers(in1,in2):
+    fs,s1,s2 = read_normalized(in1,in2,mmap=True)
+    return fs,array_block_reader(s1),array_block_reader(s2)
+
+def get_overlap_save_sizes(max_lag,memory):
+    '''
+    Return the FFT size and the number of new samples by block for a memory budget in bytes.
+    By sample of the FFT: the s1 window and the s2 block in float32, the two complex64 half spectrums and the float32 result.
+    '''
+    max_fft_size = (memory - 8*(2*max_lag+1))//20
+    if max_fft_size - max_fft_size//32 - 2*max_lag < max(max_lag, 4096):
+        raise Exception(f"Not enough memory for the overlap-save correlation: {memory//(1024*1024)} MB for a max lag of {max_lag} samples")
+    fft_size = fft.next_fast_len(max_fft_size - max_fft_size//32, real=True)
+    return fft_size,fft_size - 2*max_lag
+
+def get_overlap_save_min_memory(max_lag):
+    '''
+    Smallest memory budget in bytes accepted by get_overlap_save_sizes for max_lag.
+    '''
+    max_fft_size = -(-(2*max_lag + max(max_lag, 4096))*32//31) + 32
+    return 20*max_fft_size + 8*(2*max_lag+1)
+
+def get_top_peaks(corr,top_k,min_distance):
+    '''
+    Index and value of the top_k highest peaks of corr, separated by at least min_distance. corr is modified.
+    '''
+    peaks = []
+    for k in range(top_k):
+        index = int(np.argmax(corr))
+        if corr[index] <= 0:
+            break
+        peaks.append((index,float(corr[index])))
+        corr[max(0,index-min_distance):index+min_distance+1] = 0
+    return peaks
+
+def corrabs_overlap_save(reader1,reader2,max_lag,memory,top_k=overlap_save_top_k,min_distance=1):
+    '''
+    Same correlation as corrabs_lean, calculated by blocks of s2 with the overlap-save method and limited to the lags in [-max_lag,max_lag].
+    The s1 window of a block start max_lag samples before the block and finish max_lag samples after it,
+    so the max_lag first samples of the circular correlation are not aliased.
+    Return the top_k peaks (lag in samples, value), the highest first.
+    '''
+    fft_size,block_size = get_overlap_save_sizes(max_lag,memory)
+    number_lags = 2*max_lag+1
+    corr = np.zeros(number_lags, dtype=np.float64)
+    window_s1 = np.zeros(fft_size, dtype=np.float32)
+    block_s1 = reader1.read(fft_size-max_lag)
+    window_s1[max_lag:max_lag+len(block_s1)] = block_s1
+    block_s2 = np.zeros(fft_size, dtype=np.float32)
+    
+    while True:
+        new_s2 = reader2.read(block_size)
+        if len(new_s2) == 0:
+            break
+        block_s2[:len(new_s2)] = new_s2
+        block_s2[len(new_s2):] = 0
+        spectrum_1 = fft.rfft(window_s1)
+        spectrum_2 = fft.rfft(block_s2)
+        np.conjugate(spectrum_2, out=spectrum_2)
+        spectrum_1 *= spectrum_2
+        spectrum_2 = None
+        corr += fft.irfft(spectrum_1, n=fft_size, overwrite_x=True)[:number_lags]
+        spectrum_1 = None
+        if len(new_s2) < block_size:
+            break
+        
+        window_s1[:fft_size-block_size] = window_s1[block_size:]
+        block_s1 = reader1.read(block_size)
+        window_s1[fft_size-block_size:fft_size-block_size+len(block_s1)] = block_s1
+        window_s1[fft_size-block_size+len(block_s1):] = 0
+    
+    np.absolute(corr, out=corr)
+    # corr[m] is the lag m-max_lag
+    return [(index-max_lag,value) for index,value in get_top_peaks(corr,top_k,min_distance)]
+
 """
 Visualisation
 """
@@ -275,12 +886,82 @@ def show2(fs,s1,s2,title=None):
     show1(fs,s2,'red')
     plt.show()
 
-lock_fallback = RLock()
+class memory_budget():
+    '''
+    Admission of the second correlations by their estimated peak memory (in bytes).
+    The correlations are admitted in their arrival order, as many as fit in the budget.
+    A correlation bigger than the budget is admitted alone, so with a budget of 0 they run one by one.
+    '''
+    def __init__(self,size):
+        self.size = size
+        self.used = 0
+        self.running = 0
+        self.queue = []
+        self.condition = Condition()
+        self.total_wait = 0.0
+        self.admitted = 0
+
+    def acquire(self,memory):
+        begin = time.time()
+        ticket = object()
+        with self.condition:
+            self.queue.append(ticket)
+            while self.queue[0] is not ticket or (self.running > 0 and self.used+memory > self.size):
+                self.condition.wait()
+            self.queue.pop(0)
+            self.used += memory
+            self.running += 1
+            wait = time.time()-begin
+            self.total_wait += wait
+            self.admitted += 1
+            self.condition.notify_all()
+        return wait
+
+    def release(self,memory):
+        with self.condition:
+            self.used -= memory
+            self.running -= 1
+            self.condition.notify_all()
+
+fallback_memory_budget = memory_budget(0)
+
+def estimate_memory_corrabs(ls1,ls2):
+    '''
+    Peak memory of the second correlation (corrabs_lean, corrabs_phat or corrabs_coarse_to_fine) for signals of ls1 and ls2 samples.
+    corrabs_lean: the int16 signals, their float32 copies, the padded input, the two complex64 half spectrums and the result.
+    '''
+    padsize = fft.next_fast_len(ls1+ls2+1, real=True)
+    memory_lean = 6*(ls1+ls2) + 16*padsize
+    if tools.fallback_correlation_phat:
+        # corrabs_phat: corrabs_lean and the float32 magnitude of the cross spectrum
+        return memory_lean + 2*padsize
+    if (not tools.coarse_to_fine) or min(ls1,ls2) < coarse_decimation*4096:
+        return memory_lean
+    # The int16 signals, the float32 decimated signals, the coarse search on them and the float64 blocks of the fine search
+    return 2*(ls1+ls2) + (4*(ls1+ls2)+memory_lean)//coarse_decimation + 16*fine_block
+
+def get_number_samples_stream(cut_length):
+    # One second more, the estimation of the length can be a little too short
+    return int(tools.time_to_seconds(cut_length)*stream_sample_rate)+stream_sample_rate
+
+def estimate_memory_file(in1,in2):
+    # wavfile.read load all the channels, the size of the files is an upper bound of the number of samples
+    return estimate_memory_corrabs(path.getsize(in1)//2,path.getsize(in2)//2)
+
+def estimate_memory_stream(in1,in2):
+    return estimate_memory_corrabs(get_number_samples_stream(in1[3]),get_number_samples_stream(in2[3]))
+
+def estimate_memory_overlap_save():
+    return tools.fallback_correlation_memory*1024*1024
+
 def second_correlation(in1,in2):
     try:
         begin = time.time()
-        stdout, stderror, exitCode = tools.launch_cmdExt_with_timeout_reload([tools.software["audio_sync"],in1,in2],5,3600)
-        data = json.loads(stdout.decode("utf-8").strip())
+        if tools.audio_sync_pool != None:
+            data = tools.audio_sync_pool.correlate(in1,in2)
+        else:
+            stdout, stderror, exitCode = tools.launch_cmdExt_with_timeout_reload([tools.software["audio_sync"],in1,in2],5,3600)
+            data = json.loads(stdout.decode("utf-8").strip())
         file = data['file']
         offset = data['offset_seconds']
         if tools.dev:
@@ -288,37 +969,90 @@ def second_correlation(in1,in2):
     except Exception as e:
         # If audio_sync is not installed, we return the file and offset
         sys.stderr.write(f"\t\taudio_sync not working: {e}\n")
-        
-        with lock_fallback:
-            begin = time.time()
-            fs,s1,s2 = read_normalized(in1,in2)
-            ls1,ls2,padsize,xmax,ca = corrabs(s1,s2)
-            ls1 = None
-            ls2 = None
-            ca = None
-            s1 = None
-            s2 = None
-            # if show: show1(fs,ca,title='Correlation',v=xmax/fs) Change if we want reports
-            #sync_text = """
-            #==============================================================================
-            #%s needs 'ffmpeg -ss %s' cut to get in sync
-            #==============================================================================
-            #"""
-            if xmax > padsize // 2:
-                # if show: show2(fs,s1,s2[padsize-xmax:],title='1st=blue;2nd=red=cut(%s;%s)'%(in1,in2))
-                file,offset = in2,(padsize-xmax)/fs
-            else:
-                # if show: show2(fs,s1[xmax:],s2,title='1st=blue=cut;2nd=red (%s;%s)'%(in1,in2))
-                file,offset = in1,xmax/fs
-            #print(sync_text%(file,offset))
-            padsize = None
-            xmax = None
-            fs = None
-            gc.collect()
-        
-        if tools.dev:
-            sys.stderr.write(f"\t\tSecond correlation in old function took {time.time()-begin:.2f} seconds\n\t\tand we obtain: {file} in offset {offset}\n")
+        if tools.fallback_correlation_memory > 0:
+            file,offset = second_correlation_overlap_save(open_wav_block_readers,in1,in2)
+        else:
+            file,offset = second_correlation_signals(read_normalized,in1,in2,estimate_memory_file(in1,in2))
+    
+    return file,offset
+
+def second_correlation_stream(in1,in2):
+    # in1 and in2 are (file path, StreamOrder, cut begin, cut length), the audio never touch the disk
+    if tools.fallback_correlation_memory > 0:
+        return second_correlation_overlap_save(open_stream_block_readers,in1,in2)
+    if tools.fallback_correlation_phat and phat_window > 0 and tools.time_to_seconds(in1[3]) > phat_window:
+        # Only the window is decoded, the whole cut only if the peak is not clear
+        in1_window = (in1[0],in1[1],in1[2],str(phat_window))
+        in2_window = (in2[0],in2[1],in2[2],str(phat_window))
+        try:
+            file,offset = second_correlation_signals(read_normalized_stream,in1_window,in2_window,estimate_memory_stream(in1_window,in2_window))
+            if file == in1_window:
+                return in1,offset
+            return in2,offset
+        except Exception as e:
+            if tools.dev:
+                sys.stderr.write(f"\t\tSecond correlation on {phat_window} seconds not conclusive, the whole cut is used: {e}\n")
+    return second_correlation_signals(read_normalized_stream,in1,in2,estimate_memory_stream(in1,in2))
+
+def second_correlation_overlap_save(open_readers,in1,in2):
+    memory = estimate_memory_overlap_save()
+    wait = fallback_memory_budget.acquire(memory)
+    try:
+        begin = time.time()
+        fs,reader1,reader2 = open_readers(in1,in2)
+        try:
+            # Audios above the stream sample rate need more than the memory checked at the start
+            peaks = corrabs_overlap_save(reader1,reader2,int(overlap_save_max_lag*fs),max(tools.fallback_correlation_memory*1024*1024,get_overlap_save_min_memory(int(overlap_save_max_lag*fs))),min_distance=int(overlap_save_peak_distance*fs))
+            reader1.close()
+            reader2.close()
+        except:
+            reader1.kill()
+            reader2.kill()
+            raise
+        if len(peaks) == 0:
+            raise Exception("No correlation peak found")
+        lag = peaks[0][0]
+        if lag < 0:
+            file,offset = in2,-lag/fs
+        else:
+            file,offset = in1,lag/fs
+    finally:
+        fallback_memory_budget.release(memory)
+    
+    if tools.dev:
+        sys.stderr.write(f"\t\tSecond correlation with overlap-save waited {wait:.2f} seconds for {memory//(1024*1024)} MB of memory and took {time.time()-begin:.2f} seconds\n\t\tand we obtain: {file} in offset {offset}\n\t\tpeaks (lag in samples, value): {peaks}\n")
+    return file,offset
+
+def second_correlation_signals(read_signals,in1,in2,memory):
+    wait = fallback_memory_budget.acquire(memory)
+    try:
+        begin = time.time()
+        fs,s1,s2 = read_signals(in1,in2)
+        if tools.fallback_correlation_phat:
+            lag,value,confidence = corrabs_phat_window(s1,s2,fs)
+        elif tools.coarse_to_fine:
+            lag,value = corrabs_coarse_to_fine(s1,s2)
+        else:
+            lag,value = corrabs_lean(s1,s2)
+        s1 = None
+        s2 = None
+        #sync_text = """
+        #==============================================================================
+        #%s needs 'ffmpeg -ss %s' cut to get in sync
+        #==============================================================================
+        #"""
+        if lag < 0:
+            file,offset = in2,-lag/fs
+        else:
+            file,offset = in1,lag/fs
+        #print(sync_text%(file,offset))
+        fs = None
+        gc.collect()
+    finally:
+        fallback_memory_budget.release(memory)
     
+    if tools.dev:
+        sys.stderr.write(f"\t\tSecond correlation in old function waited {wait:.2f} seconds for {memory//(1024*1024)} MB of memory and took {time.time()-begin:.2f} seconds\n\t\tand we obtain: {file} in offset {offset}\n")
     return file,offset
 
 '''
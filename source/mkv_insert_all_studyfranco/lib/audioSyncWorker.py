@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+    plugins.global_settings.py
+
+    Written by:               Josh.5 <jsunnex@gmail.com>
+    Date:                     10 Jun 2022, (6:52 PM)
+
+    Copyright:
+        Copyright (C) 2021 Josh Sunnex
+
+        This program is free software: you can redistribute it and/or modify it under the terms of the GNU General
+        Public License as published by the Free Software Foundation, version 3.
+
+        This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+        implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+        for more details.
+
+        You should have received a copy of the GNU General Public License along with this program.
+        If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import sys
+import time
+from queue import Queue,Empty
+from subprocess import Popen, PIPE, TimeoutExpired
+from threading import Thread
+import psutil
+import tools
+
+class audio_sync_worker():
+    '''
+    A long-lived audio_sync process. One JSON request by line is sent on its stdin:
+        {"id": 1, "in1": "file_1.wav", "in2": "file_2.wav"}
+    and it answers one JSON line on its stdout:
+        {"id": 1, "file": "file_1.wav", "offset_seconds": 0.52} or {"id": 1, "error": "message"}
+    '''
+    response_poll = 10
+    def __init__(self,cmd):
+        self.cmd = cmd
+        self.process = None
+        self.responses = None
+        self.request_id = 0
+
+    def start(self):
+        self.process = Popen(self.cmd, stdin=PIPE, stdout=PIPE, text=True, bufsize=1)
+        self.responses = Queue()
+        Thread(target=self.read_responses, args=(self.process,self.responses), daemon=True).start()
+
+    @staticmethod
+    def read_responses(process,responses):
+        for line in process.stdout:
+            responses.put(line)
+        responses.put(None)
+
+    def stop(self):
+        if self.process != None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (OSError,TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def kill(self):
+        if self.process != None:
+            try:
+                self.process.kill()
+                self.process.wait()
+            except OSError:
+                pass
+            self.process = None
+
+    def is_idle(self):
+        # The CPU of the worker and of its children (ffmpeg, ...) during 2 seconds
+        try:
+            ps_proc = psutil.Process(self.process.pid)
+            if ps_proc.status() == psutil.STATUS_ZOMBIE:
+                return True
+            ps_procs = [ps_proc]+ps_proc.children(recursive=True)
+            for ps_proc in ps_procs:
+                ps_proc.cpu_percent(interval=None)
+            time.sleep(2)
+            cpu_percent = 0
+            for ps_proc in ps_procs:
+                try:
+                    cpu_percent += ps_proc.cpu_percent(interval=None)
+                except psutil.NoSuchProcess:
+                    pass
+            return cpu_percent < 0.05
+        except psutil.NoSuchProcess:
+            return True
+
+    def request(self,in1,in2,timeout,max_idle_check=3):
+        '''
+        Return the response of the worker. Raise an exception if the worker stop, timeout,
+        or stay idle during max_idle_check consecutive checks (one check every response_poll seconds without response).
+        '''
+        if self.process == None or self.process.poll() != None:
+            self.kill()
+            self.start()
+        self.request_id += 1
+        self.process.stdin.write(json.dumps({"id": self.request_id, "in1": in1, "in2": in2})+"\n")
+        self.process.stdin.flush()
+        start_time = time.time()
+        idle_check = 0
+        while True:
+            try:
+                line = self.responses.get(timeout=self.response_poll)
+            except Empty:
+                if time.time() - start_time > timeout:
+                    raise Exception(f"The audio_sync worker is timeout: {' '.join(self.cmd)}")
+                if self.is_idle():
+                    idle_check += 1
+                    if idle_check >= max_idle_check:
+                        raise Exception(f"The audio_sync worker is hang: {' '.join(self.cmd)}")
+                else:
+                    idle_check = 0
+                continue
+            if line == None:
+                raise Exception(f"The audio_sync worker stopped: {' '.join(self.cmd)}, return code {self.process.wait()}")
+            data = json.loads(line)
+            if data.get("id") == self.request_id:
+                return data
+
+class audio_sync_worker_pool():
+    '''
+    Keep number_workers audio_sync workers for the whole task.
+    A worker who stop, hang or timeout is killed and the request is sent again to a new process, max_restart times.
+    '''
+    def __init__(self,cmd,number_workers,timeout=3600,max_restart=5):
+        self.timeout = timeout
+        self.max_restart = max_restart
+        self.workers = [audio_sync_worker(cmd) for i in range(number_workers)]
+        self.idle_workers = Queue()
+        for worker in self.workers:
+            self.idle_workers.put(worker)
+
+    def correlate(self,in1,in2):
+        worker = self.idle_workers.get()
+        try:
+            restart = self.max_restart
+            data = None
+            while data == None:
+                try:
+                    data = worker.request(in1,in2,self.timeout)
+                except Exception as e:
+                    worker.kill()
+                    restart -= 1
+                    if restart < 0:
+                        raise e
+                    if tools.dev:
+                        sys.stderr.write(f"\t\t{e}\n\t\tThe audio_sync worker will be restarted\n")
+        finally:
+            self.idle_workers.put(worker)
+        if "error" in data:
+            raise Exception(f"audio_sync error: {data['error']}")
+        return data
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+    plugins.global_settings.py
+
+    Written by:               Josh.5 <jsunnex@gmail.com>
+    Date:                     10 Jun 2022, (6:52 PM)
+
+    Copyright:
+        Copyright (C) 2021 Josh Sunnex
+
+        This program is free software: you can redistribute it and/or modify it under the terms of the GNU General
+        Public License as published by the Free Software Foundation, version 3.
+
+        This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+        implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+        for more details.
+
+        You should have received a copy of the GNU General Public License along with this program.
+        If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+'''
+Chroma fingerprint in NumPy, built like the default algorithm of Chromaprint (fpcalc):
+mono PCM at 11025 Hz, Hamming windowed frames of 4096 samples every 1365 samples, power spectrum folded in 12 chroma bins (28 Hz to 3520 Hz),
+5 frames smoothing, euclidean normalisation, then 16 Haar-like classifiers on the chroma image quantized in 2 bits each (one uint32 by item).
+The fingerprints are computed from PCM arrays, without fpcalc process, and compared with the functions of audioCorrelation.
+'''
+import numpy as np
+from scipy import fft
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+from math import gcd
+
+sample_rate = 11025
+frame_size = 4096
+frame_hop = frame_size//3
+min_freq = 28
+max_freq = 3520
+chroma_filter_coefficients = np.array([0.25, 0.75, 1.0, 0.75, 0.25])
+chunk_frames = 1024
+
+# (filter type, first chroma bin, number of chroma bins, number of frames), (quantizer thresholds)
+classifiers = [
+    ((0, 4, 3, 15), (1.98215, 2.35817, 2.63523)),
+    ((4, 4, 6, 15), (-1.03809, -0.651211, -0.282167)),
+    ((1, 0, 4, 16), (-0.298702, 0.119262, 0.558497)),
+    ((3, 8, 2, 12), (-0.105439, 0.0153946, 0.135898)),
+    ((3, 4, 4, 8), (-0.142891, 0.0258736, 0.200632)),
+    ((4, 0, 3, 5), (-0.826319, -0.590612, -0.368214)),
+    ((1, 2, 2, 9), (-0.557409, -0.233035, 0.0534525)),
+    ((2, 7, 3, 4), (-0.0646826, 0.00620476, 0.0784847)),
+    ((2, 6, 2, 16), (-0.192387, -0.029699, 0.215855)),
+    ((2, 1, 3, 2), (-0.0397818, -0.00568076, 0.0292026)),
+    ((5, 10, 1, 15), (-0.53823, -0.369934, -0.190235)),
+    ((3, 6, 2, 10), (-0.124877, 0.0296483, 0.139239)),
+    ((2, 1, 1, 14), (-0.101475, 0.0225617, 0.231971)),
+    ((3, 5, 6, 4), (-0.0799915, -0.00729616, 0.063262)),
+    ((1, 9, 2, 12), (-0.272556, 0.019424, 0.302559)),
+    ((3, 4, 2, 14), (-0.164292, -0.0321188, 0.0846339)),
+]
+max_filter_width = max([filter_params[3] for filter_params,thresholds in classifiers])
+gray_code = np.array([0, 1, 3, 2], dtype=np.uint32)
+
+def get_chroma_bins():
+    '''
+    Index of the first FFT bin, and chroma bin of each FFT bin up to max_freq.
+    '''
+    min_index = max(1, int(round(frame_size*min_freq/sample_rate)))
+    max_index = min(frame_size//2, int(round(frame_size*max_freq/sample_rate)))
+    octaves = np.log2(np.arange(min_index, max_index)*sample_rate/frame_size/(440.0/16.0))
+    return min_index,(12*(octaves-np.floor(octaves))).astype(np.intp)
+
+class chroma_extractor():
+    '''
+    Chroma of the frames of a PCM stream. The samples can be given by blocks of any size, like they are read from a decode pipe.
+    '''
+
+    def __init__(self):
+        self.window = np.hamming(frame_size).astype(np.float32)
+        self.min_index,self.notes = get_chroma_bins()
+        # The power of each FFT bin is added to its chroma bin with one matrix product
+        self.notes_matrix = np.zeros((len(self.notes), 12))
+        self.notes_matrix[np.arange(len(self.notes)), self.notes] = 1.0
+        self.remaining = np.empty(0, dtype=np.float32)
+        self.chroma = []
+
+    def feed(self,samples):
+        signal = np.concatenate((self.remaining, np.asarray(samples, dtype=np.float32)))
+        number_frames = (len(signal)-frame_size)//frame_hop+1 if len(signal) >= frame_size else 0
+        for begin in range(0,number_frames,chunk_frames):
+            end = min(number_frames,begin+chunk_frames)
+            frames = np.lib.stride_tricks.sliding_window_view(signal[begin*frame_hop:(end-1)*frame_hop+frame_size], frame_size)[::frame_hop]
+            spectrum = fft.rfft(frames*self.window, axis=1)[:, self.min_index:self.min_index+len(self.notes)]
+            power = spectrum.real.astype(np.float64)**2 + spectrum.imag.astype(np.float64)**2
+            self.chroma.append(power @ self.notes_matrix)
+        self.remaining = signal[number_frames*frame_hop:]
+
+    def get_chroma(self):
+        if len(self.chroma) == 0:
+            return np.zeros((0, 12))
+        return np.concatenate(self.chroma)
+
+def filter_and_normalise_chroma(chroma):
+    number_frames = len(chroma)-len(chroma_filter_coefficients)+1
+    if number_frames < 1:
+        return np.zeros((0, 12))
+    filtered = np.zeros((number_frames, 12))
+    for position,coefficient in enumerate(chroma_filter_coefficients):
+        filtered += coefficient*chroma[position:position+number_frames]
+    norm = np.sqrt(np.sum(filtered**2, axis=1))
+    silent = norm < 0.01
+    norm[silent] = 1.0
+    filtered /= norm[:, None]
+    filtered[silent] = 0.0
+    return filtered
+
+def get_areas(integral,x,y,width,height,number_items):
+    # Sum of the image on the frames [x+item, x+item+width) and the chroma bins [y, y+height) for each item
+    return integral[x+width:x+width+number_items, y+height] - integral[x:x+number_items, y+height] - integral[x+width:x+width+number_items, y] + integral[x:x+number_items, y]
+
+def apply_filter(integral,filter_type,y,height,width,number_items):
+    if filter_type == 0:
+        a = get_areas(integral,0,y,width,height,number_items)
+        b = 0.0
+    elif filter_type == 1:
+        half = height//2
+        a = get_areas(integral,0,y+half,width,height-half,number_items)
+        b = get_areas(integral,0,y,width,half,number_items)
+    elif filter_type == 2:
+        half = width//2
+        a = get_areas(integral,half,y,width-half,height,number_items)
+        b = get_areas(integral,0,y,half,height,number_items)
+    elif filter_type == 3:
+        half_height = height//2
+        half_width = width//2
+        a = get_areas(integral,0,y+half_height,half_width,height-half_height,number_items) + get_areas(integral,half_width,y,width-half_width,half_height,number_items)
+        b = get_areas(integral,0,y,half_width,half_height,number_items) + get_areas(integral,half_width,y+half_height,width-half_width,height-half_height,number_items)
+    elif filter_type == 4:
+        third = height//3
+        a = get_areas(integral,0,y+third,width,third,number_items)
+        b = get_areas(integral,0,y,width,third,number_items) + get_areas(integral,0,y+2*third,width,height-2*third,number_items)
+    else:
+        third = width//3
+        a = get_areas(integral,third,y,third,height,number_items)
+        b = get_areas(integral,0,y,third,height,number_items) + get_areas(integral,2*third,y,width-2*third,height,number_items)
+    return np.log1p(a) - np.log1p(b)
+
+def calculate_fingerprints_chroma(chroma):
+    '''
+    uint32 fingerprint of the raw chroma of the frames, one item by frame after the first max_filter_width-1 filtered frames.
+    '''
+    image = filter_and_normalise_chroma(chroma)
+    number_items = len(image)-max_filter_width+1
+    if number_items < 1:
+        return np.zeros(0, dtype=np.uint32)
+    integral = np.zeros((len(image)+1, 13))
+    integral[1:, 1:] = np.cumsum(np.cumsum(image, axis=0), axis=1)
+    fingerprints = np.zeros(number_items, dtype=np.uint32)
+    for (filter_type,y,height,width),thresholds in classifiers:
+        values = apply_filter(integral,filter_type,y,height,width,number_items)
+        fingerprints = (fingerprints << np.uint32(2)) | gray_code[np.searchsorted(thresholds, values, side='right')]
+    return fingerprints
+
+def calculate_fingerprints_pcm(signal,rate=sample_rate):
+    '''
+    Fingerprint of a mono PCM array (int16 or float at the same scale).
+    '''
+    if rate != sample_rate:
+        divisor = gcd(int(rate), sample_rate)
+        signal = resample_poly(np.asarray(signal, dtype=np.float32), sample_rate//divisor, int(rate)//divisor)
+    extractor = chroma_extractor()
+    extractor.feed(signal)
+    return calculate_fingerprints_chroma(extractor.get_chroma())
+
+def calculate_fingerprints_wav(filename,length=None):
+    '''
+    Fingerprint of the first channel of a wav file, on the first length seconds like fpcalc -length.
+    '''
+    rate,signal = wavfile.read(filename, mmap=True)
+    if len(signal.shape) > 1:
+        signal = signal[:, 0]
+    if length != None and length > 0:
+        signal = signal[:int(length*rate)]
+    return calculate_fingerprints_pcm(signal,rate)
+
+def calculate_fingerprints_pipe(stream,block_samples=sample_rate*60):
+    '''
+    Fingerprint of mono s16le PCM at 11025 Hz read from a pipe, one block at a time: only the chroma of the whole stream is kept in memory.
+    '''
+    extractor = chroma_extractor()
+    buffer = np.empty(block_samples, dtype=np.int16)
+    view = memoryview(buffer).cast("B")
+    pending = 0
+    while True:
+        read = stream.readinto(view[pending:])
+        if not read:
+            break
+        pending += read
+        if pending == len(view):
+            extractor.feed(buffer)
+            pending = 0
+    extractor.feed(buffer[:pending//2])
+    return calculate_fingerprints_chroma(extractor.get_chroma())
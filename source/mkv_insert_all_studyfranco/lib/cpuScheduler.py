@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+    plugins.global_settings.py
+
+    Written by:               Josh.5 <jsunnex@gmail.com>
+    Date:                     10 Jun 2022, (6:52 PM)
+
+    Copyright:
+        Copyright (C) 2021 Josh Sunnex
+
+        This program is free software: you can redistribute it and/or modify it under the terms of the GNU General
+        Public License as published by the Free Software Foundation, version 3.
+
+        This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+        implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+        for more details.
+
+        You should have received a copy of the GNU General Public License along with this program.
+        If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+
+import sys
+from heapq import heappush,heappop
+from itertools import count
+from threading import RLock,Event
+from time import time
+import tools
+
+priority_big_job = 0
+priority_job = 10
+
+class scheduled_result():
+    '''
+    Result of a job waiting in the scheduler, same get/wait/ready as the AsyncResult of the pool it is given to.
+    '''
+
+    def __init__(self):
+        self.dispatched = Event()
+        self.result = None
+        self.error = None
+
+    def set_result(self, result, error=None):
+        self.result = result
+        self.error = error
+        self.dispatched.set()
+
+    def get(self, timeout=None):
+        self.dispatched.wait()
+        if self.error != None:
+            raise self.error
+        return self.result.get(timeout)
+
+    def wait(self, timeout=None):
+        self.dispatched.wait()
+        if self.error == None:
+            self.result.wait(timeout)
+
+    def ready(self):
+        return self.dispatched.is_set() and (self.error != None or self.result.ready())
+
+class cpu_scheduler():
+    '''
+    Give the jobs to the pools when the CPU tokens they need are free.
+    The tokens are a fixed budget of cores, a job ask the number of threads it use (-threads of ffmpeg, n_threads of libvmaf).
+    apply_async only queue the job and return at once: the queue is dispatched by priority then by arrival,
+    when a job is queued and when a job end. A big job is waiting the cores it ask, and the jobs after it wait it.
+    Only call it from the main process. A scheduled job must not wait the result of another scheduled job:
+    it keeps its tokens while waiting, and the other job can wait these tokens forever.
+    '''
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.free_tokens = tokens
+        self.lock = RLock()
+        self.waiting = []
+        self.sequence = count()
+        self.begin = time()
+        self.last_change = self.begin
+        self.used_token_time = 0.0
+        self.wait_time = 0.0
+        self.number_jobs = 0
+
+    def account(self):
+        now = time()
+        self.used_token_time += (self.tokens-self.free_tokens)*(now-self.last_change)
+        self.last_change = now
+
+    def dispatch(self):
+        with self.lock:
+            while len(self.waiting) and self.waiting[0][2] <= self.free_tokens:
+                priority, sequence, tokens, pool, func, args, result, submit_time = heappop(self.waiting)
+                self.account()
+                self.free_tokens -= tokens
+                self.number_jobs += 1
+                self.wait_time += time()-submit_time
+                try:
+                    result.set_result(pool.apply_async(func, args, callback=lambda job_result, tokens=tokens: self.release(tokens), error_callback=lambda error, tokens=tokens: self.release(tokens)))
+                except Exception as e:
+                    self.account()
+                    self.free_tokens += tokens
+                    result.set_result(None, e)
+
+    def release(self, tokens):
+        with self.lock:
+            self.account()
+            self.free_tokens += tokens
+        self.dispatch()
+
+    def apply_async(self, pool, func, args=(), tokens=1, priority=priority_job):
+        '''
+        Queue the job for the pool. The tokens are taken when it is given to the pool and released at its end.
+        '''
+        result = scheduled_result()
+        with self.lock:
+            heappush(self.waiting, (priority, next(self.sequence), max(1,min(tokens,self.tokens)), pool, func, args, result, time()))
+        self.dispatch()
+        return result
+
+    def get_utilisation(self):
+        with self.lock:
+            self.account()
+            if self.last_change == self.begin:
+                return 0.0
+            return self.used_token_time/(self.tokens*(self.last_change-self.begin))
+
+    def report(self):
+        if tools.dev:
+            sys.stderr.write(f"\t\tCPU scheduler: {self.number_jobs} jobs on {self.tokens} tokens, {self.get_utilisation()*100:.1f}% used, {self.wait_time:.1f} s of wait in the queue\n")
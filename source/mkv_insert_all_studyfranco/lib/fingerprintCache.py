@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+    plugins.global_settings.py
+
+    Written by:               Josh.5 <jsunnex@gmail.com>
+    Date:                     10 Jun 2022, (6:52 PM)
+
+    Copyright:
+        Copyright (C) 2021 Josh Sunnex
+
+        This program is free software: you can redistribute it and/or modify it under the terms of the GNU General
+        Public License as published by the Free Software Foundation, version 3.
+
+        This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+        implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+        for more details.
+
+        You should have received a copy of the GNU General Public License along with this program.
+        If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import sqlite3
+import sys
+import time
+from os import stat
+from threading import RLock
+import numpy
+import tools
+
+class fingerprint_cache():
+    '''
+    Persistent cache of the chromaprint fingerprints.
+    The fingerprints are stored in a SQLite database shared by all the tasks,
+    with a LRU eviction when the database is bigger than max_size (in bytes).
+    The last access of the hits is kept in memory and written by batch (see flush_access), not on each get.
+    '''
+    access_flush_size = 256
+
+    def __init__(self, database_path, max_size):
+        self.database_path = database_path
+        self.max_size = max_size
+        self.lock = RLock()
+        self.hit = 0
+        self.miss = 0
+        self.access_pending = {}
+        self.connection = sqlite3.connect(database_path, timeout=60, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS fingerprints (key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS fingerprints_last_access ON fingerprints (last_access)")
+            self.connection.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM fingerprints WHERE key = ?", (key,)).fetchone()
+            if row == None:
+                self.miss += 1
+                return None
+            self.hit += 1
+            self.access_pending[key] = time.time()
+            if len(self.access_pending) >= self.access_flush_size:
+                self.flush_access()
+        return numpy.frombuffer(row[0], dtype=numpy.uint32)
+
+    def get_all(self, keys):
+        '''
+        Get the fingerprints for a list of list of keys (one list by audio, one key by cut).
+        Return None if one of them is not in the cache.
+        '''
+        fingerprints = []
+        for keys_audio in keys:
+            fingerprints_audio = []
+            fingerprints.append(fingerprints_audio)
+            for key in keys_audio:
+                fingerprint = self.get(key)
+                if fingerprint is None:
+                    return None
+                fingerprints_audio.append(fingerprint)
+        return fingerprints
+
+    def flush_access(self):
+        '''
+        Write the last access of the hits since the last flush, in one transaction.
+        '''
+        with self.lock:
+            if len(self.access_pending):
+                self.connection.executemany("UPDATE fingerprints SET last_access = ? WHERE key = ?", [(last_access, key) for key, last_access in self.access_pending.items()])
+                self.connection.commit()
+                self.access_pending = {}
+
+    def put(self, key, fingerprint):
+        data = numpy.ascontiguousarray(fingerprint, dtype=numpy.uint32).tobytes()
+        with self.lock:
+            # The eviction must see the recent hits
+            self.flush_access()
+            self.connection.execute("INSERT OR REPLACE INTO fingerprints (key, data, size, last_access) VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        with self.lock:
+            total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM fingerprints").fetchone()[0]
+            if total_size > self.max_size:
+                to_remove = []
+                for key, size in self.connection.execute("SELECT key, size FROM fingerprints ORDER BY last_access ASC"):
+                    if total_size <= self.max_size:
+                        break
+                    to_remove.append((key,))
+                    total_size -= size
+                self.connection.executemany("DELETE FROM fingerprints WHERE key = ?", to_remove)
+                if tools.dev:
+                    sys.stderr.write(f"\t\tFingerprint cache evict {len(to_remove)} fingerprints\n")
+
+    def close(self):
+        with self.lock:
+            if tools.dev:
+                sys.stderr.write(f"\t\tFingerprint cache: {self.hit} hit and {self.miss} miss\n")
+            self.flush_access()
+            self.connection.close()
+
+def get_file_identity(file_path):
+    file_stat = stat(file_path)
+    return f"{file_stat.st_ino}:{file_stat.st_size}:{file_stat.st_mtime_ns}"
+
+def generate_key(stream_identity, stream_order, cut_begin, cut_length, extraction_params):
+    return json.dumps([stream_identity, str(stream_order), str(cut_begin), str(cut_length), extraction_params], sort_keys=True)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+    plugins.global_settings.py
+
+    Written by:               Josh.5 <jsunnex@gmail.com>
+    Date:                     10 Jun 2022, (6:52 PM)
+
+    Copyright:
+        Copyright (C) 2021 Josh Sunnex
+
+        This program is free software: you can redistribute it and/or modify it under the terms of the GNU General
+        Public License as published by the Free Software Foundation, version 3.
+
+        This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+        implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+        for more details.
+
+        You should have received a copy of the GNU General Public License along with this program.
+        If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+
+import fcntl
+import sys
+import time
+from multiprocessing import Value
+from os import path
+import tools
+
+poll_time = 0.05
+
+class host_cpu_budget():
+    '''
+    CPU tokens shared by all the mkv_insert tasks of the host.
+    A token is a slot file locked with flock in a common folder, the kernel release the lock if the process die.
+    The guard file is only held to try the slots, never during the wait. A command takes all its tokens at once or none of them,
+    except the one holding the reservation file: it keeps the tokens collected, so the commands waiting for many tokens are not
+    starved by the small ones, and only one command keeps a part of its tokens (two of them would wait for each other).
+    Create it before the pools: the wait time is shared with the workers.
+    '''
+
+    def __init__(self, folder, tokens):
+        self.folder = folder
+        self.tokens = tokens
+        if (not tools.make_dirs(folder)):
+            raise Exception(f"Impossible to create the CPU tokens folder {folder}")
+        self.wait_time = Value('d', 0.0)
+        self.number_commands = Value('i', 0)
+
+    def lock_free_slots(self, slots, tokens):
+        with open(path.join(self.folder,"guard"),"a") as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            for slot_number in range(0,self.tokens):
+                if len(slots) == tokens:
+                    break
+                slot = open(path.join(self.folder,f"slot_{slot_number}"),"a")
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    slots.append(slot)
+                except BlockingIOError:
+                    # Not free, or already one of ours
+                    slot.close()
+
+    def try_reservation(self):
+        reservation = open(path.join(self.folder,"reservation"),"a")
+        try:
+            fcntl.flock(reservation, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return reservation
+        except BlockingIOError:
+            reservation.close()
+            return None
+
+    def acquire(self, tokens):
+        tokens = max(1,min(tokens,self.tokens))
+        begin_wait = time.time()
+        slots = []
+        reservation = None
+        try:
+            self.lock_free_slots(slots, tokens)
+            while len(slots) < tokens:
+                if reservation == None:
+                    reservation = self.try_reservation()
+                if reservation == None:
+                    self.release(slots)
+                    slots = []
+                time.sleep(poll_time)
+                self.lock_free_slots(slots, tokens)
+        except:
+            self.release(slots)
+            raise
+        finally:
+            if reservation != None:
+                reservation.close()
+        wait = time.time()-begin_wait
+        with self.wait_time.get_lock():
+            self.wait_time.value += wait
+        with self.number_commands.get_lock():
+            self.number_commands.value += 1
+        if tools.dev or wait >= poll_time:
+            sys.stderr.write(f"\t\tWaited {wait:.2f} s for {tokens} host CPU tokens\n")
+        return slots
+
+    def release(self, slots):
+        for slot in slots:
+            # Close the file release the lock
+            slot.close()
+
+    def report(self):
+        sys.stderr.write(f"Host CPU budget: {self.number_commands.value} commands on {self.tokens} tokens, {self.wait_time.value:.1f} s of wait for the tokens\n")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+    plugins.global_settings.py
+
+    Written by:               Josh.5 <jsunnex@gmail.com>
+    Date:                     10 Jun 2022, (6:52 PM)
+
+    Copyright:
+        Copyright (C) 2021 Josh Sunnex
+
+        This program is free software: you can redistribute it and/or modify it under the terms of the GNU General
+        Public License as published by the Free Software Foundation, version 3.
+
+        This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+        implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+        for more details.
+
+        You should have received a copy of the GNU General Public License along with this program.
+        If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+'''
+Integrated loudness of ITU-R BS.1770-4 / EBU R128 in NumPy, to normalise the extracted cuts without ffmpeg loudnorm passes.
+The signal is read by chunks, the K-weighted energy is summed by segments of 100 ms
+and the gated blocks of 400 ms (75 % overlap) are made from 4 consecutive segments.
+'''
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import lfilter
+
+chunk_segments = 600
+absolute_gate = -70.0
+relative_gate = -10.0
+
+def k_weighting_filters(rate):
+    # High shelf then high pass of BS.1770, for any sample rate (same coefficients as libebur128)
+    f0 = 1681.974450955533
+    G = 3.999843853973347
+    Q = 0.7071752369554196
+    K = np.tan(np.pi*f0/rate)
+    Vh = np.power(10.0, G/20.0)
+    Vb = np.power(Vh, 0.4996667741545416)
+    a0 = 1.0 + K/Q + K*K
+    shelf_b = np.array([(Vh + Vb*K/Q + K*K)/a0, 2.0*(K*K - Vh)/a0, (Vh - Vb*K/Q + K*K)/a0])
+    shelf_a = np.array([1.0, 2.0*(K*K - 1.0)/a0, (1.0 - K/Q + K*K)/a0])
+    
+    f0 = 38.13547087602444
+    Q = 0.5003270373238773
+    K = np.tan(np.pi*f0/rate)
+    a0 = 1.0 + K/Q + K*K
+    high_pass_b = np.array([1.0, -2.0, 1.0])
+    high_pass_a = np.array([1.0, 2.0*(K*K - 1.0)/a0, (1.0 - K/Q + K*K)/a0])
+    return [(shelf_b,shelf_a),(high_pass_b,high_pass_a)]
+
+def get_full_scale(dtype):
+    if np.issubdtype(dtype, np.integer):
+        return float(-np.iinfo(dtype).min)
+    return 1.0
+
+def integrated_loudness(signal, rate, channel_weights=None):
+    '''
+    Integrated loudness in LUFS of signal (samples or samples x channels, integer PCM or float in [-1,1]).
+    Return None if all the blocks are under the absolute gate (silence).
+    '''
+    if signal.ndim == 1:
+        signal = signal.reshape(-1,1)
+    number_channels = signal.shape[1]
+    if channel_weights == None:
+        channel_weights = np.ones(number_channels)
+    else:
+        channel_weights = np.asarray(channel_weights, dtype=np.float64)
+    full_scale = get_full_scale(signal.dtype)
+    filters = k_weighting_filters(rate)
+    filter_states = [np.zeros((2,number_channels)) for b,a in filters]
+    segment_size = int(round(rate*0.1))
+    number_segments = len(signal)//segment_size
+    
+    segment_energy = np.empty((number_segments,number_channels), dtype=np.float64)
+    for first_segment in range(0,number_segments,chunk_segments):
+        last_segment = min(first_segment+chunk_segments,number_segments)
+        chunk = signal[first_segment*segment_size:last_segment*segment_size].astype(np.float64)/full_scale
+        for filter_index,(b,a) in enumerate(filters):
+            chunk,filter_states[filter_index] = lfilter(b, a, chunk, axis=0, zi=filter_states[filter_index])
+        segment_energy[first_segment:last_segment] = np.square(chunk).reshape(-1,segment_size,number_channels).sum(axis=1)
+    
+    if number_segments < 4:
+        return None
+    # Blocks of 400 ms every 100 ms: 4 consecutive segments
+    cumulative_energy = np.concatenate((np.zeros((1,number_channels)), np.cumsum(segment_energy, axis=0)))
+    block_energy = ((cumulative_energy[4:]-cumulative_energy[:-4])/(4*segment_size)) @ channel_weights
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10.0*np.log10(block_energy)
+    gated_energy = block_energy[block_loudness > absolute_gate]
+    if len(gated_energy) == 0:
+        return None
+    relative_threshold = -0.691 + 10.0*np.log10(gated_energy.mean()) + relative_gate
+    gated_energy = block_energy[(block_loudness > absolute_gate) & (block_loudness > relative_threshold)]
+    return -0.691 + 10.0*np.log10(gated_energy.mean())
+
+def get_biquad_filters(rate, highpass=None, lowpass=None):
+    '''
+    Coefficients of the highpass and lowpass filters of ffmpeg (2 poles, Q of 0.707).
+    A frequency over the Nyquist frequency is not applied.
+    '''
+    filters = []
+    for frequency,high in [(highpass,True),(lowpass,False)]:
+        if frequency == None or frequency >= rate/2:
+            continue
+        w0 = 2.0*np.pi*frequency/rate
+        alpha = np.sin(w0)/(2.0*0.707)
+        cos_w0 = np.cos(w0)
+        if high:
+            b = np.array([(1.0+cos_w0)/2.0, -(1.0+cos_w0), (1.0+cos_w0)/2.0])
+        else:
+            b = np.array([(1.0-cos_w0)/2.0, 1.0-cos_w0, (1.0-cos_w0)/2.0])
+        a = np.array([1.0+alpha, -2.0*cos_w0, 1.0-alpha])
+        filters.append((b/a[0],a/a[0]))
+    return filters
+
+def apply_filters_and_gain_in_place(file_path, filters, gain_db):
+    '''
+    Filter the samples of a PCM wav and multiply them by the gain, directly in the file, with the clipping of the integer format.
+    '''
+    rate, signal = wavfile.read(file_path, mmap=True)
+    signal_in_place = np.memmap(file_path, dtype=signal.dtype, mode='r+', offset=signal.offset, shape=signal.shape)
+    signal = None
+    gain = np.power(10.0, gain_db/20.0)
+    if np.issubdtype(signal_in_place.dtype, np.integer):
+        min_value = np.iinfo(signal_in_place.dtype).min
+        max_value = np.iinfo(signal_in_place.dtype).max
+    filter_states = [np.zeros((2,)+signal_in_place.shape[1:]) for b,a in filters]
+    chunk_size = rate*60
+    for begin in range(0,len(signal_in_place),chunk_size):
+        chunk = signal_in_place[begin:begin+chunk_size].astype(np.float64)
+        for filter_index,(b,a) in enumerate(filters):
+            chunk,filter_states[filter_index] = lfilter(b, a, chunk, axis=0, zi=filter_states[filter_index])
+        chunk *= gain
+        if np.issubdtype(signal_in_place.dtype, np.integer):
+            np.clip(np.rint(chunk), min_value, max_value, out=chunk)
+        signal_in_place[begin:begin+chunk_size] = chunk
+    signal_in_place.flush()
+    signal_in_place = None
+
+def normalise_wav_file(file_path, target_i, highpass=None, lowpass=None, min_gain=0.5):
+    '''
+    Measure the integrated loudness of a PCM wav, then apply the highpass and lowpass filters and the gain to reach target_i (in LUFS)
+    in the same file. Like the ffmpeg normalisation, the loudness is measured before the filters,
+    and the gain is not applied if it is smaller than min_gain dB or if the loudness cannot be measured.
+    Return the gain applied in dB.
+    '''
+    rate, signal = wavfile.read(file_path, mmap=True)
+    measured_i = integrated_loudness(signal, rate)
+    signal = None
+    if measured_i == None:
+        gain_db = 0.0
+    else:
+        gain_db = float(target_i) - measured_i
+    if abs(gain_db) < min_gain:
+        gain_db = 0.0
+    filters = get_biquad_filters(rate, highpass, lowpass)
+    if len(filters) or gain_db != 0.0:
+        apply_filters_and_gain_in_place(file_path, filters, gain_db)
+    return gain_db
@@ -25,11 +25,15 @@
 import argparse
 from datetime import datetime
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from os import path,chdir,sched_getaffinity
 import traceback
 import tools
 import json
 import multiprocessing
+import psutil
+import shlex
+import sys
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='This script process mkv,mp4 file to generate best file', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -45,6 +49,27 @@ if __name__ == '__main__':
                         default="/tmp", help="Folder where send temporar files")
     parser.add_argument("--language_keep", metavar='language_keep', type=str,default="", help="List of languages to keep in the format iso 2 letter: fr,en,de")
     parser.add_argument("--remove_sub_language_not_keep", metavar='remove_sub_language_not_keep', type=str,default="False", help="Remove the subtitles not in the language to keep")
+    parser.add_argument("--correlation_sample_rate", metavar='correlation_sample_rate', type=int, default=0, help="Sample rate of the mono audio extracted to compare the files. 0 to keep the sample rate and the channels of the source")
+    parser.add_argument("--fallback_correlation", metavar='fallback_correlation', type=str, default="False", help="Use the second correlation when the fingerprints are not enough to compare two audios")
+    parser.add_argument("--fallback_correlation_stream", metavar='fallback_correlation_stream', type=str, default="True", help="The second correlation read the audio directly from ffmpeg, without temporary wav files")
+    parser.add_argument("--fallback_correlation_memory", metavar='fallback_correlation_memory', type=int, default=0, help="Memory in MB for the overlap-save second correlation. 0 to load the whole cuts in memory")
+    parser.add_argument("--fallback_correlation_budget", metavar='fallback_correlation_budget', type=int, default=0, help="Memory in MB shared by the second correlations running at the same time. 0 to use the half of the available memory")
+    parser.add_argument("--fallback_correlation_phat", metavar='fallback_correlation_phat', type=str, default="False", help="The NumPy second correlation use a GCC-PHAT weighting on a shorter window, the whole cut only if the peak is not clear")
+    parser.add_argument("--audio_sync_workers", metavar='audio_sync_workers', type=int, default=0, help="Number of audio_sync workers kept alive for the whole task. 0 to launch audio_sync for each correlation")
+    parser.add_argument("--audio_sync_worker_cmd", metavar='audio_sync_worker_cmd', type=str, default="", help="Command of an audio_sync worker (see audioSyncWorker). Without it, audio_sync is launched for each correlation")
+    parser.add_argument("--correlation_executor", metavar='correlation_executor', type=str, default="process", choices=["process","thread"], help="Run the fingerprint correlations in the processes of the audio conversion pool or in threads")
+    parser.add_argument("--fingerprint_full_track", metavar='fingerprint_full_track', type=str, default="False", help="Fingerprint each audio track in one pass with fpcalc -length 0 and slice the fingerprints of the cuts")
+    parser.add_argument("--fingerprint_backend", metavar='fingerprint_backend', type=str, default="fpcalc", choices=["fpcalc","numpy"], help="Calculate the audio fingerprints with fpcalc or in the process with NumPy")
+    parser.add_argument("--adaptive_cuts", metavar='adaptive_cuts', type=str, default="False", help="Correlate the cuts by waves and stop when the first cuts agree on the delay")
+    parser.add_argument("--coarse_to_fine", metavar='coarse_to_fine', type=str, default="False", help="Search the delays on subsampled fingerprints or decimated signals first, then only around the best coarse delays. Faster, but not always the delay of the full search")
+    parser.add_argument("--frame_accuracy", metavar='frame_accuracy', type=str, default="False", help="Align the video of the file on the source with a sub-frame audio delay, checked with the PSNR only when it is ambiguous")
+    parser.add_argument("--frame_psnr_engine", metavar='frame_psnr_engine', type=str, default="numpy", choices=["ffmpeg","numpy"], help="Calculate the PSNR of the frames to test with one ffmpeg by frame or with NumPy on cuts decoded one time")
+    parser.add_argument("--best_video_quality", metavar='best_video_quality', type=str, default="False", help="When the file have multiple video tracks, keep the one with the best VMAF")
+    parser.add_argument("--vmaf_fast_arbitration", metavar='vmaf_fast_arbitration', type=str, default="False", help="Compare the video tracks with a subsampled and downscaled VMAF, and stop when the gap is clear")
+    parser.add_argument("--cpu_token_dir", metavar='cpu_token_dir', type=str, default="", help="Folder shared by the tasks of the host where the CPU tokens are locked. Empty to not share a CPU budget")
+    parser.add_argument("--cpu_tokens", metavar='cpu_tokens', type=int, default=0, help="Number of CPU tokens shared by the tasks, 0 for the number of cores")
+    parser.add_argument("--fingerprint_cache", metavar='fingerprint_cache', type=str, default="", help="SQLite file where the audio fingerprints are cached between tasks. Empty to disable the cache")
+    parser.add_argument("--fingerprint_cache_size", metavar='fingerprint_cache_size', type=int, default=512, help="Maximum size of the fingerprint cache in MB")
     args = parser.parse_args()
     
     chdir(args.pwd)
@@ -62,6 +87,29 @@ if __name__ == '__main__':
             if args.remove_sub_language_not_keep == "True":
                 tools.remove_sub_language_not_keep = True
 
+        tools.correlation_sample_rate = args.correlation_sample_rate
+        tools.fingerprint_full_track = args.fingerprint_full_track == "True"
+        tools.fingerprint_backend = args.fingerprint_backend
+        tools.adaptive_cuts = args.adaptive_cuts == "True"
+        tools.coarse_to_fine = args.coarse_to_fine == "True"
+        tools.frame_accuracy = args.frame_accuracy == "True"
+        tools.frame_psnr_engine = args.frame_psnr_engine
+        tools.best_video_quality = args.best_video_quality == "True"
+        tools.vmaf_fast_arbitration = args.vmaf_fast_arbitration == "True"
+        if args.fallback_correlation == "True":
+            tools.fallback_correlation = True
+        tools.fallback_correlation_stream = args.fallback_correlation_stream == "True"
+        tools.fallback_correlation_memory = args.fallback_correlation_memory
+        if tools.fallback_correlation_memory > 0:
+            from audioCorrelation import get_overlap_save_min_memory,overlap_save_max_lag,stream_sample_rate
+            min_memory = -(-get_overlap_save_min_memory(overlap_save_max_lag*stream_sample_rate)//(1024*1024))
+            if tools.fallback_correlation_memory < min_memory:
+                sys.stderr.write(f"The memory of the second correlation is increased from {tools.fallback_correlation_memory} MB to {min_memory} MB, the minimum for delays up to {overlap_save_max_lag} seconds\n")
+                tools.fallback_correlation_memory = min_memory
+        tools.fallback_correlation_budget = args.fallback_correlation_budget
+        tools.fallback_correlation_phat = args.fallback_correlation_phat == "True"
+        tools.correlation_executor = args.correlation_executor
+
         if (not tools.make_dirs(tools.tmpFolder)):
             raise Exception("Impossible to create the temporar dir")
 
@@ -69,18 +117,62 @@ if __name__ == '__main__':
         if tools.core_to_use < 1:
             tools.core_to_use = 1
 
+        if args.cpu_token_dir != "":
+            import hostCpuBudget
+            if args.cpu_tokens > 0:
+                tools.host_cpu_budget = hostCpuBudget.host_cpu_budget(args.cpu_token_dir,args.cpu_tokens)
+            else:
+                tools.host_cpu_budget = hostCpuBudget.host_cpu_budget(args.cpu_token_dir,len(sched_getaffinity(0)))
+
         import mergeVideo
         import video
+        import audioCorrelation
+        import cpuScheduler
         
         video.ffmpeg_pool_audio_convert = Pool(processes=tools.core_to_use)
         video.ffmpeg_pool_big_job = Pool(processes=1)
+        video.job_scheduler = cpuScheduler.cpu_scheduler(tools.core_to_use)
+        if tools.correlation_executor == "thread":
+            video.correlation_pool = ThreadPool(processes=tools.core_to_use)
+        else:
+            # The correlations run when the audio conversion pool is idle, after the fingerprints
+            video.correlation_pool = video.ffmpeg_pool_audio_convert
+        
+        if tools.fallback_correlation_budget > 0:
+            audioCorrelation.fallback_memory_budget = audioCorrelation.memory_budget(tools.fallback_correlation_budget*1024*1024)
+        else:
+            audioCorrelation.fallback_memory_budget = audioCorrelation.memory_budget(psutil.virtual_memory().available//2)
+        
+        # Open after the pools creation, the connection is only used by this process
+        if args.fingerprint_cache != "":
+            import fingerprintCache
+            tools.fingerprint_cache = fingerprintCache.fingerprint_cache(args.fingerprint_cache,args.fingerprint_cache_size*1024*1024)
+        
+        if args.audio_sync_workers > 0:
+            if args.audio_sync_worker_cmd != "":
+                import audioSyncWorker
+                tools.audio_sync_pool = audioSyncWorker.audio_sync_worker_pool(shlex.split(args.audio_sync_worker_cmd),args.audio_sync_workers)
+            else:
+                # audio_sync itself has no worker mode, it is launched for each correlation
+                sys.stderr.write("No audio_sync worker command, audio_sync is launched for each correlation\n")
         
         with open("lib/titles_subs_group.json") as titles_subs_group_file:
             tools.group_title_sub = json.load(titles_subs_group_file)
 
         mergeVideo.merge_videos(args.file, args.source, args.out)
+        video.job_scheduler.report()
+        if tools.host_cpu_budget != None:
+            tools.host_cpu_budget.report()
+        if tools.fingerprint_cache != None:
+            tools.fingerprint_cache.close()
+        if tools.audio_sync_pool != None:
+            tools.audio_sync_pool.close()
         tools.remove_dir(tools.tmpFolder)
     except:
+        if tools.fingerprint_cache != None:
+            tools.fingerprint_cache.close()
+        if tools.audio_sync_pool != None:
+            tools.audio_sync_pool.close()
         tools.remove_dir(tools.tmpFolder)
         traceback.print_exc()
         exit(1)
@@ -25,13 +25,14 @@
 import re
 import sys
 from os import path,sched_getaffinity
-from time import strftime,gmtime
-from threading import Thread
+from time import strftime,gmtime,time
 import tools
 import video
-from audioCorrelation import correlate, test_calcul_can_be
+from audioCorrelation import calculate_fingerprints_array, calculate_full_track_fingerprints, slice_fingerprints, fingerprint_array, correlate_one_to_many_timed, test_calcul_can_be, second_correlation, second_correlation_stream
+from audioCorrelation import read_normalized_stream, corrabs_sub_sample, phat_window, peak_confidence_exclusion
 import gc
 from decimal import *
+from threading import Thread
 
 max_stream = 85
 
@@ -114,21 +115,34 @@ def get_good_parameters_to_get_fidelity(videosObj,language,audioParam,maxTime):
         timeTake = "00:01:00"
         maxTime = 60
     for videoObj in videosObj:
-        videoObj.extract_audio_in_part(language,audioParam,cutTime=[["00:00:00",timeTake]])
+        cache_key = None
+        if tools.fingerprint_cache != None:
+            cache_key = videoObj.get_audio_in_part_cache_keys(language,audioParam,[["00:00:00",timeTake]],maxTime)[0][0]
+            if tools.fingerprint_cache.get(cache_key) is not None:
+                continue
+        videoObj.extract_audio_in_part(language,audioParam,cutTime=[["00:00:00",timeTake]],correlation_method="fingerprint")
         videoObj.wait_end_ffmpeg_progress_audio()
-        if (not test_calcul_can_be(videoObj.tmpFiles['audio'][0][0],maxTime)):
+        if (not test_calcul_can_be(videoObj.tmpFiles['audio'][0][0],maxTime,cache_key)):
             raise Exception(f"Audio parameters to get the fidelity not working with {videoObj.filePath}")
 
 def prepare_get_delay_sub(videos_obj,language):
     audio_parameter_to_use_for_comparison = {'Format':"WAV",
                                              'codec':"pcm_s16le",
                                              'Channels':"2"}
-    min_channel = video.get_less_channel_number(videos_obj,language)
-    if min_channel == "1":
-        audio_parameter_to_use_for_comparison['Channels'] = min_channel
+    if tools.correlation_sample_rate > 0:
+        # Correlation profile: the first channel at a low sample rate, the fingerprints and the correlations don't need more
+        audio_parameter_to_use_for_comparison['Channels'] = "1"
+        audio_parameter_to_use_for_comparison['SamplingRate'] = str(tools.correlation_sample_rate)
+        audio_parameter_to_use_for_comparison['AudioFilter'] = f"pan=mono|c0=c0,aresample={tools.correlation_sample_rate}"
+    else:
+        min_channel = video.get_less_channel_number(videos_obj,language)
+        if min_channel == "1":
+            audio_parameter_to_use_for_comparison['Channels'] = min_channel
 
     min_video_duration_in_sec = video.get_shortest_audio_durations(videos_obj,language)
-    get_good_parameters_to_get_fidelity(videos_obj,language,audio_parameter_to_use_for_comparison,min_video_duration_in_sec)
+    if not tools.fingerprint_full_track:
+        # The full track fingerprints don't use the extracted audio, if they fail the cuts are extracted like before
+        get_good_parameters_to_get_fidelity(videos_obj,language,audio_parameter_to_use_for_comparison,min_video_duration_in_sec)
     
     begin_in_second,length_time = video.generate_begin_and_length_by_segment(min_video_duration_in_sec)
     length_time_converted = strftime('%H:%M:%S',gmtime(length_time*2))
@@ -136,55 +150,229 @@ def prepare_get_delay_sub(videos_obj,language):
 
     return begin_in_second,audio_parameter_to_use_for_comparison,length_time,length_time_converted,list_cut_begin_length
 
-class get_delay_fidelity_thread(Thread):
-    def __init__(self, video_obj_1_tmp_file,video_obj_2_tmp_file,lenghtTime):
-        Thread.__init__(self)
-        self.video_obj_1_tmp_file = video_obj_1_tmp_file
-        self.video_obj_2_tmp_file = video_obj_2_tmp_file
-        self.lenghtTime = lenghtTime
-        self.delay_Fidelity_Values  = None
+def calculate_fingerprints_cuts(video_obj,lenghtTime,cache_keys=None):
+    video_obj.wait_end_ffmpeg_progress_audio()
+    fingerprints_jobs = []
+    for tmp_files in video_obj.tmpFiles['audio']:
+        fingerprints_jobs.append([video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, calculate_fingerprints_array, (tmp_file,lenghtTime)) for tmp_file in tmp_files[:video.number_cut]])
+    fingerprints = [[fingerprints_job.get() for fingerprints_job in fingerprints_jobs_audio] for fingerprints_jobs_audio in fingerprints_jobs]
+    
+    if cache_keys != None and tools.fingerprint_cache != None:
+        for fingerprints_audio,cache_keys_audio in zip(fingerprints,cache_keys):
+            for fingerprint,cache_key in zip(fingerprints_audio,cache_keys_audio):
+                tools.fingerprint_cache.put(cache_key,fingerprint)
+    return fingerprints
 
-    def run(self):
-        self.delay_Fidelity_Values = correlate(self.video_obj_1_tmp_file,self.video_obj_2_tmp_file,self.lenghtTime)
+def calculate_fingerprints_full_track(video_obj,language,list_cut_begin_length,lenghtTime):
+    '''
+    Fingerprint each compatible audio one time on the whole track, then give the fingerprints of the cuts by slicing it.
+    Same layout as calculate_fingerprints_cuts: one list by audio, one fingerprint by cut.
+    '''
+    # The cuts are not extracted, so the positions are set here
+    video_obj.set_audio_pos_file(language)
+    cache_keys = video_obj.get_audio_full_track_cache_keys(language)
+    full_fingerprints = [None]*len(cache_keys)
+    fingerprints_jobs = []
+    for audio in video_obj.audios[language]:
+        if audio["compatible"]:
+            if tools.fingerprint_cache != None:
+                full_fingerprints[audio["audio_pos_file"]] = tools.fingerprint_cache.get(cache_keys[audio["audio_pos_file"]])
+            if full_fingerprints[audio["audio_pos_file"]] is None:
+                fingerprints_jobs.append((audio["audio_pos_file"],video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, calculate_full_track_fingerprints, (video_obj.filePath,audio['StreamOrder']))))
+    for audio_pos_file,fingerprints_job in fingerprints_jobs:
+        full_fingerprints[audio_pos_file] = fingerprints_job.get()
+        if tools.fingerprint_cache != None:
+            tools.fingerprint_cache.put(cache_keys[audio_pos_file],full_fingerprints[audio_pos_file])
+    if tools.dev:
+        sys.stderr.write(f"\t\tFull track fingerprints for {language}: {len(fingerprints_jobs)} calculated, {len(cache_keys)-len(fingerprints_jobs)} from the cache\n")
+    return [[slice_fingerprints(full_fingerprint,tools.time_to_seconds(cut[0]),lenghtTime) for cut in list_cut_begin_length[:video.number_cut]] for full_fingerprint in full_fingerprints]
 
-def get_delay_fidelity(video_obj_1,video_obj_2,lenghtTime,ignore_audio_couple=set()):
+def get_delay_fidelity_fingerprints(fingerprints_1,fingerprints_2,lenghtTime,ignore_audio_couple=set()):
+    # The fingerprints are sent to the workers as uint32 arrays
+    fingerprints_1 = [[fingerprint_array(fingerprint) for fingerprint in fingerprints_audio] for fingerprints_audio in fingerprints_1]
+    fingerprints_2 = [[fingerprint_array(fingerprint) for fingerprint in fingerprints_audio] for fingerprints_audio in fingerprints_2]
     delay_Fidelity_Values = {}
-    delay_Fidelity_Values_jobs = []
-    
-    video_obj_1.wait_end_ffmpeg_progress_audio()
-    video_obj_2.wait_end_ffmpeg_progress_audio()
-    for i in range(0,len(video_obj_1.tmpFiles['audio'])):
-        for j in range(0,len(video_obj_2.tmpFiles['audio'])):
-            if f"{i}-{j}" not in ignore_audio_couple:
-                delay_Fidelity_Values_jobs_between_audio = []
-                delay_Fidelity_Values_jobs.append([f"{i}-{j}",delay_Fidelity_Values_jobs_between_audio])
-                for h in range(0,video.number_cut):
-                    delay_Fidelity_Values_jobs_between_audio.append(get_delay_fidelity_thread(video_obj_1.tmpFiles['audio'][i][h],video_obj_2.tmpFiles['audio'][j][h],lenghtTime))
-                    delay_Fidelity_Values_jobs_between_audio[-1].start()
-    
-    for delay_Fidelity_Values_job in delay_Fidelity_Values_jobs:
-        delay_between_two_audio = []
-        delay_Fidelity_Values[delay_Fidelity_Values_job[0]] = delay_between_two_audio
-        for delay_Fidelity_Values_job_between_audio in delay_Fidelity_Values_job[1]:
-            delay_Fidelity_Values_job_between_audio.join()
-            delay_between_two_audio.append(delay_Fidelity_Values_job_between_audio.delay_Fidelity_Values)
+    correlation_jobs = []
+    for i in range(0,len(fingerprints_1)):
+        list_j = [j for j in range(0,len(fingerprints_2)) if f"{i}-{j}" not in ignore_audio_couple]
+        for j in list_j:
+            delay_Fidelity_Values[f"{i}-{j}"] = []
+        if len(list_j):
+            for h in range(0,len(fingerprints_1[i])):
+                correlation_jobs.append((i,h,list_j,video.job_scheduler.apply_async(video.correlation_pool, correlate_one_to_many_timed, (fingerprints_1[i][h],[fingerprints_2[j][h] for j in list_j],lenghtTime,time()))))
+    
+    for i,h,list_j,correlation_job in correlation_jobs:
+        delay_fidelity_list,wait_time,run_time = correlation_job.get()
+        if tools.dev:
+            sys.stderr.write(f"\t\tCorrelation of the audio {i} cut {h} with {len(list_j)} audios waited {wait_time:.3f} seconds and ran {run_time:.3f} seconds\n")
+        for j,delay_fidelity in zip(list_j,delay_fidelity_list):
+            delay_Fidelity_Values[f"{i}-{j}"].append(delay_fidelity)
 
     gc.collect()
     return delay_Fidelity_Values
 
+def get_fingerprints_cuts(video_obj,language,audio_parameter_to_use_for_comparison,list_cut_begin_length,lenghtTime,cache_keys):
+    '''
+    Fingerprints of the cuts from the cache, or extracted and calculated. One list by compatible audio, one fingerprint by cut.
+    '''
+    fingerprints = None
+    if tools.fingerprint_cache != None:
+        fingerprints = tools.fingerprint_cache.get_all(cache_keys)
+        if tools.dev and fingerprints != None:
+            sys.stderr.write(f"\t\tFingerprints for {language} found in the cache\n")
+    if fingerprints == None:
+        video_obj.extract_audio_in_part(language,audio_parameter_to_use_for_comparison,cutTime=list_cut_begin_length,correlation_method="fingerprint")
+        fingerprints = calculate_fingerprints_cuts(video_obj,lenghtTime,cache_keys)
+    else:
+        # The cuts are not extracted, so the positions are set here
+        video_obj.set_audio_pos_file(language)
+    return fingerprints
+
+adaptive_min_cuts = 2
+adaptive_min_fidelity = 0.90
+def get_adaptive_cut_order(number_cuts):
+    '''
+    The first and the last cut, then the cuts in the middle of the biggest gaps, to spread the first waves over the file.
+    '''
+    cut_order = [0]
+    if number_cuts > 1:
+        cut_order.append(number_cuts-1)
+    gaps = [(0,number_cuts-1)]
+    while len(cut_order) < number_cuts:
+        gaps.sort(key=lambda gap: gap[1]-gap[0], reverse=True)
+        begin,end = gaps.pop(0)
+        middle = (begin+end)//2
+        if middle != begin:
+            cut_order.append(middle)
+            gaps.extend([(begin,middle),(middle,end)])
+    return cut_order
+
+def get_delay_fidelity_adaptive(video_obj,language,audio_parameter_to_use_for_comparison,list_cut_begin_length,lenghtTime,cache_keys,fingerprints=None,ignore_audio_couple=set()):
+    '''
+    Same result as get_delay_fidelity_fingerprints, but the cuts are correlated by waves and a couple stop
+    when at least adaptive_min_cuts cuts agree on the same delay with a fidelity over adaptive_min_fidelity.
+    The next waves add one cut only for the couples still in doubt.
+    Without fingerprints (full track fingerprints not available), the cuts of each wave are taken from the cache or extracted.
+    '''
+    number_audios = len(cache_keys)
+    cut_order = get_adaptive_cut_order(len(list_cut_begin_length))
+    couples_done = set(ignore_audio_couple)
+    delay_Fidelity_Values = {}
+    position = 0
+    wave_size = adaptive_min_cuts
+    while position < len(cut_order) and len(couples_done) < number_audios*number_audios:
+        wave = cut_order[position:position+wave_size]
+        position += wave_size
+        wave_size = 1
+        if fingerprints != None:
+            fingerprints_wave = [[fingerprints_audio[h] for h in wave] for fingerprints_audio in fingerprints]
+        else:
+            fingerprints_wave = get_fingerprints_cuts(video_obj,language,audio_parameter_to_use_for_comparison,[list_cut_begin_length[h] for h in wave],lenghtTime,[[cache_keys_audio[h] for h in wave] for cache_keys_audio in cache_keys])
+        for couple,delay_fidelity_list in get_delay_fidelity_fingerprints(fingerprints_wave,fingerprints_wave,lenghtTime,ignore_audio_couple=couples_done).items():
+            delay_Fidelity_Values.setdefault(couple,[]).extend(delay_fidelity_list)
+            delay_fidelity_list = delay_Fidelity_Values[couple]
+            if len(delay_fidelity_list) >= adaptive_min_cuts and len(set([delay_fidelity[2] for delay_fidelity in delay_fidelity_list])) == 1 and min([delay_fidelity[0] for delay_fidelity in delay_fidelity_list]) >= adaptive_min_fidelity:
+                couples_done.add(couple)
+    
+    if tools.dev:
+        for couple,delay_fidelity_list in delay_Fidelity_Values.items():
+            sys.stderr.write(f"\t\tAdaptive cuts {language} {couple}: {len(delay_fidelity_list)} cuts used on {len(list_cut_begin_length)}\n")
+    return delay_Fidelity_Values
+
+def get_delay_second_correlation(video_obj,language,i,j,list_cut_begin_length,audio_parameter_to_use_for_comparison):
+    '''
+    Delays in ms between the audio i and j for each cut, with the same sign as the chromaprint delays.
+    '''
+    audio_by_pos_file = {}
+    for audio in video_obj.audios[language]:
+        if "audio_pos_file" in audio:
+            audio_by_pos_file[audio["audio_pos_file"]] = audio
+    if (not tools.fallback_correlation_stream):
+        if video_obj.audioCutTime != list_cut_begin_length:
+            # The fingerprints came from the cache, the cuts were not extracted
+            video_obj.extract_audio_in_part(language,audio_parameter_to_use_for_comparison,cutTime=list_cut_begin_length)
+        else:
+            # The cuts extracted for the fingerprints are not normalised
+            video_obj.normalise_audio_in_part()
+    video_obj.wait_end_ffmpeg_progress_audio()
+    
+    # The cuts are correlated in parallel, the memory budget of audioCorrelation limit how many run at the same time
+    threads = []
+    for h,cut in enumerate(list_cut_begin_length):
+        if tools.fallback_correlation_stream:
+            in1 = (video_obj.filePath,audio_by_pos_file[i]['StreamOrder'],cut[0],cut[1])
+            in2 = (video_obj.filePath,audio_by_pos_file[j]['StreamOrder'],cut[0],cut[1])
+            threads.append(second_correlation_thread(second_correlation_stream,in1,in2))
+        else:
+            in1 = video_obj.tmpFiles['audio'][i][h]
+            in2 = video_obj.tmpFiles['audio'][j][h]
+            threads.append(second_correlation_thread(second_correlation,in1,in2))
+        threads[-1].start()
+    
+    delays = []
+    for thread in threads:
+        thread.join()
+        if thread.exception != None:
+            raise thread.exception
+        delays.append(thread.delay)
+    return delays
+
+class second_correlation_thread(Thread):
+    '''
+    Delay in ms of one cut, with the same sign as the chromaprint delays.
+    '''
+    def __init__(self,correlation_function,in1,in2):
+        Thread.__init__(self)
+        self.correlation_function = correlation_function
+        self.in1 = in1
+        self.in2 = in2
+        self.delay = None
+        self.exception = None
+
+    def run(self):
+        try:
+            file,offset = self.correlation_function(self.in1,self.in2)
+            if file == self.in1:
+                self.delay = -offset*1000
+            else:
+                self.delay = offset*1000
+        except Exception as e:
+            self.exception = e
+
+def validate_with_second_correlation(video_obj,language,i,j,list_cut_begin_length,audio_parameter_to_use_for_comparison):
+    try:
+        delays = get_delay_second_correlation(video_obj,language,i,j,list_cut_begin_length,audio_parameter_to_use_for_comparison)
+    except Exception as e:
+        sys.stderr.write(f"Error during the second correlation of {i}-{j} on {language}: {e}\n")
+        return False
+    if tools.dev:
+        sys.stderr.write(f"find_differences_and_keep_best_audio second correlation delays {i}-{j}: {delays}\n")
+    return max([abs(delay) for delay in delays]) < 128
+
 def find_differences_and_keep_best_audio(video_obj,language,audioRules):
     if len(video_obj.audios[language]) > 1:
         if tools.dev:
             sys.stderr.write(f"\t\tKeep the best audio for {language}\n")
         try:
             begin_in_second,audio_parameter_to_use_for_comparison,length_time,length_time_converted,list_cut_begin_length = prepare_get_delay_sub([video_obj],language)
-            video_obj.extract_audio_in_part(language,audio_parameter_to_use_for_comparison,cutTime=list_cut_begin_length)
+            cache_keys = video_obj.get_audio_in_part_cache_keys(language,audio_parameter_to_use_for_comparison,list_cut_begin_length,length_time*2)
+            fingerprints = None
+            if tools.fingerprint_full_track:
+                try:
+                    fingerprints = calculate_fingerprints_full_track(video_obj,language,list_cut_begin_length,length_time*2)
+                except Exception as e:
+                    sys.stderr.write(f"Error with the full track fingerprints on {language}, the cuts are extracted: {e}\n")
 
             ignore_compare = set([f"{i}-{i}" for i in range(len(video_obj.audios[language]))])
             for i in range(len(video_obj.audios[language])):
                 for j in range(i+1,len(video_obj.audios[language])):
                     ignore_compare.add(f"{j}-{i}")
-            delay_Fidelity_Values = get_delay_fidelity(video_obj,video_obj,length_time*2,ignore_audio_couple=ignore_compare)
+            if tools.adaptive_cuts:
+                delay_Fidelity_Values = get_delay_fidelity_adaptive(video_obj,language,audio_parameter_to_use_for_comparison,list_cut_begin_length,length_time*2,cache_keys,fingerprints,ignore_audio_couple=ignore_compare)
+            else:
+                if fingerprints == None:
+                    fingerprints = get_fingerprints_cuts(video_obj,language,audio_parameter_to_use_for_comparison,list_cut_begin_length,length_time*2,cache_keys)
+                delay_Fidelity_Values = get_delay_fidelity_fingerprints(fingerprints,fingerprints,length_time*2,ignore_audio_couple=ignore_compare)
             
             fileid_audio = {}
             validation = {}
@@ -218,8 +406,12 @@ def find_differences_and_keep_best_audio(video_obj,language,audioRules):
                                 sys.stderr.write(f"find_differences_and_keep_best_audio set_delay {i}-{j}: {set_delay}\n")
                                 sys.stderr.write(f"find_differences_and_keep_best_audio fidelity {i}-{j}: {[fi[0] for fi in delay_Fidelity_Values[f"{i}-{j}"]]}\n")
                             validation[i][j] = True
+                        elif tools.fallback_correlation:
+                            validation[i][j] = validate_with_second_correlation(video_obj,language,i,j,list_cut_begin_length,audio_parameter_to_use_for_comparison)
                         else:
                             validation[i][j] = False
+                    elif tools.fallback_correlation:
+                        validation[i][j] = validate_with_second_correlation(video_obj,language,i,j,list_cut_begin_length,audio_parameter_to_use_for_comparison)
                     else:
                         validation[i][j] = False
             
@@ -750,7 +942,7 @@ def generate_new_file_audio_config(video_obj,base_cmd,audio,md5_audio_already_ad
                 cmd_convert.extend(["-exact_rice_parameters", "1"])
         tmp_file_convert = path.join(tools.tmpFolder,f"{video_obj.fileBaseName}_{audio['StreamOrder']}_tmp.mkv")
         cmd_convert.extend(["-t", duration_best_video, tmp_file_convert])
-        ffmpeg_cmd_dict['convert_process'].append(video.ffmpeg_pool_audio_convert.apply_async(tools.launch_cmdExt, (cmd_convert,)))
+        ffmpeg_cmd_dict['convert_process'].append(video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, tools.launch_cmdExt, (cmd_convert,)))
         sys.stderr.write(str(cmd_convert)+"\n")
         ffmpeg_cmd_dict['merge_cmd'].extend(["--no-global-tags", "-M", "-B"])
         ffmpeg_cmd_dict['merge_cmd'].extend(mkvmerge_delay)
@@ -833,7 +1025,7 @@ def generate_new_file(video_obj_original,ffmpeg_cmd_dict,md5_audio_already_added
                     cmd_convert.extend(["-c:s", "ass"])
                 tmp_file_convert = path.join(tools.tmpFolder,f"{video_obj.fileBaseName}_{sub['StreamOrder']}_tmp.mkv")
                 cmd_convert.extend(["-t", duration_best_video, tmp_file_convert])
-                ffmpeg_cmd_dict['convert_process'].append(video.ffmpeg_pool_audio_convert.apply_async(tools.launch_cmdExt, (cmd_convert,)))
+                ffmpeg_cmd_dict['convert_process'].append(video.job_scheduler.apply_async(video.ffmpeg_pool_audio_convert, tools.launch_cmdExt, (cmd_convert,)))
                 sys.stderr.write(str(cmd_convert)+"\n")
                 ffmpeg_cmd_dict['merge_cmd'].extend(["--no-global-tags", "-M", "-B"])
                 ffmpeg_cmd_dict['merge_cmd'].extend(mkvmerge_delay)
@@ -853,6 +1045,29 @@ def generate_new_file(video_obj_original,ffmpeg_cmd_dict,md5_audio_already_added
         ffmpeg_cmd_dict['metadata_cmd'].extend(["-A", "-S", "-D", video_obj_original.filePath])
     return number_track
 
+def get_frame_accurate_delay(video_obj_1,video_obj_2):
+    '''
+    Delay in ms of the video of video_obj_2 against video_obj_1, on a frame. None if they have no audio language in common.
+    The GCC-PHAT of the audios give a sub-frame delay, get_good_frame only compare frames with the PSNR if this delay is ambiguous.
+    '''
+    common_languages = [language for language in video_obj_1.audios.keys() if language in video_obj_2.audios]
+    if len(common_languages) == 0:
+        return None
+    audio_1 = video_obj_1.audios[common_languages[0]][0]
+    audio_2 = video_obj_2.audios[common_languages[0]][0]
+    begin_in_second,length_time = video.generate_begin_and_length_by_segment(min(float(video_obj_1.video['Duration']),float(video_obj_2.video['Duration'])))
+    length_correlation = str(min(length_time,phat_window))
+    fs,s1,s2 = read_normalized_stream((video_obj_1.filePath,audio_1['StreamOrder'],begin_in_second,length_correlation),(video_obj_2.filePath,audio_2['StreamOrder'],begin_in_second,length_correlation))
+    lag,confidence = corrabs_sub_sample(s1,s2,max(1,int(peak_confidence_exclusion*fs)))
+    s1 = None
+    s2 = None
+    # s1[n+lag] = s2[n]: the audio of the source at t is at t-lag in the file
+    calculated_delay = -lag/fs
+    if tools.dev:
+        sys.stderr.write(f"\t\tAudio delay between {video_obj_1.filePath} and {video_obj_2.filePath}: {calculated_delay*1000:.3f} ms with a confidence of {confidence:.2f}\n")
+    delay,begins_video = video.get_good_frame(video_obj_1,video_obj_2,begin_in_second,length_time,str(video.generate_time_compare_video_quality(length_time)),calculated_delay,confidence)
+    return delay
+
 def merge_videos(file, source, out):
     md5_audio_already_added = set()
     md5_sub_already_added = set()
@@ -922,6 +1137,19 @@ def merge_videos(file, source, out):
     
     file_video_metadata = video.video(path.dirname(file),path.basename(file))
     file_video_metadata.get_mediadata()
+    if tools.best_video_quality and file_video_metadata.multiples_video:
+        try:
+            file_video_metadata.select_best_video()
+        except Exception as e:
+            sys.stderr.write(f"Error during the selection of the best video of {file}: {e}\n")
+    if tools.frame_accuracy:
+        try:
+            video_delay = get_frame_accurate_delay(source_video_metadata,file_video_metadata)
+            if video_delay != None and round(video_delay) != 0:
+                # The content of the source at t is at t+video_delay in the file
+                final_insert.extend(["--sync", f"{file_video_metadata.video['StreamOrder']}:{-round(video_delay)}"])
+        except Exception as e:
+            sys.stderr.write(f"Error during the frame accuracy of {file}: {e}\n")
     if file_video_metadata.multiples_video:
         final_insert.extend(["-A", "-S", "--no-chapters", "-M", "-B", "--no-global-tags", "--video-tracks", file_video_metadata.video['StreamOrder'], file])
     else:
@@ -1008,5 +1236,5 @@ def merge_videos(file, source, out):
         sys.stderr.write("\t\tFile produce\n")
     
     tools.launch_cmdExt_with_timeout_reload([tools.software["ffmpeg"], "-err_detect", "crccheck+bitstream+buffer",
-                                             "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", str(sched_getaffinity(0)),
+                                             "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", str(len(sched_getaffinity(0))),
                                             "-i", out, "-map", "0", "-f", "null", "-c", "copy", "-"], 2, 2400)
@@ -23,12 +23,14 @@
 """
 
 import os
+import re
 import shutil
 import sys
 from subprocess import Popen, PIPE, TimeoutExpired
 import psutil
 import time
 from configparser import ConfigParser
+from functools import wraps
 
 def config_loader(file, section):
     parser = ConfigParser()
@@ -81,6 +83,62 @@ def remove_dir(dir_path,printError=True):
             sys.stderr.write("Error: %s : %s\n" % (dir_path, e.strerror))
 
 ''' Popen functions '''
+def get_cmd_threads(cmd):
+    # -threads of ffmpeg (0 or auto: all the CPU of the task), n_threads of libvmaf, else one thread
+    threads = 1
+    for i in range(0,len(cmd)):
+        try:
+            if cmd[i] == "-threads" and i+1 < len(cmd):
+                if str(cmd[i+1]) in ["0","auto"]:
+                    threads = max(threads,len(os.sched_getaffinity(0)))
+                else:
+                    threads = max(threads,int(cmd[i+1]))
+            else:
+                for n_threads in re.findall(r"n_threads=(\d+)",str(cmd[i])):
+                    threads = max(threads,int(n_threads))
+        except ValueError:
+            pass
+    return threads
+
+def with_host_cpu_tokens(launch_function):
+    '''
+    The command wait the tokens of its threads in the host CPU budget, if the tasks share one.
+    '''
+    @wraps(launch_function)
+    def launch_with_tokens(cmd,*args,**kwargs):
+        if host_cpu_budget == None:
+            return launch_function(cmd,*args,**kwargs)
+        slots = host_cpu_budget.acquire(get_cmd_threads(cmd))
+        try:
+            return launch_function(cmd,*args,**kwargs)
+        finally:
+            host_cpu_budget.release(slots)
+    return launch_with_tokens
+
+def acquire_host_cpu_tokens(cmds):
+    '''
+    Tokens of the commands of a pipeline launched with Popen, outside of the launch_cmdExt functions.
+    The tokens of all the commands are taken at once: two tasks holding the tokens of their first command and waiting for
+    the second one would block each other. Return the slots of each command, to give to release_host_cpu_tokens.
+    '''
+    if host_cpu_budget == None:
+        return [None for cmd in cmds]
+    threads = [get_cmd_threads(cmd) for cmd in cmds]
+    slots = host_cpu_budget.acquire(sum(threads))
+    # The budget can give less tokens than asked if it is small, the first commands keep them
+    slots_by_cmd = []
+    position = 0
+    for number_threads in threads:
+        slots_by_cmd.append(slots[position:position+number_threads])
+        position += number_threads
+    return slots_by_cmd
+
+def release_host_cpu_tokens(slots_by_cmd):
+    for slots in slots_by_cmd:
+        if slots != None:
+            host_cpu_budget.release(slots)
+
+@with_host_cpu_tokens
 def launch_cmdExt(cmd):
     cmdDownload = Popen(cmd, stdout=PIPE, stderr=PIPE)
     stdout, stderror = cmdDownload.communicate()
@@ -89,12 +147,14 @@ def launch_cmdExt(cmd):
         raise Exception("This cmd is in error: "+" ".join(cmd)+"\n"+str(stderror.decode("utf-8"))+"\n"+str(stdout.decode("utf-8"))+"\nReturn code: "+str(exitCode)+"\n")
     return stdout, stderror, exitCode
 
+@with_host_cpu_tokens
 def launch_cmdExt_no_test(cmd):
     cmdDownload = Popen(cmd, stdout=PIPE, stderr=PIPE)
     stdout, stderror = cmdDownload.communicate()
     exitCode = cmdDownload.returncode
     return stdout, stderror, exitCode
 
+@with_host_cpu_tokens
 def launch_cmdExt_with_tester(cmd,max_restart=1,timeout=120):
     cmdDownload = Popen(cmd, stdout=PIPE, stderr=PIPE)
     exitCode = 5555
@@ -162,6 +222,7 @@ def launch_cmdExt_with_tester(cmd,max_restart=1,timeout=120):
         raise Exception("This cmd is in error: "+" ".join(cmd)+"\n"+str(stderror.decode("utf-8"))+"\n"+str(stdout.decode("utf-8"))+"\nReturn code: "+str(exitCode)+"\n")
     return stdout, stderror, exitCode
 
+@with_host_cpu_tokens
 def launch_cmdExt_with_timeout_reload(cmd,max_restart=1,timeout=120):
     unpocessed = True
     while unpocessed:
@@ -187,6 +248,13 @@ def launch_cmdExt_with_timeout_reload(cmd,max_restart=1,timeout=120):
         raise Exception("This cmd is in error: "+" ".join(cmd)+"\n"+str(stderror.decode("utf-8"))+"\n"+str(stdout.decode("utf-8"))+"\nReturn code: "+str(exitCode)+"\n")
     return stdout, stderror, exitCode
 
+def time_to_seconds(time_str):
+    # "HH:MM:SS.mmm", "MM:SS" or "SS" to seconds
+    seconds = 0.0
+    for part in str(time_str).split(":"):
+        seconds = seconds*60 + float(part)
+    return seconds
+
 def remove_element_without_bug(list_set, element):
     try:
         list_set.remove(element)
@@ -217,9 +285,28 @@ software = { "mediainfo":"mediainfo",
             "ffmpeg":"ffmpeg",
             "ffprobe":"ffprobe",
             "fpcalc":"fpcalc",
-            "mkvmerge":"mkvmerge"
+            "mkvmerge":"mkvmerge",
+            "audio_sync":"audio_sync"
             }
 core_to_use = 1
+fingerprint_cache = None
+host_cpu_budget = None
+fingerprint_full_track = False
+fingerprint_backend = "fpcalc"
+adaptive_cuts = False
+coarse_to_fine = False
+frame_accuracy = False
+frame_psnr_engine = "numpy"
+best_video_quality = False
+vmaf_fast_arbitration = False
+audio_sync_pool = None
+correlation_sample_rate = 0
+fallback_correlation = False
+fallback_correlation_stream = True
+fallback_correlation_memory = 0
+fallback_correlation_budget = 0
+fallback_correlation_phat = False
+correlation_executor = "process"
 default_language_for_undetermine = 'und'
 dev = False
 special_params = {"change_all_und": False, "original_language":""}
@@ -19,12 +19,18 @@
 
 """
 
-from os import path,remove
+from os import path,remove,rename
 import shutil
 from sys import stderr
-from threading import RLock,Thread
-from time import strftime,gmtime,sleep,time
+from threading import Thread
+from time import strftime,gmtime,time
 import hashlib
+from tempfile import mkdtemp,TemporaryFile
+from copy import copy
+from subprocess import Popen,PIPE
+import numpy as np
+from loudness import normalise_wav_file
+from cpuScheduler import priority_big_job
 import tools
 import re
 import json
@@ -32,6 +38,8 @@ from iso639 import Lang,is_language
 
 ffmpeg_pool_audio_convert = None
 ffmpeg_pool_big_job = None
+correlation_pool = None
+job_scheduler = None
 path_to_livmaf_model = "" #Nothing if it use the default
 number_cut = 5
 percent_time_by_test_video_quality_from_cut = 25
@@ -58,9 +66,14 @@ class video():
         self.audiodesc = None
         self.commentary = None
         self.video = None
+        self.videos = []
         self.subtitles = None
         self.video_quality = None
         self.tmpFiles = {}
+        self.audioCutTime = None
+        self.audioCutNormalised = False
+        self.audioCutCodecParam = []
+        self.audioCutNormalisationFrequencies = get_normalisation_frequencies()
         self.ffmpeg_progress_audio = []
         self.delays = {}
         self.lastCutAsDefault = False
@@ -89,6 +102,7 @@ class video():
         self.subtitles = {}
         self.commentary = {}
         self.audiodesc = {}
+        self.videos = []
         for data in self.mediadata['media']['track']:
             data['MD5'] = ''
             data["keep"] = True
@@ -138,6 +152,8 @@ class video():
                 language = "und"
 
             if data['@type'] == 'Video':
+                data['language_iso'] = language
+                self.videos.append(data)
                 if self.video != None:
                     self.multiples_video = True
 
@@ -220,8 +236,25 @@ class video():
         stderr.write(f'Multiple video in the same file {self.filePath}, I will compare the {data_video_1["StreamOrder"]} et {data_video_2["StreamOrder"]} track\n')
         stderr.write("If your video are not sync, the result can be random.\n")
         stderr.write("!"*40+"\n")
-        
-        
+        video_obj_1 = copy(self)
+        video_obj_1.video = data_video_1
+        video_obj_2 = copy(self)
+        video_obj_2.video = data_video_2
+        begin_in_second,length_time = generate_begin_and_length_by_segment(min(float(data_video_1['Duration']),float(data_video_2['Duration'])))
+        begins_video = generate_cut_to_compare_video_quality(float(begin_in_second),float(begin_in_second),length_time)
+        if get_best_quality_video(video_obj_1, video_obj_2, begins_video, str(generate_time_compare_video_quality(length_time))) == "1":
+            return data_video_1
+        else:
+            return data_video_2
+    
+    def select_best_video(self):
+        '''
+        Keep in self.video the video track with the best VMAF when the file have multiple video tracks.
+        '''
+        best_video = self.videos[0]
+        for challenger in self.videos[1:]:
+            best_video = self.get_best_video(best_video,challenger)
+        self.video = best_video
             
     def get_fps(self):
         if 'FrameRate' in self.video:
@@ -241,7 +274,12 @@ class video():
         else:
             return None
     
-    def extract_audio_in_part(self,language,exportParam,cutTime=None,asDefault=False):
+    def extract_audio_in_part(self,language,exportParam,cutTime=None,asDefault=False,correlation_method="second_correlation"):
+        '''
+        Extract the compatible audios of the language, cut by cutTime, in tmpFiles['audio'].
+        With correlation_method "fingerprint", the audios are not normalised: fpcalc does not depend of the gain.
+        normalise_audio_in_part normalise them later if the second correlation need them.
+        '''
         if (not self.lastCutAsDefault) or (not asDefault):
             self.lastCutAsDefault = asDefault
             global ffmpeg_pool_audio_convert
@@ -250,8 +288,10 @@ class video():
             if 'audio' in self.tmpFiles:
                 self.remove_tmp_files(type_file="audio")
             self.tmpFiles['audio'] = nameFilesExtract
+            self.audioCutTime = cutTime
     
-            baseCommand = [tools.software["ffmpeg"], "-y", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", "5", "-nostdin", "-i", self.filePath, "-vn", "-dn", "-sn"]
+            # The input options, with the input seeking of the cut if there is one
+            baseCommand = [tools.software["ffmpeg"], "-y", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", "5", "-nostdin"]
             codec_param = []
             if exportParam['Format'] == 'WAV':
                 if 'codec' in exportParam:
@@ -266,10 +306,21 @@ class video():
                 codec_param.extend(["-ar", exportParam['SamplingRate']])
             if 'Channels' in exportParam:
                 codec_param.extend(["-ac", exportParam['Channels']])
-            baseCommand.extend(codec_param)
+            self.audioCutCodecParam = codec_param
+            audio_filter = exportParam.get('AudioFilter')
+            self.audioCutNormalisationFrequencies = get_normalisation_frequencies(exportParam.get('SamplingRate'))
+            self.audioCutNormalised = correlation_method != "fingerprint"
+            if not self.audioCutNormalised:
+                normalisation = None
+            elif exportParam['Format'] == 'WAV' and exportParam.get('codec','pcm_s16le').startswith('pcm_'):
+                # The PCM wav are filtered during the extraction and normalised in place, without temporary file
+                normalisation = "numpy"
+            else:
+                normalisation = "ffmpeg"
             audio_pos_file = 0
-            wait_end_big_job()
             if cutTime == None:
+                cmd = baseCommand+["-i", self.filePath]
+                outputs = []
                 for audio in self.audios[language]:
                     if audio["compatible"]:
                         nameFilesExtractCut = []
@@ -278,27 +329,84 @@ class video():
                         audio_pos_file += 1
                         nameOutFile = path.join(tools.tmpFolder,self.fileBaseName+"."+str(audio['StreamOrder'])+".1"+"."+exportParam['Format'].lower().replace('-',''))
                         nameFilesExtractCut.append(nameOutFile)
-                        cmd = baseCommand.copy()
                         name_out_file_tmp = path.join(tools.tmpFolder,self.fileBaseName+"."+str(audio['StreamOrder'])+".1"+"_tmp."+exportParam['Format'].lower().replace('-',''))
-                        cmd.extend(["-map", "0:"+str(audio['StreamOrder']), name_out_file_tmp])
-                        self.ffmpeg_progress_audio.append(ffmpeg_pool_audio_convert.apply_async(generate_normalised_file, (cmd,codec_param.copy(),nameOutFile,name_out_file_tmp)))
+                        cmd.extend(get_extraction_output_cmd(audio['StreamOrder'],codec_param,nameOutFile,name_out_file_tmp,normalisation,audio_filter))
+                        outputs.append((nameOutFile,name_out_file_tmp,normalisation))
+                if len(outputs):
+                    # The tokens are the threads given to ffmpeg
+                    self.ffmpeg_progress_audio.append(job_scheduler.apply_async(ffmpeg_pool_audio_convert, generate_normalised_files, (cmd,codec_param.copy(),outputs,self.audioCutNormalisationFrequencies), tools.get_cmd_threads(cmd)))
             else:
+                # One ffmpeg by cut for all the audios: the input seeking decode only the cut, and the file is read one time by cut
+                cmds = [baseCommand+["-ss", cut[0], "-t", cut[1], "-i", self.filePath] for cut in cutTime]
+                outputs = [[] for cut in cutTime]
                 for audio in self.audios[language]:
                     if audio["compatible"]:
                         nameFilesExtractCut = []
                         nameFilesExtract.append(nameFilesExtractCut)
                         audio["audio_pos_file"] = audio_pos_file
                         audio_pos_file += 1
-                        cutNumber = 0
-                        for cut in cutTime:
+                        for cutNumber in range(0,len(cutTime)):
                             nameOutFile = path.join(tools.tmpFolder,self.fileBaseName+"."+str(audio['StreamOrder'])+"."+str(cutNumber)+"."+exportParam['Format'].lower().replace('-',''))
                             nameFilesExtractCut.append(nameOutFile)
-                            cmd = baseCommand.copy()
                             name_out_file_tmp = path.join(tools.tmpFolder,self.fileBaseName+"."+str(audio['StreamOrder'])+"_tmp."+str(cutNumber)+"."+exportParam['Format'].lower().replace('-',''))
-                            cmd.extend(["-map", "0:"+str(audio['StreamOrder']), "-ss", cut[0], "-t", cut[1] , name_out_file_tmp])
-                            self.ffmpeg_progress_audio.append(ffmpeg_pool_audio_convert.apply_async(generate_normalised_file, (cmd,codec_param.copy(),nameOutFile,name_out_file_tmp)))
-                            cutNumber += 1
+                            cmds[cutNumber].extend(get_extraction_output_cmd(audio['StreamOrder'],codec_param,nameOutFile,name_out_file_tmp,normalisation,audio_filter))
+                            outputs[cutNumber].append((nameOutFile,name_out_file_tmp,normalisation))
+                for cmd,outputs_cut in zip(cmds,outputs):
+                    if len(outputs_cut):
+                        self.ffmpeg_progress_audio.append(job_scheduler.apply_async(ffmpeg_pool_audio_convert, generate_normalised_files, (cmd,codec_param.copy(),outputs_cut,self.audioCutNormalisationFrequencies), tools.get_cmd_threads(cmd)))
             
+    def normalise_audio_in_part(self):
+        '''
+        Normalise the audios extracted for the fingerprints, only when the second correlation need them.
+        '''
+        if not self.audioCutNormalised:
+            global ffmpeg_pool_audio_convert
+            self.wait_end_ffmpeg_progress_audio()
+            for nameFilesExtractCut in self.tmpFiles['audio']:
+                for nameOutFile in nameFilesExtractCut:
+                    name_out_file, extension = path.splitext(nameOutFile)
+                    name_out_file_tmp = name_out_file+"_raw"+extension
+                    rename(nameOutFile,name_out_file_tmp)
+                    self.ffmpeg_progress_audio.append(job_scheduler.apply_async(ffmpeg_pool_audio_convert, normalise_file, (self.audioCutCodecParam.copy(),nameOutFile,name_out_file_tmp,self.audioCutNormalisationFrequencies), normalise_file_threads))
+            self.audioCutNormalised = True
+
+    def get_audio_in_part_cache_keys(self,language,exportParam,cutTime,lengthFile):
+        '''
+        Keys of the fingerprint cache for the cuts produced by extract_audio_in_part with correlation_method "fingerprint".
+        One list by compatible audio and one key by cut, like tmpFiles['audio'].
+        The audios are not modified, audio_pos_file is set by extract_audio_in_part or set_audio_pos_file.
+        '''
+        from fingerprintCache import generate_key
+        extraction_params = {"export": exportParam, "length": lengthFile, "normalisation": None, "seek": "input", "backend": tools.fingerprint_backend}
+        return [[generate_key(self.get_stream_identity(audio),audio['StreamOrder'],cut[0],cut[1],extraction_params) for cut in cutTime] for audio in self.audios[language] if audio["compatible"]]
+
+    def get_audio_full_track_cache_keys(self,language):
+        '''
+        Keys of the fingerprint cache for the full track fingerprints, one by compatible audio, in the audio_pos_file order.
+        '''
+        from fingerprintCache import generate_key
+        from audioCorrelation import fingerprint_sample_rate
+        extraction_params = {"export": "full_track", "rate": fingerprint_sample_rate, "channel": "c0", "backend": tools.fingerprint_backend}
+        return [generate_key(self.get_stream_identity(audio),audio['StreamOrder'],"0","full",extraction_params) for audio in self.audios[language] if audio["compatible"]]
+
+    def set_audio_pos_file(self,language):
+        '''
+        Position of each compatible audio of the language in the fingerprints lists, like extract_audio_in_part does for tmpFiles['audio'].
+        '''
+        audio_pos_file = 0
+        for audio in self.audios[language]:
+            if audio["compatible"]:
+                audio["audio_pos_file"] = audio_pos_file
+                audio_pos_file += 1
+
+    def get_stream_identity(self,audio):
+        from fingerprintCache import get_file_identity
+        # The MD5 identify the stream content, even if the container was regenerated in the tmp folder
+        if audio['MD5'] != '':
+            return "md5:"+audio['MD5']
+        else:
+            return "file:"+get_file_identity(self.filePath)
+
     def remove_tmp_files(self,type_file=None):
         self.wait_end_ffmpeg_progress_audio()
         if type_file == None:
@@ -307,11 +415,15 @@ class video():
                     for file in files:
                         remove(file)
             self.tmpFiles = {}
+            self.audioCutTime = None
         else:
-            for files in self.tmpFiles[type_file]:
+            for files in self.tmpFiles.get(type_file,[]):
                 for file in files:
                     remove(file)
             self.tmpFiles[type_file] = []
+            if type_file == "audio":
+                # The next second correlation in wav must extract the cuts again
+                self.audioCutTime = None
                 
     def wait_end_ffmpeg_progress_audio(self):
         while len(self.ffmpeg_progress_audio) > 0:
@@ -322,70 +434,12 @@ class video():
     def calculate_md5_streams(self):
         if self.mediadata == None:
             self.get_mediadata()
-        global ffmpeg_pool_audio_convert
-        task_audio = {}
-        for language, data in self.audios.items():
-            task_audio[language] = []
-            for audio in data:
-                task_audio[language].append(ffmpeg_pool_audio_convert.apply_async(md5_calculator,(self.filePath,audio["StreamOrder"])))
-                
-        task_commentary = {}
-        for language, data in self.commentary.items():
-            task_commentary[language] = []
-            for audio in data:
-                task_commentary[language].append(ffmpeg_pool_audio_convert.apply_async(md5_calculator,(self.filePath,audio["StreamOrder"])))
-
-        task_audio_desc = {}
-        for language, data in self.audiodesc.items():
-            task_audio_desc[language] = []
-            for audio in data:
-                task_audio_desc[language].append(ffmpeg_pool_audio_convert.apply_async(md5_calculator,(self.filePath,audio["StreamOrder"])))
-
-        task_subtitle = {}
-        for language, data in self.subtitles.items():
-            task_subtitle[language] = []
-            for subtitle in data:
-                task_subtitle[language].append(ffmpeg_pool_audio_convert.apply_async(md5_calculator,(self.filePath,subtitle["StreamOrder"])))
-        
-        for language, data in task_audio.items():
-            i=0
-            for audio in data:
-                result = audio.get()
-                if result[1] != None:
-                    self.audios[language][i]['MD5'] = result[1]
-                else:
-                    stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {result[0]}")
-                i += 1
-
-        for language, data in task_commentary.items():
-            i=0
-            for audio in data:
-                result = audio.get()
-                if result[1] != None:
-                    self.commentary[language][i]['MD5'] = result[1]
-                else:
-                    stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {result[0]}")
-                i += 1
-                
-        for language, data in task_audio_desc.items():
-            i=0
-            for audio in data:
-                result = audio.get()
-                if result[1] != None:
-                    self.audiodesc[language][i]['MD5'] = result[1]
-                else:
-                    stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {result[0]}")
-                i += 1
-
-        for language, data in task_subtitle.items():
-            i=0
-            for subtitle in data:
-                result = subtitle.get()
-                if result[1] != None:
-                    self.subtitles[language][i]['MD5'] = result[1]
-                else:
-                    stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {result[0]}")
-                i += 1
+        # All the streams are hashed with only one read of the file
+        tracks = []
+        for tracks_by_language in [self.audios,self.commentary,self.audiodesc,self.subtitles]:
+            for language, data in tracks_by_language.items():
+                tracks.extend(data)
+        self.set_md5_streams(tracks,md5_calculator_streams(self.filePath,[(track["StreamOrder"],None) for track in tracks]))
 
     def calculate_md5_streams_split(self):
         if self.mediadata == None:
@@ -394,77 +448,44 @@ class video():
         if tools.dev:
             stderr.write("\t\tStart to calculate the md5 of the streams\n")
         
-        global ffmpeg_pool_audio_convert
         length_video = float(self.video['Duration'])
         if length_video > 20:
             length_video = length_video-10.0
-        task_audio = {}
-        for language, data in self.audios.items():
-            task_audio[language] = []
-            for audio in data:
-                task_audio[language].append(ffmpeg_pool_audio_convert.apply_async(md5_calculator,(self.filePath,audio["StreamOrder"],10,length_video,float(audio['Duration']))))
-                
-        task_commentary = {}
-        for language, data in self.commentary.items():
-            task_commentary[language] = []
-            for audio in data:
-                task_commentary[language].append(ffmpeg_pool_audio_convert.apply_async(md5_calculator,(self.filePath,audio["StreamOrder"],10,length_video,float(audio['Duration']))))
-
-        task_audio_desc = {}
-        for language, data in self.audiodesc.items():
-            task_audio_desc[language] = []
-            for audio in data:
-                task_audio_desc[language].append(ffmpeg_pool_audio_convert.apply_async(md5_calculator,(self.filePath,audio["StreamOrder"],10,length_video,float(audio['Duration']))))
+        tracks = []
+        for tracks_by_language in [self.audios,self.commentary,self.audiodesc]:
+            for language, data in tracks_by_language.items():
+                tracks.extend(data)
 
         dic_index_data_sub_codec = tools.extract_ffmpeg_type_dict(self.filePath)
-        task_subtitle = {}
+        task_subtitle = []
         for language, data in self.subtitles.items():
-            task_subtitle[language] = []
             for subtitle in data:
-                task_subtitle[language].append(subtitle_md5_second(self.filePath,subtitle,dic_index_data_sub_codec,length_video))
-                task_subtitle[language][-1].start()
+                codec_name = dic_index_data_sub_codec.get(int(subtitle["StreamOrder"]),{}).get("codec_name")
+                if codec_name != None and codec_name.lower() not in tools.sub_type_not_encodable:
+                    # The text is hashed without the timing
+                    task_subtitle.append(subtitle_md5_second(self.filePath,subtitle,dic_index_data_sub_codec,length_video))
+                    task_subtitle[-1].start()
+                else:
+                    tracks.append(subtitle)
         
         if tools.dev:
             stderr.write("\t\tStart to wait the end of the md5 calculation of the streams\n")
-        
-        for language, data in task_audio.items():
-            i=0
-            for audio in data:
-                result = audio.get()
-                if result[1] != None:
-                    self.audios[language][i]['MD5'] = result[1]
-                else:
-                    stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {result[0]}")
-                i += 1
-
-        for language, data in task_commentary.items():
-            i=0
-            for audio in data:
-                result = audio.get()
-                if result[1] != None:
-                    self.commentary[language][i]['MD5'] = result[1]
-                else:
-                    stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {result[0]}")
-                i += 1
-                
-        for language, data in task_audio_desc.items():
-            i=0
-            for audio in data:
-                result = audio.get()
-                if result[1] != None:
-                    self.audiodesc[language][i]['MD5'] = result[1]
-                else:
-                    stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {result[0]}")
-                i += 1
+        self.set_md5_streams(tracks,md5_calculator_streams(self.filePath,[(track["StreamOrder"],float(track['Duration'])) for track in tracks],10,length_video))
 
         if tools.dev:
             stderr.write("\t\tStart to wait the end of the md5 calculation of the subtitles\n")
-        for language, data in task_subtitle.items():
-            for subtitle in data:
-                subtitle.join(timeout=240)
+        for subtitle in task_subtitle:
+            subtitle.join(timeout=240)
         if tools.dev:
             stderr.write("\t\tEnd of the md5 calculation of the subtitles\n")
 
+    def set_md5_streams(self,tracks,md5_streams):
+        for track in tracks:
+            if md5_streams.get(track["StreamOrder"]) != None:
+                track['MD5'] = md5_streams[track["StreamOrder"]]
+            else:
+                stderr.write(f"Error with {self.filePath} during the md5 calculation of the stream {track['StreamOrder']}")
+
 """
 Preparation function
 """
@@ -493,12 +514,63 @@ def generate_cut_with_begin_length(begin_in_second,length_time,length_time_conve
 target_i = "-23.0"
 target_tp = "-2.0"
 target_lra = "7.0"
-def generate_normalised_file(cmd_extract,codec_param,nameOutFile,name_out_file_tmp):
+normalisation_highpass = 60
+normalisation_lowpass = 16000
+def get_normalisation_frequencies(sampling_rate=None):
+    # The lowpass is only kept when it is under the Nyquist frequency of the output
+    if sampling_rate != None and int(sampling_rate) <= 32000:
+        return normalisation_highpass,None
+    return normalisation_highpass,normalisation_lowpass
+
+def get_normalisation_filter(normalisation_frequencies=None):
+    if normalisation_frequencies == None:
+        normalisation_frequencies = get_normalisation_frequencies()
+    highpass,lowpass = normalisation_frequencies
+    if lowpass == None:
+        return f"highpass=f={highpass}"
+    return f"highpass=f={highpass},lowpass=f={lowpass}"
+
+def get_extraction_output_cmd(stream_order,codec_param,nameOutFile,name_out_file_tmp,normalisation,audio_filter=None):
+    '''
+    normalisation "ffmpeg": extraction in name_out_file_tmp, normalised in nameOutFile by normalise_file.
+    normalisation "numpy": PCM wav in nameOutFile, the loudness is measured and the normalisation filter and the gain applied in place.
+    normalisation None: raw extraction in nameOutFile.
+    audio_filter is like the mono downmix of the correlation profile.
+    '''
+    cmd = ["-map", "0:"+str(stream_order)]
+    if audio_filter != None:
+        cmd.extend(["-af", audio_filter])
+    if normalisation == "ffmpeg":
+        return cmd+codec_param+[name_out_file_tmp]
+    else:
+        return cmd+codec_param+[nameOutFile]
+
+def generate_normalised_files(cmd_extract,codec_param,outputs,normalisation_frequencies=None):
+    '''
+    Launch one extraction with several outputs, then normalise each of them.
+    outputs is a list of (nameOutFile, name_out_file_tmp, normalisation), see get_extraction_output_cmd.
+    '''
     tools.launch_cmdExt_with_timeout_reload(cmd_extract,3,max(600*4,1800))
-    if not path.exists(name_out_file_tmp):
-        raise FileNotFoundError(f"Extraction failed for {name_out_file_tmp}")
-    
-    stdout, stderror, exitCode = tools.launch_cmdExt([tools.software["ffmpeg"], "-y", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", "3", "-nostdin", "-i",
+    for nameOutFile,name_out_file_tmp,normalisation in outputs:
+        if normalisation == "ffmpeg":
+            extracted_file = name_out_file_tmp
+        else:
+            extracted_file = nameOutFile
+        if not path.exists(extracted_file):
+            raise FileNotFoundError(f"Extraction failed for {extracted_file}")
+    for nameOutFile,name_out_file_tmp,normalisation in outputs:
+        if normalisation == "ffmpeg":
+            normalise_file(codec_param,nameOutFile,name_out_file_tmp,normalisation_frequencies)
+        elif normalisation == "numpy":
+            if normalisation_frequencies == None:
+                normalisation_frequencies = get_normalisation_frequencies()
+            # Measured before the filters, like loudnorm in normalise_file
+            normalise_wav_file(nameOutFile,target_i,*normalisation_frequencies)
+
+normalise_file_threads = 3
+def normalise_file(codec_param,nameOutFile,name_out_file_tmp,normalisation_frequencies=None):
+    normalisation_filter = get_normalisation_filter(normalisation_frequencies)
+    stdout, stderror, exitCode = tools.launch_cmdExt([tools.software["ffmpeg"], "-y", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", str(normalise_file_threads), "-nostdin", "-i",
                     name_out_file_tmp, "-af", f"loudnorm=i={target_i}:lra={target_lra}:tp={target_tp}:print_format=json",
                     "-f", "null", "-"])
     try:
@@ -528,11 +600,11 @@ def generate_normalised_file(cmd_extract,codec_param,nameOutFile,name_out_file_t
     else:
         filter_str = f"volume={gain_db:.2f}dB"
 
-    cmd_normalisation = [tools.software["ffmpeg"], "-y", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", "3", "-nostdin", "-i",
+    cmd_normalisation = [tools.software["ffmpeg"], "-y", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", str(normalise_file_threads), "-nostdin", "-i",
                     name_out_file_tmp,
                     "-map", "0"]
     cmd_normalisation.extend(codec_param)
-    cmd_normalisation.extend(["-af", f"highpass=f=60,lowpass=f=16000,{filter_str}",nameOutFile])
+    cmd_normalisation.extend(["-af", f"{normalisation_filter},{filter_str}",nameOutFile])
     tools.launch_cmdExt(cmd_normalisation)
 
     if path.exists(name_out_file_tmp):
@@ -595,27 +667,21 @@ def get_begin_time_with_millisecond(delay,beginInSecBeforeDelay):
             begining_in_millisecond = ""
     return begining_in_second, begining_in_millisecond
 
-big_job_in_porgress = RLock()
-def wait_end_big_job():
-    global big_job_in_porgress
-    #while big_job_in_porgress.locked():
-    big_job_in_porgress.acquire()
-    big_job_in_porgress.release()
+def escape_filter_option(value):
+    # First for the options of the filter, then for the filtergraph
+    value = value.replace("\\","\\\\").replace("'","\\'").replace(":","\\:")
+    return re.sub(r"([\\'\[\],;])", r"\\\1", value)
 
-def big_job_waiter():
-    global ffmpeg_pool_audio_convert
-    for i in range(0,tools.core_to_use-1):
-        ffmpeg_pool_audio_convert.apply_async(sleep, (30,))
-    ffmpeg_pool_audio_convert.apply_async(sleep, (0.00000000001,)).get()
+def get_vmaf_score(log_path):
+    with open(log_path) as log_file:
+        data = json.load(log_file)
+    if "pooled_metrics" in data:
+        return float(data["pooled_metrics"]["vmaf"]["mean"])
+    else:
+        # libvmaf 1.x
+        return float(data["VMAF score"])
 
-def get_best_quality_video(video_obj_1, video_obj_2, begins_video, time_by_test):
-    import re
-    from statistics import mean
-    ffmpeg_VMAF_1_vs_2 = [tools.software["ffmpeg"], "-ss", "00:03:00", "-t", time_by_test, "-i", video_obj_1.filePath, 
-           "-ss", "00:03:00", "-t", time_by_test, "-i", video_obj_2.filePath,
-           "-lavfi", "[0:{}][1:{}]libvmaf=n_threads={}:log_fmt=json".format(video_obj_1.video['StreamOrder'],video_obj_2.video['StreamOrder'],tools.core_to_use)+path_to_livmaf_model,
-           "-threads", str(tools.core_to_use), "-f", "null","-map", f"0:{video_obj_1.video['StreamOrder']}", "-map", f"1:{video_obj_2.video['StreamOrder']}", "-"]
-    
+def get_quality_filter_modifications(video_obj_1, video_obj_2):
     framerate_video_obj_1 = video_obj_1.get_fps()
     framerate_video_obj_2 = video_obj_2.get_fps()
     scale_video_obj_1 = video_obj_1.get_scale()
@@ -631,52 +697,124 @@ def get_best_quality_video(video_obj_1, video_obj_2, begins_video, time_by_test)
             filter_modifications.append(f'scale={scale_video_obj_1[0]}:{scale_video_obj_1[1]}')
         else:
             filter_modifications.append(f'scale={scale_video_obj_2[0]}:{scale_video_obj_2[1]}')
-    if len(filter_modifications):
-        ffmpeg_VMAF_1_vs_2[13] = "-filter_complex"
-        ffmpeg_VMAF_1_vs_2[14] = "[0:{}]{}[0];[1:{}]{}[1]; [0][1]libvmaf=n_threads={}:log_fmt=json".format(video_obj_1.video['StreamOrder'],", ".join(filter_modifications),video_obj_2.video['StreamOrder'],", ".join(filter_modifications),tools.core_to_use)+path_to_livmaf_model
-
-    ffmpeg_VMAF_2_vs_1 = ffmpeg_VMAF_1_vs_2.copy()
-    ffmpeg_VMAF_2_vs_1[6] = video_obj_2.filePath
-    ffmpeg_VMAF_2_vs_1[12] = video_obj_1.filePath
-    out_1_vs_2 = []
-    out_2_vs_1 = []
+    return filter_modifications
+
+def get_vmaf_dual_cmd(video_obj_1, video_obj_2, begins, time_by_test, filter_modifications, log_path_1_vs_2, log_path_2_vs_1, vmaf_options=""):
+    '''
+    One ffmpeg for the two directions: each cut is decoded and scaled one time, split, and given to two libvmaf.
+    '''
+    modifications = "".join([f"{filter_modification}," for filter_modification in filter_modifications])
+    libvmaf = "libvmaf=n_threads={}:log_fmt=json:log_path={}"+vmaf_options+path_to_livmaf_model
+    filter_graph = (f"[0:{video_obj_1.video['StreamOrder']}]{modifications}split=2[main_1][reference_1];"
+                    f"[1:{video_obj_2.video['StreamOrder']}]{modifications}split=2[main_2][reference_2];"
+                    f"[main_1][reference_2]{libvmaf.format(tools.core_to_use,escape_filter_option(log_path_1_vs_2))}[vmaf_1_vs_2];"
+                    f"[main_2][reference_1]{libvmaf.format(tools.core_to_use,escape_filter_option(log_path_2_vs_1))}[vmaf_2_vs_1]")
+    return [tools.software["ffmpeg"], "-nostdin", "-ss", begins[0], "-t", time_by_test, "-i", video_obj_1.filePath,
+            "-ss", begins[1], "-t", time_by_test, "-i", video_obj_2.filePath,
+            "-filter_complex", filter_graph, "-map", "[vmaf_1_vs_2]", "-map", "[vmaf_2_vs_1]",
+            "-threads", str(tools.core_to_use), "-f", "null", "-"]
+
+'''
+Fast VMAF arbitration.
+The default model (vmaf_v0.6.1, a 1080p display seen at 3 times its height) is kept at fast_vmaf_width x fast_vmaf_height:
+the two videos are scaled to the same size and scored by the same model in the two directions, and only the sign of the gap
+between the two directions is used. The bias of the model at this size is the same for the two videos.
+tests/test_vmaf_fast_libvmaf.py checks on encoded clips that the decisions are the ones of the full size.
+'''
+fast_vmaf_subsample = 5
+fast_vmaf_width = 960
+fast_vmaf_height = 540
+fast_vmaf_min_cuts = 2
+fast_vmaf_risk = 0.05
+def get_vmaf_fast_options(filter_modifications):
+    '''
+    Filter modifications and libvmaf options of the fast arbitration:
+    both videos at the same small size (the fps modification is kept), and one frame on fast_vmaf_subsample.
+    '''
+    filter_modifications = [filter_modification for filter_modification in filter_modifications if filter_modification.startswith("fps=")]
+    filter_modifications.append(f"scale={fast_vmaf_width}:{fast_vmaf_height}")
+    return filter_modifications,f":n_subsample={fast_vmaf_subsample}"
+
+def is_quality_gap_clear(values_1_vs_2, values_2_vs_1):
+    '''
+    Student test on the score differences of the cuts: True if the sign of the gap is clear with the fast_vmaf_risk.
+    '''
+    if len(values_1_vs_2) < fast_vmaf_min_cuts:
+        return False
+    from scipy.stats import t as student
+    differences = np.array(values_1_vs_2)-np.array(values_2_vs_1)
+    deviation = differences.std(ddof=1)
+    if deviation == 0:
+        return differences[0] != 0
+    return abs(differences.mean())/(deviation/np.sqrt(len(differences))) > student.ppf(1-fast_vmaf_risk/2, len(differences)-1)
+
+def launch_vmaf_dual(video_obj_1, video_obj_2, cut_number, begins, time_by_test, filter_modifications, vmaf_options):
+    log_path_base = path.join(tools.tmpFolder,f"vmaf_{video_obj_1.fileBaseName}_{video_obj_1.video['StreamOrder']}_{video_obj_2.fileBaseName}_{video_obj_2.video['StreamOrder']}_{cut_number}")
+    log_paths = [log_path_base+"_1_vs_2.json", log_path_base+"_2_vs_1.json"]
+    return job_scheduler.apply_async(ffmpeg_pool_big_job, tools.launch_cmdExt, (get_vmaf_dual_cmd(video_obj_1, video_obj_2, begins, time_by_test, filter_modifications, log_paths[0], log_paths[1], vmaf_options),), tools.core_to_use, priority_big_job),log_paths
+
+def get_vmaf_dual_scores(job_vmaf, log_paths):
+    job_vmaf.get()
+    scores = [get_vmaf_score(log_path) for log_path in log_paths]
+    for log_path in log_paths:
+        remove(log_path)
+    return scores
+
+def get_best_quality_video(video_obj_1, video_obj_2, begins_video, time_by_test):
+    from statistics import mean
+    filter_modifications = get_quality_filter_modifications(video_obj_1, video_obj_2)
+    vmaf_options = ""
+    if tools.vmaf_fast_arbitration:
+        # Only to know which video is the best
+        filter_modifications,vmaf_options = get_vmaf_fast_options(filter_modifications)
     values_1_vs_2 = []
     values_2_vs_1 = []
-    begin_pos_1_vs_2 = [2,8]
-    begin_pos_2_vs_1 = [8,2]
-    global big_job_in_porgress
-    with big_job_in_porgress:
-        big_job_waiter()
-        for begins in begins_video:
-            for x,y in zip(begin_pos_1_vs_2,begins):
-                ffmpeg_VMAF_1_vs_2[x] = y
-            job_1_vs_2 = ffmpeg_pool_big_job.apply_async(tools.launch_cmdExt, (ffmpeg_VMAF_1_vs_2,))
-            
-            for x,y in zip(begin_pos_2_vs_1,begins):
-                ffmpeg_VMAF_2_vs_1[x] = y
-            job_2_vs_1 = ffmpeg_pool_big_job.apply_async(tools.launch_cmdExt, (ffmpeg_VMAF_2_vs_1,))
-            
-            while len(out_1_vs_2) > 0:
-                values_1_vs_2.append(float(re.search(r'.*\[Parsed_libvmaf.*\] VMAF score. (\d*.\d*).*',out_1_vs_2.pop()[1].decode("utf-8"), re.MULTILINE).group(1)))
-                
-            while len(out_2_vs_1) > 0:
-                values_2_vs_1.append(float(re.search(r'.*\[Parsed_libvmaf.*\] VMAF score. (\d*.\d*).*',out_2_vs_1.pop()[1].decode("utf-8"), re.MULTILINE).group(1)))
-    
-            out_1_vs_2.append(job_1_vs_2.get())
-            out_2_vs_1.append(job_2_vs_1.get())
-    
-    while len(out_1_vs_2) > 0:
-        values_1_vs_2.append(float(re.search(r'.*\[Parsed_libvmaf.*\] VMAF score. (\d*.\d*).*',out_1_vs_2.pop()[1].decode("utf-8"), re.MULTILINE).group(1)))
-            
-    while len(out_2_vs_1) > 0:
-        values_2_vs_1.append(float(re.search(r'.*\[Parsed_libvmaf.*\] VMAF score. (\d*.\d*).*',out_2_vs_1.pop()[1].decode("utf-8"), re.MULTILINE).group(1)))
+    if tools.vmaf_fast_arbitration:
+        # The cuts are done one by one to stop when the gap is clear
+        for i,begins in enumerate(begins_video):
+            value_1_vs_2,value_2_vs_1 = get_vmaf_dual_scores(*launch_vmaf_dual(video_obj_1, video_obj_2, i, begins, time_by_test, filter_modifications, vmaf_options))
+            values_1_vs_2.append(value_1_vs_2)
+            values_2_vs_1.append(value_2_vs_1)
+            if is_quality_gap_clear(values_1_vs_2, values_2_vs_1):
+                break
+    else:
+        jobs_vmaf = [launch_vmaf_dual(video_obj_1, video_obj_2, i, begins, time_by_test, filter_modifications, vmaf_options) for i,begins in enumerate(begins_video)]
+        for job_vmaf,log_paths in jobs_vmaf:
+            value_1_vs_2,value_2_vs_1 = get_vmaf_dual_scores(job_vmaf, log_paths)
+            values_1_vs_2.append(value_1_vs_2)
+            values_2_vs_1.append(value_2_vs_1)
     
+    if tools.dev:
+        stderr.write(f"\t\tVMAF {video_obj_1.filePath}:{video_obj_1.video['StreamOrder']} vs {video_obj_2.filePath}:{video_obj_2.video['StreamOrder']} on {len(values_1_vs_2)} cuts: {mean(values_1_vs_2):.3f} / {mean(values_2_vs_1):.3f}\n")
     if mean(values_1_vs_2) >= mean(values_2_vs_1):
         return "1"
     else:
         return "2"
     
-def get_good_frame(video_obj_1, video_obj_2, begin_in_sec, length_time, time_by_test, calculated_delay):
+sub_frame_min_confidence = 1.8
+sub_frame_margin = 0.25
+def get_frames_to_test(frame_position, delay_confidence):
+    '''
+    Frames to compare with the PSNR, relative to int(frame_position) like get_good_frame.
+    With a confident sub-frame delay (delay_confidence not None), the nearest frame is chosen without test when the delay is within
+    sub_frame_margin frame of it, otherwise only the two frames around the delay are tested.
+    Return the frames to test and the frame chosen if there is nothing to test.
+    '''
+    if delay_confidence == None or delay_confidence < sub_frame_min_confidence:
+        return list(range(-2,3)),None
+    from math import floor
+    frame_before = floor(frame_position)-int(frame_position)
+    fraction = frame_position-floor(frame_position)
+    if fraction <= sub_frame_margin:
+        return [],frame_before
+    elif fraction >= 1-sub_frame_margin:
+        return [],frame_before+1
+    return [frame_before,frame_before+1],None
+
+def get_good_frame(video_obj_1, video_obj_2, begin_in_sec, length_time, time_by_test, calculated_delay, delay_confidence=None):
+    '''
+    calculated_delay in seconds, delay_confidence is the confidence of a sub-frame delay (see get_frames_to_test).
+    '''
     import re
     from statistics import mean
     ffmpeg_PSNR = [tools.software["ffmpeg"], "-ss", "00:03:00", "-t", time_by_test, "-i", video_obj_1.filePath, 
@@ -710,23 +848,42 @@ def get_good_frame(video_obj_1, video_obj_2, begin_in_sec, length_time, time_by_
     if len(filter_modifications):
         ffmpeg_PSNR[13] = "-filter_complex"
         ffmpeg_PSNR[14] = "[0:{}]{}[0];[1:{}]{}[1]; [0][1]psnr".format(video_obj_1.video['StreamOrder'],", ".join(filter_modifications),video_obj_2.video['StreamOrder'],", ".join(filter_modifications))
+    # The NumPy engine compare both videos at the same small size, only the fps filter is kept
+    gray_filters = [filter_modification for filter_modification in filter_modifications if filter_modification.startswith("fps=")]
+    gray_width,gray_height = get_gray_frame_size(scale_video_obj_1 if scale_video_obj_1 != None else scale_video_obj_2)
+    gray_filters.extend([f"scale={gray_width}:{gray_height}", "format=gray"])
     
     time_by_frame = 1.0/float(frame_rate_use)
     begin_in_sec_frame_adjusted = (float(int(begin_in_sec/time_by_frame))*time_by_frame)
     length_time_frame_adjusted = (float(int(length_time/time_by_frame))*time_by_frame)
     
+    frames_to_test,good_frame = get_frames_to_test((begin_in_sec_frame_adjusted + calculated_delay)/time_by_frame,delay_confidence)
+    if tools.dev:
+        stderr.write(f"\t\tFrames tested with the PSNR for a delay of {calculated_delay*1000:.2f} ms: {frames_to_test}\n")
     best_value_psnr = -1
-    good_frame = -2
-    global big_job_in_porgress
-    with big_job_in_porgress:
-        big_job_waiter()
-        for i in range(-2,3):
+    if len(frames_to_test):
+        good_frame = frames_to_test[0]
+    if len(frames_to_test) and tools.frame_psnr_engine == "numpy":
+        # Each cut of both videos is decoded one time, the PSNR of all the offsets is calculated on the same frames
+        first_offset = min(frames_to_test)
+        number_offsets = max(frames_to_test)-first_offset+1
+        jobs_psnr = []
+        for begins in generate_cut_to_compare_video_quality(begin_in_sec_frame_adjusted,(float(int((begin_in_sec_frame_adjusted + calculated_delay)/time_by_frame)+first_offset)*time_by_frame),length_time_frame_adjusted):
+            jobs_psnr.append(job_scheduler.apply_async(ffmpeg_pool_big_job, calculate_psnr_offsets, ((video_obj_1.filePath,video_obj_1.video['StreamOrder'],begins[0]),(video_obj_2.filePath,video_obj_2.video['StreamOrder'],begins[1]),
+                                                                                                                time_by_test,time_by_frame,number_offsets,",".join(gray_filters),gray_width,gray_height), tools.core_to_use, priority_big_job))
+        list_result_average_psnr = np.array([job_psnr.get() for job_psnr in jobs_psnr]).mean(axis=0)
+        for i in frames_to_test:
+            if list_result_average_psnr[i-first_offset] >= best_value_psnr:
+                good_frame = i
+                best_value_psnr = list_result_average_psnr[i-first_offset]
+    else:
+        for i in frames_to_test:
             jobs_psnr = []
             for begins in generate_cut_to_compare_video_quality(begin_in_sec_frame_adjusted,(float(int((begin_in_sec_frame_adjusted + calculated_delay)/time_by_frame)+i)*time_by_frame),length_time_frame_adjusted):
                 ffmpeg_PSNR[2] = begins[0]
                 ffmpeg_PSNR[8] = begins[1]
-                jobs_psnr.append(ffmpeg_pool_big_job.apply_async(tools.launch_cmdExt, (ffmpeg_PSNR,)))
-            
+                jobs_psnr.append(job_scheduler.apply_async(ffmpeg_pool_big_job, tools.launch_cmdExt, (ffmpeg_PSNR.copy(),), tools.core_to_use, priority_big_job))
+        
             '''
                 TODO:
                     Create thread for process all time.
@@ -735,7 +892,7 @@ def get_good_frame(video_obj_1, video_obj_2, begin_in_sec, length_time, time_by_
             for job_psnr in jobs_psnr:
                 result = job_psnr.get()
                 list_result_average_psnr.append(float(re.search(r'.*\[Parsed_psnr.*\].+average:(\d+.\d+).*',result[1].decode("utf-8"), re.MULTILINE).group(1)))
-            
+        
             if mean(list_result_average_psnr) >= best_value_psnr:
                 good_frame = i
                 best_value_psnr = mean(list_result_average_psnr)
@@ -743,6 +900,102 @@ def get_good_frame(video_obj_1, video_obj_2, begin_in_sec, length_time, time_by_
     calculated_delay = (float(int((begin_in_sec_frame_adjusted + calculated_delay)/time_by_frame)+good_frame)*time_by_frame) - begin_in_sec_frame_adjusted
     return calculated_delay*1000,generate_cut_to_compare_video_quality(begin_in_sec_frame_adjusted,(float(int((begin_in_sec_frame_adjusted + calculated_delay)/time_by_frame)+good_frame)*time_by_frame),length_time_frame_adjusted)
 
+gray_frame_width = 320
+def get_gray_frame_size(scale):
+    if scale == None:
+        return gray_frame_width,gray_frame_width*9//16//2*2
+    return gray_frame_width,max(2,int(round(gray_frame_width*scale[1]/scale[0]/2))*2)
+
+def get_gray_frame_cmd(file_path,stream_order,begin,duration,video_filter):
+    return [tools.software["ffmpeg"], "-v", "error", "-nostats", "-nostdin", "-threads", str(tools.core_to_use),
+            "-ss", str(begin), "-t", str(duration), "-i", file_path, "-map", f"0:{stream_order}", "-an", "-sn", "-dn",
+            "-vf", video_filter, "-f", "rawvideo", "-pix_fmt", "gray", "pipe:1"]
+
+class gray_frame_reader():
+    '''
+    Read one by one the grayscale frames decoded by ffmpeg in a pipe.
+    '''
+    def __init__(self,cmd,width,height):
+        self.cmd = cmd
+        self.width = width
+        self.height = height
+        # stderr in a temporary file: it is only read at the end, a full pipe would block ffmpeg
+        self.stderr_file = TemporaryFile()
+        self.process = Popen(self.cmd, stdout=PIPE, stderr=self.stderr_file)
+        self.end_of_stream = False
+
+    def read_frame(self):
+        frame = np.empty((self.height,self.width), dtype=np.uint8)
+        buffer = memoryview(frame).cast("B")
+        position = 0
+        while position < len(buffer):
+            read = self.process.stdout.readinto(buffer[position:])
+            if not read:
+                self.end_of_stream = True
+                return None
+            position += read
+        return frame
+
+    def close(self):
+        if not self.end_of_stream:
+            # The end of the cut is not needed if the other video is shorter: ffmpeg is stopped and its exit code is not an error
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.stderr_file.seek(0)
+        stderror = self.stderr_file.read()
+        self.stderr_file.close()
+        if self.end_of_stream and self.process.returncode != 0:
+            raise Exception("This cmd is in error: "+" ".join(self.cmd)+"\n"+str(stderror.decode("utf-8"))+"\nReturn code: "+str(self.process.returncode)+"\n")
+
+def calculate_psnr_offsets(input_1,input_2,time_by_test,time_by_frame,number_offsets,video_filter,width,height):
+    '''
+    PSNR of the cut of input_1 (file path, StreamOrder, begin) against the cut of input_2 shifted by 0 to number_offsets-1 frames.
+    Each cut is decoded one time: the last number_offsets frames of input_2 are kept and compared with each frame of input_1.
+    Return the average PSNR of each offset.
+    '''
+    cmds = [get_gray_frame_cmd(input_1[0],input_1[1],input_1[2],time_by_test,video_filter),
+            get_gray_frame_cmd(input_2[0],input_2[1],input_2[2],float(time_by_test)+number_offsets*time_by_frame,video_filter)]
+    # The two decoders run together, their host CPU tokens are taken at once
+    slots = tools.acquire_host_cpu_tokens(cmds)
+    try:
+        reader_1 = gray_frame_reader(cmds[0],width,height)
+        try:
+            reader_2 = gray_frame_reader(cmds[1],width,height)
+        except:
+            reader_1.close()
+            raise
+        try:
+            window = np.empty((number_offsets,height,width), dtype=np.float32)
+            for offset in range(number_offsets):
+                frame_2 = reader_2.read_frame()
+                if frame_2 is None:
+                    raise Exception(f"Not enough frames in {input_2[0]} at {input_2[2]}")
+                window[offset] = frame_2
+            squared_errors = np.zeros(number_offsets)
+            number_frames = 0
+            frame_1 = reader_1.read_frame()
+            while frame_1 is not None:
+                differences = window - frame_1
+                squared_errors += np.einsum('ijk,ijk->i', differences, differences, dtype=np.float64)
+                number_frames += 1
+                frame_2 = reader_2.read_frame()
+                if frame_2 is None:
+                    break
+                window[:-1] = window[1:]
+                window[-1] = frame_2
+                frame_1 = reader_1.read_frame()
+        finally:
+            reader_1.close()
+            reader_2.close()
+    finally:
+        tools.release_host_cpu_tokens(slots)
+    if number_frames == 0:
+        raise Exception(f"No frame decoded in {input_1[0]} at {input_1[2]}")
+    mse = squared_errors/(number_frames*width*height)
+    # Same value as the psnr filter of ffmpeg for identical frames
+    return [float(10*np.log10(255.0**2/value)) if value > 0 else float("inf") for value in mse]
+
 def get_common_audios_language(videosObj):
     commonLanguages = set(videosObj[0].audios.keys())
     for videoObj in videosObj:
@@ -891,24 +1144,32 @@ def test_if_it_better_by_rules(formatFileBase,bitrateFileBase,formatFileChalleng
     else:
         return 2
 
-def md5_calculator(filePath,streamID,start_time=0,end_time=None,duration_stream=None):
-    cmd = [
-    tools.software["ffmpeg"], "-v", "error", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", "1", "-i", filePath,
-    "-ss", str(start_time)]
-
+def get_md5_time_window(start_time=0,end_time=None,duration_stream=None):
+    time_window = ["-ss", str(start_time)]
     if end_time != None:
         if duration_stream != None:
             if duration_stream > end_time:
-                cmd.extend(["-t", str(end_time-start_time)])
+                time_window.extend(["-t", str(end_time-start_time)])
             else:
-                cmd.extend(["-t", str(duration_stream-start_time)])
+                time_window.extend(["-t", str(duration_stream-start_time)])
         else:
-            cmd.extend(["-t", str(end_time-start_time)])
+            time_window.extend(["-t", str(end_time-start_time)])
+    return time_window
+
+md5_timeout = 240
+md5_min_read_speed = 20*1024*1024
+def get_md5_timeout(filePath):
+    # One read of the whole file: the timeout follow its size, for the slow disks
+    return max(md5_timeout, int(path.getsize(filePath)/md5_min_read_speed))
 
+def md5_calculator(filePath,streamID,start_time=0,end_time=None,duration_stream=None):
+    cmd = [
+    tools.software["ffmpeg"], "-v", "error", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", "1", "-i", filePath]
+    cmd.extend(get_md5_time_window(start_time,end_time,duration_stream))
     cmd.extend(["-map", f"0:{streamID}", "-c", "copy", "-f", "md5", "-"
     ])
     try:
-        stdout, stderror, exitCode = tools.launch_cmdExt_with_timeout_reload(cmd,6,240)
+        stdout, stderror, exitCode = tools.launch_cmdExt_with_timeout_reload(cmd,6,get_md5_timeout(filePath))
         if exitCode == 0:
             md5 = stdout.decode("utf-8").strip().split("=")[-1]
             return (streamID, md5)
@@ -916,6 +1177,47 @@ def md5_calculator(filePath,streamID,start_time=0,end_time=None,duration_stream=
         stderr.write(f"Error calculating MD5 for {filePath}, stream {streamID}: {e}\n")
     return (streamID, None)
 
+def md5_calculator_one_read(filePath,streams,start_time,end_time,md5_folder):
+    '''
+    One ffmpeg with one md5 output (and its time window) by stream. Raise if the command fails.
+    '''
+    cmd = [
+    tools.software["ffmpeg"], "-y", "-v", "error", "-analyzeduration", "1000M", "-probesize", "1000M", "-threads", "1", "-i", filePath]
+    md5_files = {}
+    for streamID,duration_stream in streams:
+        md5_files[streamID] = path.join(md5_folder,f"{streamID}.md5")
+        cmd.extend(get_md5_time_window(start_time,end_time,duration_stream))
+        cmd.extend(["-map", f"0:{streamID}", "-c", "copy", "-f", "md5", md5_files[streamID]])
+    # The same read would fail the same way: no restart
+    tools.launch_cmdExt_with_timeout_reload(cmd,0,get_md5_timeout(filePath))
+    md5_streams = {}
+    for streamID,md5_file in md5_files.items():
+        with open(md5_file) as md5_content:
+            md5_streams[streamID] = md5_content.read().strip().split("=")[-1]
+    return md5_streams
+
+def md5_calculator_streams(filePath,streams,start_time=0,end_time=None):
+    '''
+    Same MD5 as md5_calculator for several streams with only one read of the file.
+    streams is a list of (streamID, duration_stream). Return a dict streamID: md5 (None if not calculated).
+    If the command fails, the MD5 are calculated stream by stream.
+    '''
+    if len(streams) == 0:
+        return {}
+    md5_folder = mkdtemp(prefix="md5_", dir=tools.tmpFolder)
+    try:
+        md5_streams = job_scheduler.apply_async(ffmpeg_pool_audio_convert, md5_calculator_one_read, (filePath,streams,start_time,end_time,md5_folder)).get()
+    except Exception as e:
+        stderr.write(f"Error calculating MD5 for {filePath} in one read, calculated stream by stream: {e}\n")
+        md5_streams = {}
+        md5_jobs = [job_scheduler.apply_async(ffmpeg_pool_audio_convert, md5_calculator, (filePath,streamID,start_time,end_time,duration_stream)) for streamID,duration_stream in streams]
+        for md5_job in md5_jobs:
+            streamID, md5 = md5_job.get()
+            md5_streams[streamID] = md5
+    finally:
+        tools.remove_dir(md5_folder,False)
+    return md5_streams
+
 class subtitle_md5_second(Thread):
     def __init__(self,filePath,subtitle,dic_index_data_sub_codec,length_video):
         Thread.__init__(self)
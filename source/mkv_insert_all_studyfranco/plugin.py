@@ -21,6 +21,7 @@
 """
 import logging
 import os
+import tempfile
 
 from unmanic.libs.directoryinfo import UnmanicDirectoryInfo
 from unmanic.libs.unplugins.settings import PluginSettings
@@ -35,6 +36,26 @@ class Settings(PluginSettings):
         "keep_only_language": False,
         "keep_only_language_values": "",
         "remove_sub_language_not_keep": False,
+        "correlation_sample_rate": "0",
+        "fallback_correlation": False,
+        "fallback_correlation_stream": True,
+        "fallback_correlation_memory": 0,
+        "fallback_correlation_budget": 0,
+        "fallback_correlation_phat": False,
+        "audio_sync_workers": 0,
+        "audio_sync_worker_cmd": "",
+        "fingerprint_full_track": False,
+        "fingerprint_backend": "fpcalc",
+        "adaptive_cuts": False,
+        "coarse_to_fine": False,
+        "frame_accuracy": False,
+        "frame_psnr_engine": "numpy",
+        "best_video_quality": False,
+        "vmaf_fast_arbitration": False,
+        "host_cpu_budget": False,
+        "host_cpu_tokens": 0,
+        "fingerprint_cache": True,
+        "fingerprint_cache_size": 512,
     }
     
     def __init__(self, *args, **kwargs):
@@ -48,6 +69,42 @@ class Settings(PluginSettings):
             },
             "keep_only_language_values": self.__set_language_to_keep(),
             "remove_sub_language_not_keep": self.__set_remove_sub_language_not_keep(),
+            "correlation_sample_rate": self.__set_correlation_sample_rate(),
+            "fallback_correlation":  {
+                "label": "Use a second audio correlation when the fingerprints are not conclusive",
+            },
+            "fallback_correlation_stream": self.__set_fallback_correlation_stream(),
+            "fallback_correlation_memory": self.__set_fallback_correlation_memory(),
+            "fallback_correlation_budget": self.__set_fallback_correlation_budget(),
+            "fallback_correlation_phat": self.__set_fallback_correlation_phat(),
+            "audio_sync_workers": self.__set_audio_sync_workers(),
+            "audio_sync_worker_cmd": self.__set_audio_sync_worker_cmd(),
+            "fingerprint_full_track":  {
+                "label": "Fingerprint each audio track in one pass and slice the fingerprints of the cuts",
+            },
+            "fingerprint_backend": self.__set_fingerprint_backend(),
+            "adaptive_cuts":  {
+                "label": "Stop the comparison of two audios when the first cuts agree on the delay",
+            },
+            "coarse_to_fine":  {
+                "label": "Search the delays coarse to fine (faster, but in rare cases not the delay of the full search)",
+            },
+            "frame_accuracy":  {
+                "label": "Align the video of the file on the source to the frame",
+            },
+            "frame_psnr_engine": self.__set_frame_psnr_engine(),
+            "best_video_quality":  {
+                "label": "When the file have multiple video tracks, keep the one with the best VMAF",
+            },
+            "vmaf_fast_arbitration": self.__set_vmaf_fast_arbitration(),
+            "host_cpu_budget":  {
+                "label": "Share one CPU budget between the tasks running in parallel",
+            },
+            "host_cpu_tokens": self.__set_host_cpu_tokens(),
+            "fingerprint_cache":  {
+                "label": "Cache the audio fingerprints between tasks",
+            },
+            "fingerprint_cache_size": self.__set_fingerprint_cache_size(),
         }
 
     def __set_language_to_keep(self):
@@ -71,6 +128,181 @@ class Settings(PluginSettings):
             values["display"] = 'hidden'
         return values
 
+    def __set_correlation_sample_rate(self):
+        values = {
+            "label": "Sample rate of the audio extracted to synchronise the files",
+            "description": "The audio is extracted in mono at this sample rate for the fingerprints and the second correlation. The lower sample rates are faster, but their delay accuracy is not measured yet.",
+            "input_type":     "select",
+            "select_options": [
+                {
+                    "value": "0",
+                    "label": "Sample rate and channels of the source",
+                },
+                {
+                    "value": "11025",
+                    "label": "11025 Hz",
+                },
+                {
+                    "value": "16000",
+                    "label": "16000 Hz",
+                },
+            ],
+        }
+        return values
+
+    def __set_fallback_correlation_stream(self):
+        values = {
+            "label": "Read the audio of the second correlation directly from ffmpeg",
+            "description": "The audio is decoded, resampled and normalised in memory, without temporary wav files.",
+            "sub_setting": True,
+        }
+        if not self.get_setting('fallback_correlation'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_fallback_correlation_memory(self):
+        values = {
+            "label": "Memory of the second correlation (MB)",
+            "description": "With 0, the whole cuts are loaded in memory. Otherwise the audio is correlated by blocks (overlap-save) with this memory, whatever the length of the cuts. Values under the minimum for the search of delays up to 30 seconds (108 MB) are increased to it.",
+            "sub_setting": True,
+            "input_type":     "slider",
+            "slider_options": {
+                "min": 0,
+                "max": 4096,
+            },
+        }
+        if not self.get_setting('fallback_correlation'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_fallback_correlation_budget(self):
+        values = {
+            "label": "Memory shared by the second correlations running at the same time (MB)",
+            "description": "As many second correlations as their estimated memory fit in this budget run at the same time. With 0, the half of the memory available at the start of the task is used.",
+            "sub_setting": True,
+            "input_type":     "slider",
+            "slider_options": {
+                "min": 0,
+                "max": 65536,
+            },
+        }
+        if not self.get_setting('fallback_correlation'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_fallback_correlation_phat(self):
+        values = {
+            "label": "Use a GCC-PHAT weighting in the second correlation",
+            "description": "The cuts are first correlated on 40 seconds, and entirely only if the peak is not clear. Not used with a memory limit (overlap-save).",
+            "sub_setting": True,
+        }
+        if not self.get_setting('fallback_correlation'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_audio_sync_workers(self):
+        values = {
+            "label": "Number of audio_sync workers kept alive during the task",
+            "description": "The second correlation with wav files send its requests to these worker processes, launched with the worker command below. With 0 or without worker command, audio_sync is launched for each correlation.",
+            "sub_setting": True,
+            "input_type":     "slider",
+            "slider_options": {
+                "min": 0,
+                "max": 16,
+            },
+        }
+        if not self.get_setting('fallback_correlation'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_audio_sync_worker_cmd(self):
+        values = {
+            "label": "Command of an audio_sync worker",
+            "description": "Command of a program reading one JSON request by line on its stdin ({\"id\", \"in1\", \"in2\"}) and answering one JSON line ({\"id\", \"file\", \"offset_seconds\"} or {\"id\", \"error\"}). audio_sync itself has no worker mode.",
+            "sub_setting": True,
+            "input_type":  "text",
+        }
+        if not self.get_setting('fallback_correlation'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_vmaf_fast_arbitration(self):
+        values = {
+            "label": "Fast VMAF comparison of the video tracks",
+            "description": "One frame on 5 at 960x540, the cuts stop when the gap between the two tracks is clear.",
+            "sub_setting": True,
+        }
+        if not self.get_setting('best_video_quality'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_frame_psnr_engine(self):
+        values = {
+            "label": "PSNR calculation of the frames to test",
+            "sub_setting": True,
+            "input_type":     "select",
+            "select_options": [
+                {
+                    "value": "numpy",
+                    "label": "NumPy, each cut decoded one time",
+                },
+                {
+                    "value": "ffmpeg",
+                    "label": "ffmpeg, one PSNR by frame to test",
+                },
+            ],
+        }
+        if not self.get_setting('frame_accuracy'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_fingerprint_backend(self):
+        values = {
+            "label": "Audio fingerprint calculation",
+            "input_type":     "select",
+            "select_options": [
+                {
+                    "value": "fpcalc",
+                    "label": "fpcalc (Chromaprint)",
+                },
+                {
+                    "value": "numpy",
+                    "label": "NumPy, without fpcalc processes",
+                },
+            ],
+        }
+        return values
+
+    def __set_host_cpu_tokens(self):
+        values = {
+            "label": "Number of threads shared by the tasks",
+            "description": "0 to use the number of cores. Each ffmpeg wait the tokens of its threads.",
+            "sub_setting": True,
+            "input_type":     "slider",
+            "slider_options": {
+                "min": 0,
+                "max": 256,
+            },
+        }
+        if not self.get_setting('host_cpu_budget'):
+            values["display"] = 'hidden'
+        return values
+
+    def __set_fingerprint_cache_size(self):
+        values = {
+            "label": "Maximum size of the fingerprint cache (MB)",
+            "description": "When the cache is bigger, the fingerprints not used since the longest time are removed.",
+            "sub_setting": True,
+            "input_type":     "slider",
+            "slider_options": {
+                "min": 16,
+                "max": 8192,
+            },
+        }
+        if not self.get_setting('fingerprint_cache'):
+            values["display"] = 'hidden'
+        return values
+
 def on_worker_process(data):
     """
     Runner function - enables additional configured processing jobs during the worker stages of a task.
@@ -106,6 +338,61 @@ def on_worker_process(data):
     else:
         remove_sub_language_not_keep = "False"
         
-    data['exec_command'] = ['python3', "/config/.unmanic/plugins/mkv_insert_studyfranco/lib/main.py", "-o", data.get('file_out'), "-s", data.get('original_file_path'), "-f", data.get('file_in'), "-l", activate_louis, "--pwd", "/config/.unmanic/plugins/mkv_insert_studyfranco", "--tmp", os.path.dirname(data.get('file_out')), "--language_keep", settings.get_setting('keep_only_language_values'), "--remove_sub_language_not_keep", remove_sub_language_not_keep]
+    if settings.get_setting('fallback_correlation'):
+        fallback_correlation = "True"
+    else:
+        fallback_correlation = "False"
+        
+    if settings.get_setting('fingerprint_full_track'):
+        fingerprint_full_track = "True"
+    else:
+        fingerprint_full_track = "False"
+
+    if settings.get_setting('fallback_correlation_phat'):
+        fallback_correlation_phat = "True"
+    else:
+        fallback_correlation_phat = "False"
+
+    if settings.get_setting('frame_accuracy'):
+        frame_accuracy = "True"
+    else:
+        frame_accuracy = "False"
+
+    if settings.get_setting('best_video_quality'):
+        best_video_quality = "True"
+    else:
+        best_video_quality = "False"
+
+    if settings.get_setting('vmaf_fast_arbitration'):
+        vmaf_fast_arbitration = "True"
+    else:
+        vmaf_fast_arbitration = "False"
+
+    if settings.get_setting('adaptive_cuts'):
+        adaptive_cuts = "True"
+    else:
+        adaptive_cuts = "False"
+
+    if settings.get_setting('coarse_to_fine'):
+        coarse_to_fine = "True"
+    else:
+        coarse_to_fine = "False"
+
+    if settings.get_setting('fallback_correlation_stream'):
+        fallback_correlation_stream = "True"
+    else:
+        fallback_correlation_stream = "False"
+        
+    if settings.get_setting('host_cpu_budget'):
+        cpu_token_dir = os.path.join(tempfile.gettempdir(), "mkv_insert_cpu_tokens")
+    else:
+        cpu_token_dir = ""
+
+    if settings.get_setting('fingerprint_cache'):
+        fingerprint_cache = os.path.join(settings.get_profile_directory(), "fingerprint_cache.sqlite")
+    else:
+        fingerprint_cache = ""
+        
+    data['exec_command'] = ['python3', "/config/.unmanic/plugins/mkv_insert_studyfranco/lib/main.py", "-o", data.get('file_out'), "-s", data.get('original_file_path'), "-f", data.get('file_in'), "-l", activate_louis, "--pwd", "/config/.unmanic/plugins/mkv_insert_studyfranco", "--tmp", os.path.dirname(data.get('file_out')), "--language_keep", settings.get_setting('keep_only_language_values'), "--remove_sub_language_not_keep", remove_sub_language_not_keep, "--correlation_sample_rate", str(settings.get_setting('correlation_sample_rate')), "--fallback_correlation", fallback_correlation, "--fallback_correlation_stream", fallback_correlation_stream, "--fallback_correlation_memory", str(settings.get_setting('fallback_correlation_memory')), "--fallback_correlation_budget", str(settings.get_setting('fallback_correlation_budget')), "--fallback_correlation_phat", fallback_correlation_phat, "--audio_sync_workers", str(settings.get_setting('audio_sync_workers')), "--audio_sync_worker_cmd", settings.get_setting('audio_sync_worker_cmd'), "--fingerprint_full_track", fingerprint_full_track, "--fingerprint_backend", settings.get_setting('fingerprint_backend'), "--adaptive_cuts", adaptive_cuts, "--coarse_to_fine", coarse_to_fine, "--frame_accuracy", frame_accuracy, "--frame_psnr_engine", settings.get_setting('frame_psnr_engine'), "--best_video_quality", best_video_quality, "--vmaf_fast_arbitration", vmaf_fast_arbitration, "--cpu_token_dir", cpu_token_dir, "--cpu_tokens", str(settings.get_setting('host_cpu_tokens')), "--fingerprint_cache", fingerprint_cache, "--fingerprint_cache_size", str(settings.get_setting('fingerprint_cache_size'))]
 
     return data
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+    plugins.global_settings.py
+
+    Written by:               Josh.5 <jsunnex@gmail.com>
+    Date:                     10 Jun 2022, (6:52 PM)
+
+    Copyright:
+        Copyright (C) 2021 Josh Sunnex
+
+        This program is free software: you can redistribute it and/or modify it under the terms of the GNU General
+        Public License as published by the Free Software Foundation, version 3.
+
+        This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+        implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+        for more details.
+
+        You should have received a copy of the GNU General Public License along with this program.
+        If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+'''
+Stand-in of an audio_sync worker for the tests of audioSyncWorker: same JSON protocol, the correlation is the one of
+audioCorrelation (corrabs_coarse_to_fine) on the first channel of the wav files.
+If the file in1+".hang" exists, it is removed and the worker hangs on this request, to test the restart of the pool.
+'''
+import json
+import sys
+import time
+from os import path,remove
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "lib"))
+from audioCorrelation import get_files_metrics, corrabs_coarse_to_fine
+
+def correlate(in1,in2):
+    fs1,s1 = get_files_metrics(in1)
+    fs2,s2 = get_files_metrics(in2)
+    if fs1 != fs2:
+        raise Exception("not same sample rate")
+    lag,value = corrabs_coarse_to_fine(s1,s2)
+    if lag < 0:
+        return in2,-lag/fs1
+    else:
+        return in1,lag/fs1
+
+if __name__ == '__main__':
+    for line in sys.stdin:
+        if line.strip() == "":
+            continue
+        request = json.loads(line)
+        if path.exists(request["in1"]+".hang"):
+            remove(request["in1"]+".hang")
+            while True:
+                time.sleep(60)
+        try:
+            file,offset = correlate(request["in1"],request["in2"])
+            response = {"id": request.get("id"), "file": file, "offset_seconds": offset}
+        except Exception as e:
+            response = {"id": request.get("id"), "error": str(e)}
+        sys.stdout.write(json.dumps(response)+"\n")
+        sys.stdout.flush()
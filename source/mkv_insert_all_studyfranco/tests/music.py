@@ -0,0 +1,11 @@
+import numpy as np
+
+def generate_music(duration, seed, sample_rate):
+    # A note every 0.3 s with two harmonics, and a little noise
+    rng = np.random.default_rng(seed)
+    note_samples = int(0.3*sample_rate)
+    notes = 220.0*2**(rng.integers(0, 36, int(duration/0.3)+1)/12)
+    frequencies = np.repeat(notes, note_samples)[:int(duration*sample_rate)]
+    phase = 2*np.pi*np.cumsum(frequencies)/sample_rate
+    signal = np.sin(phase)+0.5*np.sin(2*phase)+0.05*rng.standard_normal(len(phase))
+    return (signal*8000).astype(np.int16)
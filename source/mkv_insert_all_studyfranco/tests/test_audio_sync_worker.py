@@ -0,0 +1,54 @@
+import sys
+from os import path
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+import audioSyncWorker
+from audioSyncWorker import audio_sync_worker_pool
+
+stand_in_cmd = [sys.executable, path.join(path.dirname(path.abspath(__file__)), "audioSyncStandIn.py")]
+
+@pytest.fixture
+def wav_files(tmp_path):
+    rng = np.random.default_rng(10)
+    signal = (np.cumsum(rng.standard_normal(48000*12))*20).astype(np.int16)
+    files = {}
+    # in1 begins 0.1 s after in2, so in2 has to be cut by 0.1 s
+    for name,data,rate in [("in1", signal[4800:48000*10], 48000), ("in2", signal[:48000*10], 48000), ("other_rate", signal[:44100*5], 44100)]:
+        files[name] = str(tmp_path / f"{name}.wav")
+        wavfile.write(files[name], rate, data)
+    return files
+
+@pytest.fixture
+def pool():
+    pool = audio_sync_worker_pool(stand_in_cmd, 1, timeout=600, max_restart=1)
+    yield pool
+    pool.close()
+
+def test_json_round_trip_and_worker_reuse(pool, wav_files):
+    data = pool.correlate(wav_files["in1"], wav_files["in2"])
+    assert data["file"] == wav_files["in2"]
+    assert data["offset_seconds"] == pytest.approx(0.1)
+    pid = pool.workers[0].process.pid
+    data = pool.correlate(wav_files["in2"], wav_files["in1"])
+    assert data["id"] == 2
+    assert data["file"] == wav_files["in2"]
+    # The same process answered the two requests
+    assert pool.workers[0].process.pid == pid
+
+def test_error_of_the_worker(pool, wav_files):
+    with pytest.raises(Exception, match="not same sample rate"):
+        pool.correlate(wav_files["in1"], wav_files["other_rate"])
+    # The worker is still used after an error response
+    assert pool.correlate(wav_files["in1"], wav_files["in2"])["file"] == wav_files["in2"]
+
+def test_restart_after_a_hang(pool, wav_files, monkeypatch):
+    monkeypatch.setattr(audioSyncWorker.audio_sync_worker, "response_poll", 0.2)
+    pool.correlate(wav_files["in1"], wav_files["in2"])
+    pid = pool.workers[0].process.pid
+    open(wav_files["in1"]+".hang", "w").close()
+    data = pool.correlate(wav_files["in1"], wav_files["in2"])
+    assert data["file"] == wav_files["in2"]
+    assert pool.workers[0].process.pid != pid
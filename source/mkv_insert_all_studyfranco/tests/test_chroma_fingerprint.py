@@ -0,0 +1,54 @@
+import io
+import shutil
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+from scipy.signal import butter, sosfilt
+
+import audioCorrelation
+from audioCorrelation import correlate_one_to_many, fingerprint_array, fingerprint_item_duration
+from chromaFingerprint import calculate_fingerprints_pcm, calculate_fingerprints_pipe, calculate_fingerprints_wav, sample_rate
+from music import generate_music
+
+fpcalc = shutil.which("fpcalc")
+length = 120
+
+def get_delayed(source, delay_in_second, rng):
+    # The target is delayed, lowpassed at 3 kHz, attenuated and noisy, like another encoding of the same audio
+    delayed = np.concatenate((np.zeros(int(delay_in_second*sample_rate)), source))[:len(source)]
+    delayed = 0.5*sosfilt(butter(8, 3000, fs=sample_rate, output='sos'), delayed) + rng.normal(0, 300, len(delayed))
+    return delayed.astype(np.int16)
+
+def test_pipe_gives_the_fingerprints_of_the_array():
+    signal = generate_music(100, 2, sample_rate)
+    reference = calculate_fingerprints_pcm(signal)
+    # Odd block sizes: the chroma frames are across the blocks
+    for block_samples in [12345, sample_rate*7+1]:
+        assert np.array_equal(calculate_fingerprints_pipe(io.BytesIO(signal.tobytes()), block_samples), reference)
+
+def test_delays_within_one_item():
+    rng = np.random.default_rng(17)
+    source = generate_music(length, 17, sample_rate)
+    fingerprint_source = calculate_fingerprints_pcm(source)
+    for delay_in_second in rng.uniform(-5, 5, 6):
+        if delay_in_second < 0:
+            corr, offset, delay = correlate_one_to_many(calculate_fingerprints_pcm(get_delayed(source, 0, rng)), [calculate_fingerprints_pcm(get_delayed(source, -delay_in_second, rng))], length)[0]
+            delay = -delay
+        else:
+            corr, offset, delay = correlate_one_to_many(fingerprint_source, [calculate_fingerprints_pcm(get_delayed(source, delay_in_second, rng))], length)[0]
+        assert corr >= 0.85
+        assert abs(delay-delay_in_second*1000) <= fingerprint_item_duration*1000
+
+@pytest.mark.skipif(fpcalc == None, reason="fpcalc is not installed")
+def test_same_delay_as_fpcalc(tmp_path):
+    rng = np.random.default_rng(18)
+    source = generate_music(length, 18, sample_rate)
+    delay_in_second = 2.5
+    wavfile.write(str(tmp_path / "source.wav"), sample_rate, source)
+    wavfile.write(str(tmp_path / "target.wav"), sample_rate, get_delayed(source, delay_in_second, rng))
+    delays = []
+    for calculate in [lambda filename: fingerprint_array(audioCorrelation.calculate_fingerprints(filename, length)), lambda filename: calculate_fingerprints_wav(filename, length)]:
+        corr, offset, delay = correlate_one_to_many(calculate(str(tmp_path / "source.wav")), [calculate(str(tmp_path / "target.wav"))], length)[0]
+        delays.append(delay)
+    assert abs(delays[0]-delays[1]) <= fingerprint_item_duration*1000
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from scipy.signal import lfilter
+
+from audioCorrelation import corrabs, corrabs_lean
+
+def get_file_offset(lag, fs):
+    # Same file and offset as second_correlation_signals
+    if lag < 0:
+        return "in2", -lag/fs
+    else:
+        return "in1", lag/fs
+
+def test_corrabs_lean_gives_the_offsets_of_corrabs():
+    rng = np.random.default_rng(5)
+    for trial in range(30):
+        ls1 = int(rng.integers(20000, 90000))
+        ls2 = int(rng.integers(20000, 90000))
+        shift = int(rng.integers(-8000, 8000))
+        # Leaky integrated noise: most of the power in the low frequencies, like music
+        signal = (lfilter([1.0], [1.0, -0.95], rng.standard_normal(max(ls1, ls2)+20000))*1000).astype(np.int16)
+        s1 = signal[10000+shift:10000+shift+ls1]
+        s2 = (signal[10000:10000+ls2] + rng.normal(0, 200, ls2)).astype(np.int16)
+        ls1,ls2,padsize,xmax,ca = corrabs(s1, s2)
+        # The old xmax to (file, offset) conversion of second_correlation
+        if xmax > padsize/2:
+            reference = ("in2", (padsize-xmax)/48000)
+        else:
+            reference = ("in1", xmax/48000)
+        lag, value = corrabs_lean(s1, s2)
+        assert get_file_offset(lag, 48000) == reference
+        assert value == pytest.approx(float(ca[xmax]), rel=1e-3)
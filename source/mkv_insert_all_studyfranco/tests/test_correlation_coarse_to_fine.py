@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import audioCorrelation
+from audioCorrelation import corrabs_lean, corrabs_coarse_to_fine, get_max_corr_coarse_to_fine, score_offsets, min_overlap
+
+def add_bit_noise(rng, fingerprints, probability):
+    flips = np.packbits(rng.random((len(fingerprints), 32)) < probability, axis=1, bitorder='little').view(np.uint32).ravel()
+    return fingerprints ^ flips
+
+def generate_fingerprints(rng, length, shift, period=None):
+    # The target is the source delayed by shift items, both with independent bit noise.
+    # With a period, the content is looped, so a lot of offsets have almost the same score.
+    if period == None:
+        base = rng.integers(0, 2**32, length+300, dtype=np.uint64).astype(np.uint32)
+    else:
+        base = np.tile(rng.integers(0, 2**32, period, dtype=np.uint64).astype(np.uint32), (length+300)//period+1)
+    noise = rng.uniform(0.05, 0.35)
+    source = add_bit_noise(rng, base[150+shift:150+shift+length], noise)
+    target = add_bit_noise(rng, base[150:150+length], noise)
+    return source, target
+
+@pytest.mark.parametrize("period", [None, 20, 37, 59])
+def test_fingerprint_coarse_to_fine_is_the_exhaustive_search(period):
+    rng = np.random.default_rng(6 if period == None else period)
+    for trial in range(60):
+        source, target = generate_fingerprints(rng, int(rng.integers(150, 800)), int(rng.integers(-100, 100)), period)
+        span = len(source) - min_overlap
+        offsets = range(-span, span + 1)
+        corr = score_offsets(source, target[None, :], offsets)[0]
+        max_corr_index = int(np.argmax(corr))
+        assert get_max_corr_coarse_to_fine(source, target[None, :], offsets)[0] == (float(corr[max_corr_index]), offsets[max_corr_index])
+
+def generate_audio(rng, length):
+    # Brown noise (music like spectrum) with a few tones
+    time = np.arange(length)/48000.0
+    signal = np.cumsum(rng.standard_normal(length))
+    signal -= np.convolve(signal, np.ones(4801)/4801, mode='same')
+    for frequency in rng.uniform(100, 2000, 3):
+        signal += 20*np.sin(2*np.pi*frequency*time)
+    return (signal/np.abs(signal).max()*12000).astype(np.int16)
+
+def test_audio_coarse_to_fine_is_corrabs_lean():
+    rng = np.random.default_rng(6)
+    for trial in range(10):
+        length = int(rng.integers(5, 15))*48000
+        shift = int(rng.integers(-48000, 48000))
+        signal = generate_audio(rng, length+96000)
+        s1 = signal[48000+shift:48000+shift+length]
+        s2 = (signal[48000:48000+length] + rng.normal(0, 300, length)).astype(np.int16)
+        lag, value = corrabs_coarse_to_fine(s1, s2)
+        lag_lean, value_lean = corrabs_lean(s1, s2)
+        assert lag == lag_lean == -shift
+        assert value == pytest.approx(value_lean, rel=1e-3)
+
+def test_audio_coarse_to_fine_short_window_falls_back_to_corrabs_lean():
+    rng = np.random.default_rng(7)
+    signal = generate_audio(rng, audioCorrelation.coarse_decimation*4096-1)
+    assert corrabs_coarse_to_fine(signal, signal) == corrabs_lean(signal, signal)
@@ -0,0 +1,29 @@
+import shutil
+import subprocess
+
+import pytest
+from scipy.io import wavfile
+
+from audioCorrelation import corrabs_lean
+
+ffmpeg = shutil.which("ffmpeg")
+
+@pytest.mark.skipif(ffmpeg == None, reason="ffmpeg is not installed")
+def test_input_seeking_extract_the_same_audio_as_output_seeking(tmp_path):
+    # Two audio streams of noise, in a matroska like the files of the plugin
+    media = str(tmp_path / "media.mkv")
+    subprocess.run([ffmpeg, "-y", "-nostdin", "-f", "lavfi", "-i", "anoisesrc=d=120:c=pink:r=48000:s=1", "-f", "lavfi", "-i", "anoisesrc=d=120:c=brown:r=48000:s=2",
+                    "-map", "0", "-map", "1", "-c:a", "flac", media], check=True, capture_output=True)
+    codec_param = ["-c:a", "pcm_s16le", "-ar", "48000", "-ac", "1"]
+    for begin,length in [("00:00:10.0", "00:00:20"), ("00:01:13.5", "00:00:30")]:
+        cmd = [ffmpeg, "-y", "-nostdin", "-ss", begin, "-t", length, "-i", media]
+        for stream in ["0", "1"]:
+            subprocess.run([ffmpeg, "-y", "-nostdin", "-i", media, "-ss", begin, "-t", length, "-map", "0:"+stream]+codec_param+[str(tmp_path / f"before.{stream}.wav")], check=True, capture_output=True)
+            cmd.extend(["-map", "0:"+stream]+codec_param+[str(tmp_path / f"now.{stream}.wav")])
+        subprocess.run(cmd, check=True, capture_output=True)
+        for stream in ["0", "1"]:
+            fs_before,before = wavfile.read(str(tmp_path / f"before.{stream}.wav"))
+            fs_now,now = wavfile.read(str(tmp_path / f"now.{stream}.wav"))
+            assert fs_before == fs_now
+            assert abs(len(before)-len(now)) <= 1
+            assert corrabs_lean(before, now)[0] == 0
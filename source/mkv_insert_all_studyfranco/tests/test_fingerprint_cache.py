@@ -0,0 +1,43 @@
+import sqlite3
+
+import numpy as np
+
+from fingerprintCache import fingerprint_cache
+
+def get_last_access(database_path, key):
+    connection = sqlite3.connect(database_path)
+    try:
+        return connection.execute("SELECT last_access FROM fingerprints WHERE key = ?", (key,)).fetchone()[0]
+    finally:
+        connection.close()
+
+def test_hits_are_written_by_batch(tmp_path):
+    database_path = str(tmp_path / "cache.db")
+    cache = fingerprint_cache(database_path, 1 << 20)
+    fingerprint = np.arange(100, dtype=np.uint32)
+    cache.put("a", fingerprint)
+    put_access = get_last_access(database_path, "a")
+    total_changes = cache.connection.total_changes
+    for i in range(10):
+        assert np.array_equal(cache.get("a"), fingerprint)
+    assert cache.get("b") is None
+    # No write on the hits
+    assert cache.connection.total_changes == total_changes
+    assert get_last_access(database_path, "a") == put_access
+    cache.close()
+    assert get_last_access(database_path, "a") > put_access
+
+def test_eviction_sees_the_hits_not_written(tmp_path):
+    database_path = str(tmp_path / "cache.db")
+    fingerprint = np.arange(100, dtype=np.uint32)
+    # Room for two fingerprints
+    cache = fingerprint_cache(database_path, 2*fingerprint.nbytes)
+    cache.put("old", fingerprint)
+    cache.put("recent", fingerprint)
+    # "old" is used again, so "recent" is the least recently used
+    cache.get("old")
+    cache.put("new", fingerprint)
+    assert cache.get("old") is not None
+    assert cache.get("recent") is None
+    assert cache.get("new") is not None
+    cache.close()
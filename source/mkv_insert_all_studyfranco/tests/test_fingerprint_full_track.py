@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from audioCorrelation import correlate_one_to_many, slice_fingerprints, fingerprint_item_duration
+from chromaFingerprint import calculate_fingerprints_pcm, sample_rate
+from music import generate_music
+
+delay_in_second = 2.5
+cut_length = 30
+cut_begins = [20, 60, 100, 140]
+
+@pytest.fixture(scope="module")
+def signals():
+    source = generate_music(200, 1, sample_rate)
+    target = np.concatenate((np.zeros(int(delay_in_second*sample_rate), dtype=np.int16), source))[:len(source)]
+    return source, target
+
+def get_cut(signal, begin):
+    return signal[int(begin*sample_rate):int((begin+cut_length)*sample_rate)]
+
+def test_sliced_fingerprints_give_the_per_cut_delays(signals):
+    source, target = signals
+    full_source = calculate_fingerprints_pcm(source)
+    full_target = calculate_fingerprints_pcm(target)
+    for begin in cut_begins:
+        corr_cut, offset_cut, delay_cut = correlate_one_to_many(calculate_fingerprints_pcm(get_cut(source, begin)), [calculate_fingerprints_pcm(get_cut(target, begin))], cut_length)[0]
+        corr_sliced, offset_sliced, delay_sliced = correlate_one_to_many(slice_fingerprints(full_source, begin, cut_length), [slice_fingerprints(full_target, begin, cut_length)], cut_length)[0]
+        assert corr_sliced > 0.9 and corr_cut > 0.9
+        # Same offset in fingerprint items on each cut
+        assert offset_sliced == offset_cut
+        # The ms by item is cut_length/items: the per-cut fingerprints lose items at the edges (warm-up of chromaprint),
+        # so their delay is a bit longer than the sliced one, which is on the real item duration
+        assert abs(delay_sliced-delay_in_second*1000) <= fingerprint_item_duration*1000
+        # About 20 items less on 240: the per-cut delay is up to 10 % longer
+        assert abs(delay_cut-delay_in_second*1000) <= 0.1*delay_in_second*1000
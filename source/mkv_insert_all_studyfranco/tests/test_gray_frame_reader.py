@@ -0,0 +1,55 @@
+import stat
+import sys
+
+import pytest
+
+import tools
+import video
+
+width = 16
+height = 8
+
+fake_ffmpeg = f'''#!{sys.executable}
+# Gray frames of the -vf scale size during -t seconds at 25 fps, exit code 1 when the input name contains "error"
+import sys
+arguments = sys.argv
+width,height = [int(value) for value in arguments[arguments.index("-vf")+1].split("scale=")[1].split(",")[0].split(":")]
+for frame in range(int(float(arguments[arguments.index("-t")+1])*25)):
+    sys.stdout.buffer.write(bytes([frame % 256])*(width*height))
+sys.stdout.buffer.flush()
+if "error" in arguments[arguments.index("-i")+1]:
+    sys.stderr.write("decoding error\\n")
+    sys.exit(1)
+'''
+
+@pytest.fixture
+def ffmpeg(tmp_path, monkeypatch):
+    ffmpeg_path = tmp_path / "ffmpeg"
+    ffmpeg_path.write_text(fake_ffmpeg)
+    ffmpeg_path.chmod(ffmpeg_path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setitem(tools.software, "ffmpeg", str(ffmpeg_path))
+
+def get_reader(file_path, duration):
+    return video.gray_frame_reader(video.get_gray_frame_cmd(file_path, 0, 0, duration, f"scale={width}:{height}"), width, height)
+
+def test_close_after_the_first_frame(ffmpeg):
+    # ffmpeg is blocked on the full pipe: it is stopped and its exit code is not an error
+    reader = get_reader("video.mkv", 1000)
+    assert reader.read_frame()[0,0] == 0
+    reader.close()
+    assert reader.process.returncode != 0
+
+def test_read_to_the_end(ffmpeg):
+    reader = get_reader("video.mkv", 2)
+    frames = 0
+    while reader.read_frame() is not None:
+        frames += 1
+    reader.close()
+    assert frames == 50
+
+def test_error_at_the_end_of_the_stream(ffmpeg):
+    reader = get_reader("error.mkv", 1)
+    while reader.read_frame() is not None:
+        pass
+    with pytest.raises(Exception, match="decoding error"):
+        reader.close()
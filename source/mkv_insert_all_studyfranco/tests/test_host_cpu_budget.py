@@ -0,0 +1,51 @@
+import fcntl
+import threading
+import time
+from os import path, sched_getaffinity
+
+import tools
+from hostCpuBudget import host_cpu_budget
+
+def test_threads_of_the_commands():
+    assert tools.get_cmd_threads(["ffmpeg", "-threads", "5", "-i", "in.mkv"]) == 5
+    assert tools.get_cmd_threads(["ffmpeg", "-threads", str(len(sched_getaffinity(0))), "-i", "in.mkv"]) == len(sched_getaffinity(0))
+    assert tools.get_cmd_threads(["ffmpeg", "-threads", "0", "-i", "in.mkv"]) == len(sched_getaffinity(0))
+    assert tools.get_cmd_threads(["ffmpeg", "-filter_complex", "libvmaf=n_threads=4:log_fmt=json", "-threads", "2"]) == 4
+    assert tools.get_cmd_threads(["mkvmerge", "-o", "out.mkv"]) == 1
+
+def acquire_in_thread(budget, tokens):
+    result = {}
+    def acquire():
+        result["slots"] = budget.acquire(tokens)
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    return thread,result
+
+def test_the_guard_is_not_held_during_the_wait(tmp_path):
+    budget = host_cpu_budget(str(tmp_path), 4)
+    slots_taken = budget.acquire(3)
+    thread,result = acquire_in_thread(budget, 4)
+    time.sleep(0.3)
+    assert thread.is_alive()
+    with open(path.join(str(tmp_path), "guard"), "a") as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    budget.release(slots_taken)
+    thread.join(5)
+    assert len(result["slots"]) == 4
+    budget.release(result["slots"])
+
+def test_all_the_tokens_or_none_without_the_reservation(tmp_path):
+    budget = host_cpu_budget(str(tmp_path), 4)
+    reservation = budget.try_reservation()
+    slots_taken = budget.acquire(3)
+    thread,result = acquire_in_thread(budget, 2)
+    time.sleep(0.3)
+    # The waiting command does not keep the free token
+    slots_small = budget.acquire(1)
+    assert thread.is_alive()
+    budget.release(slots_taken)
+    thread.join(5)
+    assert len(result["slots"]) == 2
+    budget.release(result["slots"]+slots_small)
+    reservation.close()
+    assert budget.number_commands.value == 3
@@ -0,0 +1,88 @@
+import re
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+from scipy.signal import lfilter
+
+import tools
+from loudness import get_biquad_filters, integrated_loudness, normalise_wav_file
+
+sample_rate = 48000
+ffmpeg = shutil.which(tools.software["ffmpeg"])
+
+def get_signals():
+    # Tones, noises and a bass heavy mix, mono and stereo, in float at several levels
+    rng = np.random.default_rng(13)
+    time = np.arange(sample_rate*20)/sample_rate
+    white = rng.standard_normal(len(time))
+    pink = lfilter([0.049922035, -0.095993537, 0.050612699, -0.004408786], [1, -2.494956002, 2.017265875, -0.522189400], white)
+    bursts = np.repeat(rng.random(40) < 0.5, len(time)//40)*np.sin(2*np.pi*440*time)
+    return {
+        "sine 1 kHz": 0.1*np.sin(2*np.pi*1000*time),
+        "sine 100 Hz": 0.3*np.sin(2*np.pi*100*time),
+        "white noise": 0.05*white,
+        "pink noise": 0.5*pink/np.abs(pink).max(),
+        "bursts with silence": 0.2*bursts,
+        "bass and voice": 0.3*np.sin(2*np.pi*40*time)+0.1*np.sin(2*np.pi*180*time)*(1+np.sin(2*np.pi*3*time)),
+        "stereo": np.stack((0.1*np.sin(2*np.pi*1000*time), 0.05*white), axis=1),
+    }
+
+def test_reference_sine():
+    # BS.1770: a 1 kHz sine at 0 dBFS on one channel is -3.01 LKFS, on two channels 0 LKFS
+    time = np.arange(sample_rate*10)/sample_rate
+    sine = np.power(10.0, -20/20)*np.sin(2*np.pi*1000*time)
+    assert integrated_loudness(sine, sample_rate) == pytest.approx(-23.01, abs=0.05)
+    assert integrated_loudness(np.stack((sine, sine), axis=1), sample_rate) == pytest.approx(-20.0, abs=0.05)
+    # The same value for the PCM integers
+    assert integrated_loudness((sine*32767).astype(np.int16), sample_rate) == pytest.approx(-23.01, abs=0.05)
+    assert integrated_loudness(np.zeros(sample_rate*2), sample_rate) == None
+
+def test_same_loudness_as_pyloudnorm():
+    pyloudnorm = pytest.importorskip("pyloudnorm")
+    meter = pyloudnorm.Meter(sample_rate)
+    for name,signal in get_signals().items():
+        assert integrated_loudness(signal, sample_rate) == pytest.approx(meter.integrated_loudness(signal), abs=0.1), name
+
+@pytest.mark.skipif(ffmpeg == None, reason="ffmpeg is not installed")
+def test_same_loudness_as_ffmpeg_ebur128(tmp_path):
+    for name,signal in get_signals().items():
+        file_path = str(tmp_path / "signal.wav")
+        wavfile.write(file_path, sample_rate, signal.astype(np.float32))
+        stderror = subprocess.run([ffmpeg, "-nostats", "-nostdin", "-i", file_path, "-af", "ebur128", "-f", "null", "-"], capture_output=True, text=True).stderr
+        loudness_ffmpeg = float(re.findall(r"I:\s+(-?[\d.]+) LUFS", stderror)[-1])
+        assert integrated_loudness(signal, sample_rate) == pytest.approx(loudness_ffmpeg, abs=0.1), name
+
+def test_normalisation_measured_before_the_filters(tmp_path):
+    # Like normalise_file: the gain comes from the loudness of the unfiltered audio, then the filters and the gain are applied
+    signal = (get_signals()["bass and voice"]*32767).astype(np.int16)
+    file_path = str(tmp_path / "signal.wav")
+    wavfile.write(file_path, sample_rate, signal)
+    gain_db = normalise_wav_file(file_path, "-23.0", 60, 16000)
+    assert gain_db == pytest.approx(-23.0-integrated_loudness(signal, sample_rate))
+    expected = signal.astype(np.float64)
+    for b,a in get_biquad_filters(sample_rate, 60, 16000):
+        expected = lfilter(b, a, expected)
+    expected = np.clip(np.rint(expected*np.power(10.0, gain_db/20.0)), -32768, 32767)
+    assert np.abs(wavfile.read(file_path)[1]-expected).max() <= 1
+
+def test_filters_without_gain(tmp_path):
+    # Already at the target: the filters are still applied, the lowpass over the Nyquist frequency is not
+    time = np.arange(11025*10)/11025
+    signal = (0.1*np.sin(2*np.pi*1000*time)*32767).astype(np.int16)
+    file_path = str(tmp_path / "signal.wav")
+    wavfile.write(file_path, 11025, signal)
+    assert len(get_biquad_filters(11025, 60, 16000)) == 1
+    assert normalise_wav_file(file_path, "-23.0", 60, 16000) == 0.0
+    b,a = get_biquad_filters(11025, 60, None)[0]
+    assert np.abs(wavfile.read(file_path)[1]-np.rint(lfilter(b, a, signal.astype(np.float64)))).max() <= 1
+
+@pytest.mark.skipif(ffmpeg == None, reason="ffmpeg is not installed")
+def test_same_filters_as_ffmpeg(tmp_path):
+    signal = (get_signals()["pink noise"]*32767).astype(np.int16)
+    wavfile.write(str(tmp_path / "signal.wav"), sample_rate, signal)
+    subprocess.run([ffmpeg, "-y", "-nostdin", "-i", str(tmp_path / "signal.wav"), "-af", "highpass=f=60,lowpass=f=16000", "-c:a", "pcm_s16le", str(tmp_path / "ffmpeg.wav")], check=True, capture_output=True)
+    normalise_wav_file(str(tmp_path / "signal.wav"), "-23.0", 60, 16000, min_gain=1000)
+    assert np.abs(wavfile.read(str(tmp_path / "signal.wav"))[1].astype(np.int32)-wavfile.read(str(tmp_path / "ffmpeg.wav"))[1]).max() <= 2
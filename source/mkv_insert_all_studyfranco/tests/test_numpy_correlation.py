@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import audioCorrelation
+from audioCorrelation import compare, correlate_one_to_many, get_max_corr, min_overlap
+from chromaFingerprint import calculate_fingerprints_pcm, sample_rate
+from music import generate_music
+
+popcount_table = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+
+def popcount_with_table(values):
+    return popcount_table[values & 0xFFFF] + popcount_table[values >> 16]
+
+@pytest.fixture(params=["popcount", "popcount_table"])
+def numpy_engine(request, monkeypatch):
+    # Same results with numpy.bitwise_count and with the table used by the numpy versions without it
+    monkeypatch.setattr(audioCorrelation.tools, "coarse_to_fine", False)
+    if request.param == "popcount_table":
+        monkeypatch.setattr(audioCorrelation, "popcount", popcount_with_table)
+
+def get_reference(fingerprint_source, fingerprint_target, lengthFile):
+    # The pure python correlation, like correlate() before the numpy engine
+    span = min(len(fingerprint_source), len(fingerprint_target)) - min_overlap
+    corr = compare(fingerprint_source, fingerprint_target, span, audioCorrelation.step)
+    return get_max_corr(corr, None, None, span, int(lengthFile/len(fingerprint_source)*1000))
+
+def get_random_fingerprints(rng, length):
+    return [int(value) for value in rng.integers(0, 2**32, length, dtype=np.uint64)]
+
+def test_random_fingerprints(numpy_engine):
+    rng = np.random.default_rng(1)
+    for length_source,length_target in [(300, 300), (250, 400), (400, 180), (60, 90)]:
+        fingerprint_source = get_random_fingerprints(rng, length_source)
+        fingerprints_target = [get_random_fingerprints(rng, length_target) for i in range(3)]
+        # A shifted copy with bits changed, the maximum is not at the first offset
+        fingerprints_target.append([value ^ int(rng.integers(0, 2**32)) & 0x01010101 for value in fingerprint_source[17:17+length_target]])
+        results = correlate_one_to_many(fingerprint_source, fingerprints_target, 60)
+        for fingerprint_target,result in zip(fingerprints_target, results):
+            assert result == get_reference(fingerprint_source, fingerprint_target, 60)
+
+def test_music_fingerprints(numpy_engine):
+    rng = np.random.default_rng(2)
+    length = 40
+    source = generate_music(length, 3, sample_rate)
+    fingerprint_source = [int(value) for value in calculate_fingerprints_pcm(source)]
+    fingerprints_target = []
+    for delay in [0, 3000, 25000]:
+        delayed = np.concatenate((np.zeros(delay, dtype=np.int16), source))[:len(source)]
+        fingerprints_target.append([int(value) for value in calculate_fingerprints_pcm((delayed + rng.normal(0, 300, len(delayed))).astype(np.int16))])
+    # Another music: no clear maximum
+    fingerprints_target.append([int(value) for value in calculate_fingerprints_pcm(generate_music(length, 4, sample_rate))])
+    results = correlate_one_to_many(fingerprint_source, fingerprints_target, length)
+    for fingerprint_target,result in zip(fingerprints_target, results):
+        assert result == get_reference(fingerprint_source, fingerprint_target, length)
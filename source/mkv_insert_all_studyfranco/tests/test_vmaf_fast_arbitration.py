@@ -0,0 +1,17 @@
+import numpy as np
+
+import video
+from vmaf_simulation import simulate
+
+def test_fast_arbitration_decisions_on_a_simulated_corpus():
+    gaps, decisions_full, decisions_fast, cuts_fast = simulate(2000, 23)
+    different = decisions_full != decisions_fast
+    assert different.mean() < 0.05
+    # The wrong decisions are on the close pairs, where the choice matters little
+    assert different[np.abs(gaps) > 2].mean() < 0.01
+    assert video.fast_vmaf_min_cuts <= cuts_fast.min() and cuts_fast.mean() < video.number_cut
+
+def test_fast_arbitration_stops_after_the_minimum_cuts_on_a_clear_gap():
+    assert video.is_quality_gap_clear([95.0, 95.2], [90.0, 90.1])
+    assert not video.is_quality_gap_clear([95.0], [90.0])
+    assert not video.is_quality_gap_clear([95.0, 90.0], [90.0, 95.1])
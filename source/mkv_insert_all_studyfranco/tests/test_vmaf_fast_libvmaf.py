@@ -0,0 +1,20 @@
+import pytest
+
+from vmaf_clips import encode_clips, get_vmaf_scores, has_libvmaf
+
+pytestmark = pytest.mark.skipif(not has_libvmaf(), reason="ffmpeg with libvmaf and libx264 is not installed")
+
+duration = 2
+
+@pytest.fixture(scope="module")
+def clips(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("vmaf_clips")
+    return str(folder),encode_clips(str(folder), [18, 26, 34, 42], duration)
+
+@pytest.mark.parametrize("crf_1,crf_2", [(18, 34), (34, 18), (26, 42), (42, 26)])
+def test_fast_mode_takes_the_decision_of_the_full_mode(clips, crf_1, crf_2):
+    folder,clips_by_crf = clips
+    full = get_vmaf_scores(folder, clips_by_crf[crf_1], clips_by_crf[crf_2], duration, False)
+    fast = get_vmaf_scores(folder, clips_by_crf[crf_1], clips_by_crf[crf_2], duration, True)
+    # get_best_quality_video chooses the first video when its direction has the highest score
+    assert (full[0] >= full[1]) == (fast[0] >= fast[1])
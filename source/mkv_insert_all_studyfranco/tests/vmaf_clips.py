@@ -0,0 +1,37 @@
+import shutil
+import subprocess
+from os import path
+from types import SimpleNamespace
+
+import tools
+import video
+
+def has_libvmaf():
+    # ffmpeg with the libvmaf filter and the libx264 encoder
+    if shutil.which(tools.software["ffmpeg"]) == None:
+        return False
+    filters = subprocess.run([tools.software["ffmpeg"], "-hide_banner", "-filters"], capture_output=True, text=True).stdout
+    encoders = subprocess.run([tools.software["ffmpeg"], "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    return " libvmaf " in filters and " libx264 " in encoders
+
+def encode_clips(folder, crfs, duration, size="1920x1080"):
+    # The same synthetic source encoded at each CRF
+    clips = {}
+    for crf in crfs:
+        clips[crf] = path.join(folder, f"testsrc2_crf{crf}.mkv")
+        subprocess.run([tools.software["ffmpeg"], "-nostdin", "-y", "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25:duration={duration}",
+                        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf), "-pix_fmt", "yuv420p", clips[crf]],
+                       check=True, capture_output=True)
+    return clips
+
+def get_vmaf_scores(folder, clip_1, clip_2, duration, fast):
+    # The two directions of get_best_quality_video on one cut, in the full or the fast mode
+    video_obj_1 = SimpleNamespace(filePath=clip_1, video={"StreamOrder": "0"})
+    video_obj_2 = SimpleNamespace(filePath=clip_2, video={"StreamOrder": "0"})
+    filter_modifications = []
+    vmaf_options = ""
+    if fast:
+        filter_modifications,vmaf_options = video.get_vmaf_fast_options(filter_modifications)
+    log_paths = [path.join(folder, "vmaf_1_vs_2.json"), path.join(folder, "vmaf_2_vs_1.json")]
+    tools.launch_cmdExt(video.get_vmaf_dual_cmd(video_obj_1, video_obj_2, ("0", "0"), str(duration), filter_modifications, log_paths[0], log_paths[1], vmaf_options))
+    return [video.get_vmaf_score(log_path) for log_path in log_paths]
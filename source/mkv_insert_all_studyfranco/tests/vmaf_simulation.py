@@ -0,0 +1,50 @@
+'''
+Simulated corpus for the VMAF arbitration: get_best_quality_video runs on scores drawn from a model instead of libvmaf.
+The true gap (1 vs 2 minus 2 vs 1) is uniform in [-max_gap, max_gap], each cut adds a noise of cut_deviation.
+The fast mode (small size, subsampled frames) shrinks the gap by fast_shrink and adds a noise of fast_deviation.
+'''
+import numpy as np
+
+import tools
+import video
+
+max_gap = 4.0
+cut_deviation = 1.0
+fast_shrink = 0.8
+fast_deviation = 0.5
+
+def simulate(number_pairs, seed):
+    '''
+    Return the true gaps, the decisions of the full and fast modes and the number of cuts done by the fast mode.
+    '''
+    rng = np.random.default_rng(seed)
+    launch_vmaf_dual = video.launch_vmaf_dual
+    get_vmaf_dual_scores = video.get_vmaf_dual_scores
+    get_quality_filter_modifications = video.get_quality_filter_modifications
+    vmaf_fast_arbitration = tools.vmaf_fast_arbitration
+    gaps = rng.uniform(-max_gap, max_gap, number_pairs)
+    decisions_full = []
+    decisions_fast = []
+    cuts_fast = []
+    try:
+        video.get_vmaf_dual_scores = lambda scores, log_paths: scores
+        video.get_quality_filter_modifications = lambda video_obj_1, video_obj_2: []
+        for gap in gaps:
+            differences = gap + rng.normal(0, cut_deviation, video.number_cut)
+            differences_fast = fast_shrink*differences + rng.normal(0, fast_deviation, video.number_cut)
+            for fast,decisions in [(False, decisions_full), (True, decisions_fast)]:
+                cuts_done = []
+                def launch(video_obj_1, video_obj_2, cut_number, begins, time_by_test, filter_modifications, vmaf_options):
+                    cuts_done.append(cut_number)
+                    difference = (differences_fast if fast else differences)[cut_number]
+                    return (90.0+difference/2, 90.0-difference/2),None
+                video.launch_vmaf_dual = launch
+                tools.vmaf_fast_arbitration = fast
+                decisions.append(video.get_best_quality_video(None, None, [None]*video.number_cut, 1))
+            cuts_fast.append(len(cuts_done))
+    finally:
+        video.launch_vmaf_dual = launch_vmaf_dual
+        video.get_vmaf_dual_scores = get_vmaf_dual_scores
+        video.get_quality_filter_modifications = get_quality_filter_modifications
+        tools.vmaf_fast_arbitration = vmaf_fast_arbitration
+    return gaps,np.array(decisions_full),np.array(decisions_fast),np.array(cuts_fast)